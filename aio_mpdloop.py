@@ -0,0 +1,208 @@
+import asyncio
+import functools
+from typing import Optional
+
+import mpd_async
+import mpdloop
+from my_aiompd import Client, MPDError
+
+
+class _TaskFuture(mpd_async.Future):
+    """An mpd_async Future for the result of an asyncio task.  Cancelling it cancels the task.
+    """
+    def __init__(self, loop, task: asyncio.Task):
+        super().__init__(loop)
+        self._task = task
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task):
+        if self._done:
+            return
+        if task.cancelled():
+            self.set_exception(asyncio.CancelledError)
+        elif task.exception() is not None:
+            self.set_exception(task.exception())
+        else:
+            self.set_result(task.result())
+
+    def cancel(self):
+        self._task.cancel()
+        super().cancel()
+
+
+class _ClientShim:
+    """What mpd_async coroutines see as loop.client.  Its pending_messages is laid out the same as
+    mpdclient.MPDClient's, and it has the same C2C methods, except that they're done over the my_aiompd client and so
+    have to be awaited:
+
+        await loop.client.subscribe('jukebox')
+        async for message in mpd_async.ChannelMessages('jukebox'):
+            ...
+
+    There's no read_messages(): the client reads them as soon as they arrive.
+    """
+    def __init__(self, mpd_loop: 'AsyncioMPDLoop', client: Client):
+        self._mpd_loop = mpd_loop
+        self._client = client
+        # mapping channel names to the deques of messages the client has retrieved from the server for us
+        self.pending_messages = {}
+        self._channel_subscriptions = {}
+
+    @property
+    def subscriptions(self):
+        return self._channel_subscriptions.keys()
+
+    def do_command(self, command, *args) -> mpd_async.Future:
+        return self._mpd_loop.wrap(self._client.send_command(command, *args))
+
+    def subscribe(self, channel) -> mpd_async.Future:
+        return self._mpd_loop.wrap(self._subscribe(channel))
+
+    def unsubscribe(self, channel):
+        subscription = self._channel_subscriptions.pop(channel, None)
+        if subscription is not None:
+            subscription.close()
+            del self.pending_messages[channel]
+
+    def send_message(self, channel, message) -> mpd_async.Future:
+        return self.do_command('sendmessage', channel, message)
+
+    async def _subscribe(self, channel):
+        if channel in self._channel_subscriptions:
+            return
+        subscription = await self._client.subscribe_channel(channel)
+        if channel in self._channel_subscriptions:
+            # lost a race with another subscribe()
+            subscription.close()
+            return
+        self._channel_subscriptions[channel] = subscription
+        self.pending_messages[channel] = subscription.messages
+
+    def close(self):
+        for channel in list(self._channel_subscriptions):
+            self.unsubscribe(channel)
+
+
+class AsyncioMPDLoop(mpdloop.BaseMPDLoop):
+    """Runs mpd_async coroutines on an asyncio event loop, alongside everything else on it, instead of on an MPDLoop of
+    their own with its own connection and its own thread.  Idle events come from an IdleSubscription on `client`, which
+    is shared with whatever else is using it.
+
+        mpd_loop = AsyncioMPDLoop(client)
+        result = await mpd_loop.run_coroutine(some_mpd_async_coroutine())
+    """
+    def __init__(self, client: Client, loop: Optional[asyncio.AbstractEventLoop] = None):
+        super().__init__()
+        self._loop = loop or asyncio.get_event_loop()
+        self._client = client
+        self.client = _ClientShim(self, client)
+        self._subscription = None  # covers exactly _wanted_subsystems(), or None if nobody is waiting for anything
+        self._resubscribe_handle: Optional[asyncio.Handle] = None
+        self._watcher: Optional[asyncio.Task] = None
+        self._get: Optional[asyncio.Task] = None  # the watcher's current wait on self._subscription
+        # changes reported to a subscription that has since been replaced, which the watcher hasn't handed out yet
+        self._carried_over = set()
+
+    def call_soon(self, seconds, func, *args, **kw):
+        if kw:
+            func = functools.partial(func, **kw)
+        if seconds <= 0:
+            return self._loop.call_soon(func, *args)
+        return self._loop.call_later(seconds, func, *args)
+
+    def cancel(self, waiter):
+        if isinstance(waiter, asyncio.Handle):
+            waiter.cancel()
+        else:
+            super().cancel(waiter)
+
+    def create_task(self, coro) -> mpd_async.Task:
+        """Start running an mpd_async coroutine.
+        """
+        return mpd_async.Task(coro, self)
+
+    def wrap(self, awaitable) -> mpd_async.Future:
+        """Run an asyncio coroutine or future as a task, and return an mpd_async Future for its result, so that mpd_async
+        coroutines can await it.
+        """
+        return _TaskFuture(self, asyncio.ensure_future(awaitable, loop=self._loop))
+
+    async def run_coroutine(self, coro):
+        """Run an mpd_async coroutine to completion and return its result.  Cancelling this cancels the coroutine.
+        """
+        task = self.create_task(coro)
+        fut = self._loop.create_future()
+
+        def done(task):
+            if fut.done():
+                return
+            if task.exception() is not None:
+                fut.set_exception(task.exception())
+            else:
+                fut.set_result(task.result())
+
+        task.add_done_callback(done)
+        try:
+            return await fut
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+
+    def close(self):
+        if self._resubscribe_handle is not None:
+            self._resubscribe_handle.cancel()
+            self._resubscribe_handle = None
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+        if self._get is not None:
+            self._get.cancel()
+        if self._subscription is not None:
+            self._subscription.close()
+            self._subscription = None
+        self.client.close()
+
+    def _subsystems_changed(self):
+        # Waiters come and go in bunches (every task that wakes up takes its waiter out and usually puts a new one in
+        # straight away), so only look at what's changed once they've all had their turn.
+        if self._resubscribe_handle is None:
+            self._resubscribe_handle = self._loop.call_soon(self._resubscribe)
+
+    def _resubscribe(self):
+        self._resubscribe_handle = None
+        subsystems = self._wanted_subsystems()
+        old = self._subscription
+        if old is not None and old.subsystems == subsystems:
+            return
+        # Subscribe to the new set before dropping the old one, so the client's idle loop just gets told about the
+        # difference instead of stopping and starting again.
+        self._subscription = self._client.subscribe_idle(*subsystems) if subsystems else None
+        if old is not None:
+            self._carried_over.update(old.get_nowait())
+            old.close()
+            if self._get is not None:
+                self._get.cancel()
+        if self._subscription is not None and (self._watcher is None or self._watcher.done()):
+            self._watcher = self._loop.create_task(self._watch())
+
+    async def _watch(self):
+        while self._subscription is not None:
+            if self._carried_over:
+                changed, self._carried_over = sorted(self._carried_over), set()
+            else:
+                # In a task of its own so _resubscribe() can cancel the wait without cancelling this.
+                get = self._get = self._loop.create_task(self._subscription.get())
+                try:
+                    await asyncio.wait([get])
+                finally:
+                    self._get = None
+                if get.cancelled():
+                    continue
+                try:
+                    changed = get.result()
+                except (MPDError, ConnectionError):
+                    # The client reconnects by itself, and the next get() starts its idle loop back up.
+                    await asyncio.sleep(self._client.reconnect_delay_min)
+                    continue
+            # (any messages are already in pending_messages: the client reads them before telling subscriptions)
+            self._dispatch(changed)
@@ -0,0 +1,330 @@
+"""Benchmarks for both MPD clients (my_aiompd.Client and mpdclient.MPDClient), against fake_mpd's stand-in server.
+
+    python bench_mpd.py --output bench_output.txt
+    python bench_mpd.py --compare bench_output.txt
+
+The results are JSON, one object per measurement, so that they can be kept and compared against.  With --compare, any
+measurement that got more than --threshold worse than in the given earlier results is reported and the exit status is 1,
+which is the point: the Pi is about 20 times slower than a desktop, so a regression in data_received that costs a few
+percent here is very noticeable on the device.
+
+What gets measured:
+  parse     -- throughput of each client's response parser on a big playlistinfo/listallinfo, with the data fed to it
+               in-process (no sockets), in MB/s and records/s.  For my_aiompd this is also done with the data cut into
+               1-byte and 7-byte pieces, and for a binary response cut up inside the payload, like test_split_binary.
+  fetch     -- the same big responses fetched from the server over a socket, including my_aiompd's stream_command.
+  roundtrip -- time per small command (ping, status), one after another.
+  idle      -- time from the server noticing a change to the client's idle returning, and the cost of a command that
+               has to interrupt an idle (noidle, answer, command, idle again).
+"""
+import argparse
+import asyncio
+import io
+import json
+import sys
+import threading
+import time
+from unittest.mock import Mock
+
+import fake_mpd
+import mpdclient
+import my_aiompd
+
+
+class ServerThread:
+    """Runs a FakeMPDServer on its own event loop in a background thread, so that the blocking client can talk to it.
+    """
+    def __init__(self, library):
+        self.loop = asyncio.new_event_loop()
+        self.server = fake_mpd.FakeMPDServer(library, loop=self.loop)
+        # put the whole library in the queue, for playlistinfo.  Nobody's connected yet, so this doesn't need to be done
+        # on the server's thread.
+        for song in library.songs:
+            self.server._add(song)
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+        self.host, self.port = asyncio.run_coroutine_threadsafe(self.server.start(), self.loop).result()
+
+    def call(self, func, *args):
+        self.loop.call_soon_threadsafe(func, *args)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.server.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+
+def best_of(repeat, func):
+    """Run func() `repeat` times and return the shortest time it took, along with what it returned the last time.
+    """
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def _count_records(pairs):
+    return sum(1 for key, value in pairs if key in my_aiompd.RECORD_DELIMITERS)
+
+
+def response_bytes(server, command, *args):
+    """The exact bytes the server would send back for a command (minus the OK at the end, which the parsers are fed
+    separately).
+    """
+    conn = fake_mpd._Connection(server)
+    return fake_mpd._Connection._format(getattr(server, 'cmd_' + command)(conn, *args), None)
+
+
+# ---- parsing, in-process ----
+
+def _aio_parser(loop):
+    client = my_aiompd.Client(loop=loop)
+    transport = Mock('transport')
+    transport.write = lambda data: None
+    client.connection_made(transport)
+    client.data_received(b'OK MPD 0.23.5\n')
+    return client
+
+
+def aio_parse(loop, data, chunk_size=None):
+    """Feed a complete response to my_aiompd.Client.data_received, optionally chopped into chunk_size pieces, and
+    return what it parsed.
+    """
+    client = _aio_parser(loop)
+    client._response_fut = fut = loop.create_future()
+    data += b'OK\n'
+    if chunk_size is None:
+        client.data_received(data)
+    else:
+        for i in range(0, len(data), chunk_size):
+            client.data_received(data[i:i + chunk_size])
+    return fut.result()
+
+
+def sync_parse(data):
+    client = mpdclient.MPDClient('localhost')
+    client.readfile = io.BytesIO(data + b'OK\n')
+    return list(client._read_response(enable_reconnect=False))
+
+
+def bench_parse(server, repeat):
+    loop = asyncio.new_event_loop()
+    results = []
+    for command in ('playlistinfo', 'listallinfo'):
+        data = response_bytes(server, command)
+        cases = [('my_aiompd', 'whole', lambda: aio_parse(loop, data)),
+                 ('my_aiompd', '7-byte chunks', lambda: aio_parse(loop, data, 7)),
+                 ('mpdclient', 'whole', lambda: sync_parse(data))]
+        for client, how, func in cases:
+            elapsed, pairs = best_of(repeat, func)
+            records = _count_records(pairs)
+            results.append({'group': 'parse', 'name': '%s %s' % (command, how), 'client': client,
+                            'bytes': len(data), 'records': records, 'seconds': elapsed,
+                            'MB/s': len(data) / elapsed / 1e6, 'records/s': records / elapsed})
+    # 1-byte reads are too slow to do on the whole library, so do them on one album's worth.
+    data = response_bytes(server, 'playlistinfo', '0:12')
+    elapsed, pairs = best_of(repeat, lambda: aio_parse(loop, data, 1))
+    results.append({'group': 'parse', 'name': 'playlistinfo 0:12 1-byte chunks', 'client': 'my_aiompd',
+                    'bytes': len(data), 'records': _count_records(pairs), 'seconds': elapsed,
+                    'MB/s': len(data) / elapsed / 1e6, 'records/s': _count_records(pairs) / elapsed})
+    # binary responses, cut up so that the splits land inside the payload and right before its trailing newline.
+    data = b'size: 65536\nbinary: 8192\n' + bytes(range(256)) * 32 + b'\n'
+    for chunk_size in (None, 1000, 8192 + 24):
+        elapsed, _ = best_of(repeat, lambda: aio_parse(loop, data, chunk_size))
+        results.append({'group': 'parse', 'name': 'binary 8k %s' % ('whole' if chunk_size is None else
+                                                                   '%d-byte chunks' % chunk_size),
+                        'client': 'my_aiompd', 'bytes': len(data), 'seconds': elapsed,
+                        'MB/s': len(data) / elapsed / 1e6})
+    elapsed, _ = best_of(repeat, lambda: sync_parse(data))
+    results.append({'group': 'parse', 'name': 'binary 8k whole', 'client': 'mpdclient', 'bytes': len(data),
+                    'seconds': elapsed, 'MB/s': len(data) / elapsed / 1e6})
+    loop.close()
+    return results
+
+
+# ---- over a socket ----
+
+def bench_fetch(server_thread, repeat):
+    results = []
+    loop = asyncio.new_event_loop()
+    client = my_aiompd.Client(server_thread.host, server_thread.port, loop=loop)
+
+    async def stream(command):
+        return [record async for record in client.stream_command(command)]
+
+    sync_client = mpdclient.MPDClient(server_thread.host, server_thread.port)
+    for command in ('playlistinfo', 'listallinfo'):
+        size = len(response_bytes(server_thread.server, command))
+        cases = [('my_aiompd', 'send_command', lambda: _count_records(
+                      loop.run_until_complete(client.send_command(command)))),
+                 ('my_aiompd', 'stream_command', lambda: len(loop.run_until_complete(stream(command)))),
+                 ('mpdclient', 'do_command', lambda: _count_records(sync_client.do_command(command)))]
+        for name, how, func in cases:
+            elapsed, records = best_of(repeat, func)
+            results.append({'group': 'fetch', 'name': '%s %s' % (command, how), 'client': name, 'bytes': size,
+                            'records': records, 'seconds': elapsed, 'MB/s': size / elapsed / 1e6,
+                            'records/s': records / elapsed})
+    client.close()
+    sync_client.close()
+    loop.close()
+    return results
+
+
+def bench_roundtrip(server_thread, count):
+    results = []
+    loop = asyncio.new_event_loop()
+    client = my_aiompd.Client(server_thread.host, server_thread.port, loop=loop)
+    sync_client = mpdclient.MPDClient(server_thread.host, server_thread.port)
+
+    async def run(command):
+        for _ in range(count):
+            await client.send_command(command)
+
+    def run_sync(command):
+        for _ in range(count):
+            sync_client.do_command(command)
+
+    for command in ('ping', 'status'):
+        for name, func in (('my_aiompd', lambda: loop.run_until_complete(run(command))),
+                           ('mpdclient', lambda: run_sync(command))):
+            func()  # connect, and warm up
+            elapsed, _ = best_of(1, func)
+            results.append({'group': 'roundtrip', 'name': command, 'client': name, 'count': count,
+                            'seconds': elapsed, 'us/op': elapsed / count * 1e6})
+    client.close()
+    sync_client.close()
+    loop.close()
+    return results
+
+
+def bench_idle(server_thread, count):
+    results = []
+    loop = asyncio.new_event_loop()
+    client = my_aiompd.Client(server_thread.host, server_thread.port, loop=loop)
+
+    async def wakeups():
+        with client.subscribe_idle('mixer') as changes:
+            await client.send_command('ping')
+            total = 0
+            for _ in range(count):
+                # let the idle get to the server first
+                await asyncio.sleep(0.001)
+                start = time.perf_counter()
+                server_thread.call(server_thread.server.notify, 'mixer')
+                await changes.get()
+                total += time.perf_counter() - start
+            return total
+
+    async def interrupted():
+        # Every one of these has to stop the idle, and then the idle gets sent again afterwards.
+        with client.subscribe_idle('mixer'):
+            await client.send_command('ping')
+            start = time.perf_counter()
+            for _ in range(count):
+                await client.send_command('ping')
+                await asyncio.sleep(0)
+            return time.perf_counter() - start
+
+    elapsed = loop.run_until_complete(wakeups())
+    results.append({'group': 'idle', 'name': 'wakeup', 'client': 'my_aiompd', 'count': count, 'seconds': elapsed,
+                    'us/op': elapsed / count * 1e6})
+    elapsed = loop.run_until_complete(interrupted())
+    results.append({'group': 'idle', 'name': 'command during idle', 'client': 'my_aiompd', 'count': count,
+                    'seconds': elapsed, 'us/op': elapsed / count * 1e6})
+    client.close()
+    loop.close()
+
+    sync_client = mpdclient.MPDClient(server_thread.host, server_thread.port)
+    sync_client.connect()
+    total = 0
+    for _ in range(count):
+        sync_client.send_idle(['mixer'])
+        time.sleep(0.001)
+        start = time.perf_counter()
+        server_thread.call(server_thread.server.notify, 'mixer')
+        sync_client.receive_idle()
+        total += time.perf_counter() - start
+    results.append({'group': 'idle', 'name': 'wakeup', 'client': 'mpdclient', 'count': count, 'seconds': total,
+                    'us/op': total / count * 1e6})
+    start = time.perf_counter()
+    for _ in range(count):
+        sync_client.send_idle(['mixer'])
+        sync_client.do_command('ping')
+    elapsed = time.perf_counter() - start
+    results.append({'group': 'idle', 'name': 'command during idle', 'client': 'mpdclient', 'count': count,
+                    'seconds': elapsed, 'us/op': elapsed / count * 1e6})
+    sync_client.close()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return a description of every measurement in `results` that's more than `threshold` (a fraction) worse than
+    the same one in `baseline`.
+    """
+    old = {(r['group'], r['name'], r['client']): r for r in baseline}
+    regressions = []
+    for r in results:
+        before = old.get((r['group'], r['name'], r['client']))
+        if before is None:
+            continue
+        # lower is better for times, higher is better for rates
+        for key, higher_is_better in (('us/op', False), ('MB/s', True), ('records/s', True)):
+            if key not in r or key not in before:
+                continue
+            change = (before[key] - r[key]) / before[key] if higher_is_better else (r[key] - before[key]) / before[key]
+            if change > threshold:
+                regressions.append('%s %s (%s): %s %.4g -> %.4g (%.0f%% worse)'
+                                   % (r['group'], r['name'], r['client'], key, before[key], r[key], change * 100))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--artists', type=int, default=100,
+                        help='size of the fake library, 60 songs per artist (default %(default)s)')
+    parser.add_argument('--repeat', type=int, default=5, help='take the best of this many runs (default %(default)s)')
+    parser.add_argument('--count', type=int, default=500,
+                        help='number of commands for the round trip and idle measurements (default %(default)s)')
+    parser.add_argument('--only', choices=('parse', 'fetch', 'roundtrip', 'idle'), action='append')
+    parser.add_argument('--output', help='write the results to this file as well as stdout')
+    parser.add_argument('--compare', metavar='FILE', help='earlier results to check for regressions against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='how much worse (as a fraction) counts as a regression (default %(default)s)')
+    args = parser.parse_args(argv)
+
+    groups = args.only or ('parse', 'fetch', 'roundtrip', 'idle')
+    server_thread = ServerThread(fake_mpd.FakeLibrary(artists=args.artists))
+    results = []
+    try:
+        if 'parse' in groups:
+            results += bench_parse(server_thread.server, args.repeat)
+        if 'fetch' in groups:
+            results += bench_fetch(server_thread, args.repeat)
+        if 'roundtrip' in groups:
+            results += bench_roundtrip(server_thread, args.count)
+        if 'idle' in groups:
+            results += bench_idle(server_thread, args.count)
+    finally:
+        server_thread.stop()
+
+    output = json.dumps(results, indent=1)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print('REGRESSION:', regression, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,995 @@
+"""A stand-in for MPD that speaks enough of the protocol for everything this project sends it, so that the clients can be
+tested (and benchmarked) end to end without a real server, a real music library, or a Pi.
+
+    server = FakeMPDServer(FakeLibrary(artists=50))
+    host, port = await server.start()
+    ...
+    server.close()
+
+It keeps a queue, playback state, C2C channels and idle events the way MPD does, but doesn't play anything: "playing"
+just means the elapsed time counts up.  Responses can be delayed (latency) and cut into pieces (chunk_size) to see how
+clients cope with slow servers and awkwardly split reads.
+"""
+import asyncio
+import collections
+import os
+import random
+import re
+import time
+from typing import Optional
+
+__all__ = ['FakeMPDServer', 'FakeLibrary']
+
+PROTOCOL_VERSION = '0.23.5'
+
+# error codes, from MPD's protocol/Ack.hxx
+ACK_ERROR_NOT_LIST = 1
+ACK_ERROR_ARG = 2
+ACK_ERROR_UNKNOWN = 5
+ACK_ERROR_NO_EXIST = 50
+ACK_ERROR_EXIST = 56
+
+ALL_SUBSYSTEMS = ('database', 'update', 'stored_playlist', 'playlist', 'player', 'mixer', 'output', 'options',
+                  'partition', 'sticker', 'subscription', 'message', 'neighbor', 'mount')
+
+
+class CommandError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class FakeLibrary:
+    """A made-up music library of artists/album/NN - title.flac, with tags to match.  Every so often a name has some
+    non-ASCII characters in it, because real libraries do.
+    """
+    def __init__(self, artists=10, albums=5, tracks=12, seed=0):
+        rng = random.Random(seed)
+        genres = ('Rock', 'Jazz', 'Electronic', 'Classical', 'Hip-Hop', 'Folk')
+        self.songs = []  # list of lists of (key, value) pairs, in the order the server sends them
+        self.by_uri = {}
+        # directory -> ([subdirectories], [song URIs]), with '' as the root
+        self.directories = {'': ([], [])}
+        for a in range(artists):
+            artist = 'Artist %d' % a if a % 7 else 'Artïst Ünïcødé %d' % a
+            self.directories[''][0].append(artist)
+            self.directories[artist] = ([], [])
+            for b in range(albums):
+                album = 'Album %d' % b
+                album_dir = artist + '/' + album
+                self.directories[artist][0].append(album_dir)
+                self.directories[album_dir] = ([], [])
+                date = str(1960 + rng.randrange(60))
+                genre = rng.choice(genres)
+                for t in range(tracks):
+                    title = 'Track %d of %s' % (t + 1, album)
+                    uri = '%s/%02d - %s.flac' % (album_dir, t + 1, title)
+                    duration = 120 + rng.randrange(300) + rng.randrange(1000) / 1000
+                    song = [('file', uri), ('Last-Modified', '2020-01-01T00:00:00Z'), ('Format', '44100:16:2'),
+                            ('Artist', artist), ('AlbumArtist', artist), ('Album', album), ('Title', title),
+                            ('Track', str(t + 1)), ('Genre', genre), ('Date', date),
+                            ('Time', str(int(duration))), ('duration', '%.3f' % duration)]
+                    self.songs.append(song)
+                    self.by_uri[uri] = song
+                    self.directories[album_dir][1].append(uri)
+
+    def __len__(self):
+        return len(self.songs)
+
+    def _directory(self, path):
+        if path not in self.directories:
+            parent = path.rpartition('/')[0]
+            self._directory(parent)[0].append(path)
+            self.directories[path] = ([], [])
+        return self.directories[path]
+
+    def add_song(self, uri, *tags):
+        """Put a file in the library (if it isn't already), with whatever (key, value) tags it should have.
+        """
+        if uri in self.by_uri:
+            return
+        song = [('file', uri), ('Last-Modified', '2020-01-01T00:00:00Z')] + list(tags)
+        self.songs.append(song)
+        self.by_uri[uri] = song
+        self._directory(uri.rpartition('/')[0])[1].append(uri)
+
+    def remove_song(self, uri):
+        song = self.by_uri.pop(uri)
+        self.songs.remove(song)
+        self.directories[uri.rpartition('/')[0]][1].remove(uri)
+
+
+def _split_args(line: str):
+    """Split a command line up the way MPD does: on spaces, except inside double quotes, with backslash escapes.
+    """
+    args = []
+    i = 0
+    while i < len(line):
+        if line[i] == ' ':
+            i += 1
+        elif line[i] == '"':
+            i += 1
+            arg = []
+            while i < len(line) and line[i] != '"':
+                if line[i] == '\\':
+                    i += 1
+                arg.append(line[i])
+                i += 1
+            if i >= len(line):
+                raise CommandError(ACK_ERROR_ARG, 'Missing closing \'"\'')
+            i += 1
+            args.append(''.join(arg))
+        else:
+            end = line.find(' ', i)
+            if end == -1:
+                end = len(line)
+            args.append(line[i:end])
+            i = end
+    return args
+
+
+def _parse_range(arg: str, length: int):
+    if ':' in arg:
+        start, _, end = arg.partition(':')
+        start = int(start)
+        end = int(end) if end else length
+    else:
+        start = int(arg)
+        end = start + 1
+    if start < 0 or end < start:
+        raise CommandError(ACK_ERROR_ARG, 'Bad range')
+    return start, min(end, length)
+
+
+_FILTER_TOKEN = re.compile(r'\s*(\(|\)|==|!=|=~|!~|!|"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'|[^\s()"\']+)')
+_NOT_TAGS = frozenset(['Last-Modified', 'Format', 'Time', 'duration'])
+
+
+def _parse_filter(expression: str):
+    """Turn an MPD filter expression like ((Artist == "foo") AND (!(Album contains 'bar'))) into a function taking a
+    song (a list of pairs) and whether to ignore case, and returning whether it matches.
+    """
+    tokens = []
+    pos = 0
+    expression = expression.rstrip()
+    while pos < len(expression):
+        match = _FILTER_TOKEN.match(expression, pos)
+        if match is None:
+            raise CommandError(ACK_ERROR_ARG, 'Failed to parse filter expression')
+        token = match.group(1)
+        if token[0] in '"\'':
+            # a quoted value, which gets marked by being a tuple so it can't be mistaken for an operator
+            token = (re.sub(r'\\(.)', r'\1', token[1:-1]),)
+        tokens.append(token)
+        pos = match.end()
+
+    def expect(i, token):
+        if i >= len(tokens) or tokens[i] != token:
+            raise CommandError(ACK_ERROR_ARG, 'Failed to parse filter expression: expected %r' % token)
+        return i + 1
+
+    def value_at(i):
+        if i >= len(tokens) or not isinstance(tokens[i], tuple):
+            raise CommandError(ACK_ERROR_ARG, 'Failed to parse filter expression: expected quoted value')
+        return tokens[i][0]
+
+    def parse(i):
+        i = expect(i, '(')
+        if i < len(tokens) and tokens[i] == '!':
+            inner, i = parse(i + 1)
+            return (lambda song, fold: not inner(song, fold)), expect(i, ')')
+        if i < len(tokens) and tokens[i] == '(':
+            parts = []
+            while True:
+                part, i = parse(i)
+                parts.append(part)
+                if i < len(tokens) and tokens[i] == 'AND':
+                    i += 1
+                    continue
+                return (lambda song, fold: all(part(song, fold) for part in parts)), expect(i, ')')
+        if i >= len(tokens) or isinstance(tokens[i], tuple):
+            raise CommandError(ACK_ERROR_ARG, 'Failed to parse filter expression')
+        tag = tokens[i]
+        if tag == 'base':
+            base = value_at(i + 1).rstrip('/') + '/'
+            return (lambda song, fold: song[0][1].startswith(base)), expect(i + 2, ')')
+        if i + 1 >= len(tokens) or isinstance(tokens[i + 1], tuple):
+            raise CommandError(ACK_ERROR_ARG, 'Failed to parse filter expression: expected operator')
+        op = tokens[i + 1]
+        value = value_at(i + 2)
+        return (lambda song, fold: _match(song, tag, op, value, fold)), expect(i + 3, ')')
+
+    predicate, end = parse(0)
+    if end != len(tokens):
+        raise CommandError(ACK_ERROR_ARG, 'Unparsed garbage after expression')
+    return predicate
+
+
+def _match(song, tag, op, value, fold):
+    if tag == 'any':
+        values = [v for k, v in song if k not in _NOT_TAGS]
+    else:
+        values = [v for k, v in song if k.lower() == tag.lower()]
+    if fold:
+        value = value.casefold()
+        values = [v.casefold() for v in values]
+    if op == '==':
+        return value in values
+    elif op == '!=':
+        return value not in values
+    elif op == 'contains':
+        return any(value in v for v in values)
+    elif op == 'starts_with':
+        return any(v.startswith(value) for v in values)
+    elif op in ('=~', '!~'):
+        matched = any(re.search(value, v, re.IGNORECASE if fold else 0) for v in values)
+        return matched if op == '=~' else not matched
+    raise CommandError(ACK_ERROR_ARG, 'Unknown filter operator: %s' % op)
+
+
+def _filter_predicate(args, legacy_substring):
+    """The filter at the start of a find/search style command, either an expression or the old TAG VALUE pairs (which
+    match exactly, or as substrings with `legacy_substring`), as a function like the ones _parse_filter() returns.
+    """
+    if not args:
+        raise CommandError(ACK_ERROR_ARG, 'too few arguments')
+    if args[0].startswith('('):
+        if len(args) != 1:
+            raise CommandError(ACK_ERROR_ARG, 'Unparsed garbage after expression')
+        return _parse_filter(args[0])
+    if len(args) % 2:
+        raise CommandError(ACK_ERROR_ARG, 'Incorrect number of filter arguments')
+    op = 'contains' if legacy_substring else '=='
+    pairs = list(zip(args[::2], args[1::2]))
+    return lambda song, fold: all(_match(song, tag, op, value, fold) for tag, value in pairs)
+
+
+def _tag_value(song, tag):
+    for k, v in song:
+        if k.lower() == tag.lower():
+            return v
+    return ''
+
+
+class _QueueEntry:
+    __slots__ = ('song', 'id', 'version', 'priority')
+
+    def __init__(self, song, id_, version):
+        self.song = song
+        self.id = id_
+        self.version = version  # the queue version this entry last changed (was added or moved) in
+        self.priority = 0
+
+
+class FakeMPDServer:
+    def __init__(self, library: FakeLibrary = None, *, latency=0.0, chunk_size=None, chunk_delay=0.0,
+                 connection_timeout=None, picture_size=4096, music_directory=None, update_time=0.1, loop=None):
+        """
+        :param latency: seconds to wait before sending each response
+        :param chunk_size: if set, responses are written this many bytes at a time...
+        :param chunk_delay: ...with this many seconds in between each piece
+        :param connection_timeout: drop connections that haven't sent anything in this many seconds, unless they're
+            idling, like MPD's connection_timeout setting
+        :param picture_size: size of the made-up cover art albumart and readpicture send back
+        :param music_directory: if set, update adds the files it finds under here to the library (and drops the ones
+            that have gone), as well as the made-up ones
+        :param update_time: how long an update takes
+        """
+        self.library = library if library is not None else FakeLibrary()
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.connection_timeout = connection_timeout
+        self.picture = bytes(range(256)) * (picture_size // 256) + bytes(range(picture_size % 256))
+        self._loop = loop or asyncio.get_event_loop()
+        self._servers = []
+        self.connections = set()
+        self.commands_received = 0
+
+        self.queue = []
+        self.version = 1
+        self._next_id = 1
+        self.state = 'stop'
+        self.current = None  # index into self.queue of the current song
+        self._elapsed = 0.0  # elapsed time as of _elapsed_time
+        self._elapsed_time = time.monotonic()
+        self.volume = 50
+        self.random = False
+        self.repeat = False
+        self.single = False
+        self.consume = False
+        self.channels = {}  # channel name -> set of connections subscribed to it
+        self.music_directory = music_directory
+        self.update_time = update_time
+        self._update_job = None  # the job number of the update in progress, if there is one
+        self._last_update_job = 0
+        self._scanned = set()  # what the last update found in music_directory
+        self._start_time = time.monotonic()
+
+    # ---- running the server ----
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Listen on TCP.  Returns the (host, port) actually listened on, which is useful with port 0.
+        """
+        server = await self._loop.create_server(lambda: _Connection(self), host, port)
+        self._servers.append(server)
+        return server.sockets[0].getsockname()[:2]
+
+    async def start_unix(self, path):
+        server = await self._loop.create_unix_server(lambda: _Connection(self), path)
+        self._servers.append(server)
+        return path
+
+    def disconnect_all(self):
+        """Drop every client connection, the way a server restart would, but keep listening.
+        """
+        for conn in list(self.connections):
+            conn.transport.close()
+
+    def close(self):
+        for server in self._servers:
+            server.close()
+        self._servers.clear()
+        self.disconnect_all()
+
+    # ---- state ----
+
+    def notify(self, *subsystems):
+        for conn in list(self.connections):
+            conn.add_idle_events(subsystems)
+
+    def _queue_changed(self, entries=()):
+        self.version += 1
+        for entry in entries:
+            entry.version = self.version
+        self.notify('playlist')
+
+    @property
+    def elapsed(self):
+        if self.state == 'play':
+            return self._elapsed + time.monotonic() - self._elapsed_time
+        return self._elapsed
+
+    def _set_elapsed(self, elapsed):
+        self._elapsed = elapsed
+        self._elapsed_time = time.monotonic()
+
+    def _song_pairs(self, pos):
+        entry = self.queue[pos]
+        return entry.song + [('Pos', str(pos)), ('Id', str(entry.id))]
+
+    def _find_id(self, id_):
+        for pos, entry in enumerate(self.queue):
+            if entry.id == id_:
+                return pos
+        raise CommandError(ACK_ERROR_NO_EXIST, 'No such song')
+
+    def _lookup_song(self, uri):
+        song = self.library.by_uri.get(uri)
+        if song is not None:
+            return song
+        if '://' in uri:
+            # streams are allowed to be anything
+            return [('file', uri)]
+        raise CommandError(ACK_ERROR_NO_EXIST, 'No such song')
+
+    def _add(self, song, pos=None):
+        entry = _QueueEntry(song, self._next_id, self.version + 1)
+        self._next_id += 1
+        if pos is None or pos >= len(self.queue):
+            self.queue.append(entry)
+            moved = ()
+        else:
+            self.queue.insert(pos, entry)
+            if self.current is not None and pos <= self.current:
+                self.current += 1
+            moved = self.queue[pos + 1:]
+        self._queue_changed(moved)
+        return entry
+
+    def _delete(self, pos):
+        del self.queue[pos]
+        if self.current is not None:
+            if pos == self.current:
+                if pos < len(self.queue) and self.state != 'stop':
+                    self._set_elapsed(0)
+                else:
+                    self.current = None
+                    self.state = 'stop'
+                self.notify('player')
+            elif pos < self.current:
+                self.current -= 1
+        self._queue_changed(self.queue[pos:])
+
+    def _play(self, pos):
+        if not 0 <= pos < len(self.queue):
+            raise CommandError(ACK_ERROR_ARG, 'Bad song index')
+        self.current = pos
+        self.state = 'play'
+        self._set_elapsed(0)
+        self.notify('player')
+
+    def _next_pos(self):
+        if self.current is None:
+            return None
+        if self.single and self.repeat:
+            return self.current
+        if self.current + 1 < len(self.queue):
+            return self.current + 1
+        return 0 if self.repeat and self.queue else None
+
+    def status(self):
+        pairs = [('volume', str(self.volume)), ('repeat', str(int(self.repeat))), ('random', str(int(self.random))),
+                 ('single', str(int(self.single))), ('consume', str(int(self.consume))),
+                 ('playlist', str(self.version)), ('playlistlength', str(len(self.queue))),
+                 ('mixrampdb', '0.000000'), ('state', self.state)]
+        if self.current is not None:
+            entry = self.queue[self.current]
+            pairs += [('song', str(self.current)), ('songid', str(entry.id))]
+            if self.state != 'stop':
+                duration = dict(entry.song).get('duration')
+                pairs.append(('time', '%d:%d' % (self.elapsed, float(duration or 0))))
+                pairs.append(('elapsed', '%.3f' % self.elapsed))
+                if duration:
+                    pairs.append(('duration', duration))
+                pairs.append(('bitrate', '0'))
+            next_pos = self._next_pos()
+            if next_pos is not None:
+                pairs += [('nextsong', str(next_pos)), ('nextsongid', str(self.queue[next_pos].id))]
+        if self._update_job is not None:
+            pairs.append(('updating_db', str(self._update_job)))
+        return pairs
+
+    # ---- commands ----
+    # Each of these takes the connection and the arguments, and returns a list of (key, value) pairs.  A value that's
+    # bytes is sent as a binary chunk.
+
+    def cmd_ping(self, conn):
+        return []
+
+    def cmd_close(self, conn):
+        conn.transport.close()
+        return None
+
+    def cmd_status(self, conn):
+        return self.status()
+
+    def cmd_stats(self, conn):
+        artists = {dict(song)['Artist'] for song in self.library.songs}
+        albums = {(dict(song)['Artist'], dict(song)['Album']) for song in self.library.songs}
+        return [('uptime', str(int(time.monotonic() - self._start_time))), ('playtime', '0'),
+                ('artists', str(len(artists))), ('albums', str(len(albums))), ('songs', str(len(self.library))),
+                ('db_playtime', str(sum(int(dict(song)['Time']) for song in self.library.songs))),
+                ('db_update', '1577836800')]
+
+    def cmd_currentsong(self, conn):
+        if self.current is None:
+            return []
+        return self._song_pairs(self.current)
+
+    def cmd_playlistinfo(self, conn, arg=None):
+        if arg is None:
+            start, end = 0, len(self.queue)
+        else:
+            start, end = _parse_range(arg, len(self.queue))
+            if start >= len(self.queue) and ':' not in arg:
+                raise CommandError(ACK_ERROR_ARG, 'Bad song index')
+            if start > end:
+                # the end gets clamped to the length of the queue, but the start doesn't
+                raise CommandError(ACK_ERROR_ARG, 'Bad range')
+        return [pair for pos in range(start, end) for pair in self._song_pairs(pos)]
+
+    def cmd_playlistid(self, conn, id_=None):
+        if id_ is None:
+            return self.cmd_playlistinfo(conn)
+        return self._song_pairs(self._find_id(int(id_)))
+
+    def cmd_plchanges(self, conn, version, arg=None):
+        start, end = _parse_range(arg, len(self.queue)) if arg else (0, len(self.queue))
+        version = int(version)
+        return [pair for pos in range(start, end) if self.queue[pos].version > version
+                for pair in self._song_pairs(pos)]
+
+    def cmd_plchangesposid(self, conn, version, arg=None):
+        start, end = _parse_range(arg, len(self.queue)) if arg else (0, len(self.queue))
+        version = int(version)
+        return [pair for pos in range(start, end) if self.queue[pos].version > version
+                for pair in (('cpos', str(pos)), ('Id', str(self.queue[pos].id)))]
+
+    def cmd_lsinfo(self, conn, uri=''):
+        uri = uri.strip('/')
+        if uri in self.library.by_uri:
+            return list(self.library.by_uri[uri])
+        if uri not in self.library.directories:
+            raise CommandError(ACK_ERROR_NO_EXIST, 'No such directory')
+        subdirs, files = self.library.directories[uri]
+        return [pair for subdir in subdirs for pair in (('directory', subdir), ('Last-Modified', '2020-01-01T00:00:00Z'))] \
+            + [pair for file in files for pair in self.library.by_uri[file]]
+
+    def cmd_listallinfo(self, conn, uri=''):
+        uri = uri.strip('/')
+        if uri and uri not in self.library.directories and uri not in self.library.by_uri:
+            raise CommandError(ACK_ERROR_NO_EXIST, 'No such directory')
+        prefix = uri + '/' if uri else ''
+        return [pair for song in self.library.songs
+                if not uri or song[0][1] == uri or song[0][1].startswith(prefix) for pair in song]
+
+    def cmd_list(self, conn, tag, *args):
+        # (no filters or grouping; nothing here uses them)
+        tags = ('Artist', 'AlbumArtist', 'Album', 'Title', 'Genre', 'Date')
+        key = {tag.lower(): tag for tag in tags}.get(tag.lower())
+        if key is None:
+            raise CommandError(ACK_ERROR_ARG, 'Unknown tag type: ' + tag)
+        values = sorted({value for song in self.library.songs for k, value in song if k == key})
+        return [(key, value) for value in values]
+
+    def _search(self, args, fold, legacy_substring):
+        """Shared by find and search: returns the matching songs, and whatever arguments were left after the filter
+        (sort, window, group).
+        """
+        options = {}
+        rest = []
+        i = 0
+        while i < len(args):
+            if args[i] in ('sort', 'window', 'group') and i + 1 < len(args):
+                options[args[i]] = args[i + 1]
+                i += 2
+            else:
+                rest.append(args[i])
+                i += 1
+        predicate = _filter_predicate(rest, legacy_substring)
+        songs = [song for song in self.library.songs if predicate(song, fold)]
+        if 'sort' in options:
+            tag = options['sort']
+            descending = tag.startswith('-')
+            tag = tag.lstrip('-')
+            songs.sort(key=lambda song: _tag_value(song, tag), reverse=descending)
+        if 'window' in options:
+            start, end = _parse_range(options['window'], len(songs))
+            songs = songs[start:end]
+        return songs, options
+
+    def cmd_find(self, conn, *args):
+        songs, _ = self._search(args, fold=False, legacy_substring=False)
+        return [pair for song in songs for pair in song]
+
+    def cmd_search(self, conn, *args):
+        songs, _ = self._search(args, fold=True, legacy_substring=True)
+        return [pair for song in songs for pair in song]
+
+    def cmd_playlistfind(self, conn, *args):
+        return self._playlist_search(args, fold=False)
+
+    def cmd_playlistsearch(self, conn, *args):
+        return self._playlist_search(args, fold=True)
+
+    def _playlist_search(self, args, fold):
+        predicate = _filter_predicate(args, legacy_substring=fold)
+        return [pair for pos, entry in enumerate(self.queue) if predicate(entry.song, fold)
+                for pair in self._song_pairs(pos)]
+
+    def cmd_count(self, conn, *args):
+        return self._count(args, fold=False)
+
+    def cmd_searchcount(self, conn, *args):
+        return self._count(args, fold=True)
+
+    def _count(self, args, fold):
+        songs, options = self._search(args, fold=fold, legacy_substring=fold)
+        if 'group' not in options:
+            return [('songs', str(len(songs))), ('playtime', str(sum(int(_tag_value(song, 'Time')) for song in songs)))]
+        groups = {}
+        for song in songs:
+            counts = groups.setdefault(_tag_value(song, options['group']), [0, 0])
+            counts[0] += 1
+            counts[1] += int(_tag_value(song, 'Time'))
+        return [pair for value in sorted(groups)
+                for pair in ((options['group'], value), ('songs', str(groups[value][0])),
+                             ('playtime', str(groups[value][1])))]
+
+    def cmd_add(self, conn, uri, pos=None):
+        self._add(self._lookup_song(uri), None if pos is None else int(pos))
+        return []
+
+    def cmd_addid(self, conn, uri, pos=None):
+        entry = self._add(self._lookup_song(uri), None if pos is None else int(pos))
+        return [('Id', str(entry.id))]
+
+    def cmd_delete(self, conn, arg):
+        start, end = _parse_range(arg, len(self.queue))
+        if start >= len(self.queue):
+            raise CommandError(ACK_ERROR_ARG, 'Bad song index')
+        for pos in range(end - 1, start - 1, -1):
+            self._delete(pos)
+        return []
+
+    def cmd_deleteid(self, conn, id_):
+        self._delete(self._find_id(int(id_)))
+        return []
+
+    def cmd_clear(self, conn):
+        self.queue.clear()
+        if self.current is not None:
+            self.current = None
+            self.state = 'stop'
+            self.notify('player')
+        self._queue_changed()
+        return []
+
+    def cmd_move(self, conn, arg, to):
+        start, end = _parse_range(arg, len(self.queue))
+        moving = self.queue[start:end]
+        current = self.queue[self.current] if self.current is not None else None
+        del self.queue[start:end]
+        to = int(to)
+        self.queue[to:to] = moving
+        if current is not None:
+            self.current = self.queue.index(current)
+        lo, hi = min(start, to), max(end, to + len(moving))
+        self._queue_changed(self.queue[lo:hi])
+        return []
+
+    def cmd_shuffle(self, conn):
+        current = self.queue[self.current] if self.current is not None else None
+        random.shuffle(self.queue)
+        if current is not None:
+            self.current = self.queue.index(current)
+        self._queue_changed(self.queue)
+        return []
+
+    def cmd_play(self, conn, pos=None):
+        if pos is None:
+            if self.state == 'pause':
+                return self.cmd_pause(conn, '0')
+            pos = self.current if self.current is not None else 0
+        self._play(int(pos))
+        return []
+
+    def cmd_playid(self, conn, id_=None):
+        if id_ is None:
+            return self.cmd_play(conn)
+        self._play(self._find_id(int(id_)))
+        return []
+
+    def cmd_pause(self, conn, arg=None):
+        if self.state == 'stop':
+            return []
+        pause = self.state == 'play' if arg is None else arg == '1'
+        self._set_elapsed(self.elapsed)
+        self.state = 'pause' if pause else 'play'
+        self.notify('player')
+        return []
+
+    def cmd_stop(self, conn):
+        self.state = 'stop'
+        self._set_elapsed(0)
+        self.notify('player')
+        return []
+
+    def cmd_next(self, conn):
+        if self.state == 'stop':
+            return []
+        pos = self._next_pos()
+        if pos is None:
+            return self.cmd_stop(conn)
+        self._play(pos)
+        return []
+
+    def cmd_previous(self, conn):
+        if self.state == 'stop':
+            return []
+        self._play(max(0, self.current - 1))
+        return []
+
+    def cmd_seekcur(self, conn, arg):
+        if self.state == 'stop':
+            raise CommandError(ACK_ERROR_ARG, 'Not playing')
+        self._set_elapsed(self.elapsed + float(arg) if arg[0] in '+-' else float(arg))
+        self.notify('player')
+        return []
+
+    def _set_option(self, name, value):
+        if value not in ('0', '1'):
+            raise CommandError(ACK_ERROR_ARG, 'Boolean (0/1) expected: %s' % value)
+        setattr(self, name, value == '1')
+        self.notify('options')
+        return []
+
+    def cmd_random(self, conn, value):
+        return self._set_option('random', value)
+
+    def cmd_repeat(self, conn, value):
+        return self._set_option('repeat', value)
+
+    def cmd_single(self, conn, value):
+        return self._set_option('single', value)
+
+    def cmd_consume(self, conn, value):
+        return self._set_option('consume', value)
+
+    def cmd_setvol(self, conn, value):
+        volume = int(value)
+        if not 0 <= volume <= 100:
+            raise CommandError(ACK_ERROR_ARG, 'Invalid volume value')
+        self.volume = volume
+        self.notify('mixer')
+        return []
+
+    def cmd_getvol(self, conn):
+        return [('volume', str(self.volume))]
+
+    def cmd_albumart(self, conn, uri, offset):
+        self._lookup_song(uri)
+        offset = int(offset)
+        chunk = self.picture[offset:offset + conn.binary_limit]
+        return [('size', str(len(self.picture))), ('binary', chunk)]
+
+    def cmd_readpicture(self, conn, uri, offset):
+        return [('size', str(len(self.picture))), ('type', 'image/png')] + self.cmd_albumart(conn, uri, offset)[1:]
+
+    def cmd_binarylimit(self, conn, size):
+        conn.binary_limit = int(size)
+        return []
+
+    def cmd_subscribe(self, conn, channel):
+        if not re.fullmatch(r'[A-Za-z0-9_.:-]+', channel):
+            raise CommandError(ACK_ERROR_ARG, 'invalid channel name')
+        subscribers = self.channels.setdefault(channel, set())
+        if conn in subscribers:
+            raise CommandError(ACK_ERROR_EXIST, 'already subscribed to this channel')
+        subscribers.add(conn)
+        self.notify('subscription')
+        return []
+
+    def cmd_unsubscribe(self, conn, channel):
+        subscribers = self.channels.get(channel)
+        if not subscribers or conn not in subscribers:
+            raise CommandError(ACK_ERROR_NO_EXIST, 'not subscribed to this channel')
+        subscribers.discard(conn)
+        if not subscribers:
+            del self.channels[channel]
+        self.notify('subscription')
+        return []
+
+    def cmd_channels(self, conn):
+        return [('channel', channel) for channel in sorted(self.channels)]
+
+    def cmd_sendmessage(self, conn, channel, message):
+        subscribers = self.channels.get(channel)
+        if not subscribers:
+            raise CommandError(ACK_ERROR_NO_EXIST, 'nobody is subscribed to this channel')
+        for subscriber in subscribers:
+            subscriber.messages.append((channel, message))
+            subscriber.add_idle_events(('message',))
+        return []
+
+    def cmd_readmessages(self, conn):
+        messages, conn.messages = conn.messages, []
+        return [pair for channel, message in messages for pair in (('channel', channel), ('message', message))]
+
+    def cmd_update(self, conn, uri=''):
+        # Like MPD, a second update while one is running is just queued up behind it; here that means it's folded into
+        # the one that's running, which rescans everything anyway.
+        if self._update_job is None:
+            self._last_update_job += 1
+            self._update_job = self._last_update_job
+            self._loop.call_later(self.update_time, self._finish_update)
+            self.notify('update')
+        return [('updating_db', str(self._update_job))]
+
+    def _finish_update(self):
+        if self.music_directory is not None:
+            found = set()
+            for dirpath, dirnames, filenames in os.walk(self.music_directory):
+                relative = os.path.relpath(dirpath, self.music_directory)
+                for filename in filenames:
+                    found.add(filename if relative == '.' else relative.replace(os.sep, '/') + '/' + filename)
+            for uri in found - self._scanned:
+                self.library.add_song(uri)
+            for uri in self._scanned - found:
+                self.library.remove_song(uri)
+            self._scanned = found
+        self._update_job = None
+        self.notify('update', 'database')
+
+
+class _Connection(asyncio.Protocol):
+    def __init__(self, server: FakeMPDServer):
+        self.server = server
+        self.transport: Optional[asyncio.Transport] = None
+        self._buffer = b''
+        self.idle_events = set()  # subsystems that changed since the last idle
+        self.idling_on = None  # the subsystems the running idle command is watching, if there is one
+        self.command_list = None  # the commands collected since command_list_begin, if there is one
+        self.command_list_ok = False
+        self.messages = []  # (channel, message) pairs waiting to be read
+        self.binary_limit = 8192
+        self._outgoing = collections.deque()  # (earliest time to send, data) for responses held back by latency
+        self._pump_handle = None
+        self._timeout_handle = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.connections.add(self)
+        self._reset_timeout()
+        self._send(('OK MPD %s\n' % PROTOCOL_VERSION).encode('ascii'))
+
+    def connection_lost(self, exc):
+        self.server.connections.discard(self)
+        for subscribers in self.server.channels.values():
+            subscribers.discard(self)
+        if self._timeout_handle is not None:
+            self._timeout_handle.cancel()
+        if self._pump_handle is not None:
+            self._pump_handle.cancel()
+
+    def _reset_timeout(self):
+        if self._timeout_handle is not None:
+            self._timeout_handle.cancel()
+            self._timeout_handle = None
+        if self.server.connection_timeout and self.idling_on is None:
+            self._timeout_handle = self.server._loop.call_later(self.server.connection_timeout, self.transport.close)
+
+    def data_received(self, data):
+        self._buffer += data
+        while b'\n' in self._buffer:
+            line, _, self._buffer = self._buffer.partition(b'\n')
+            self._handle_line(line.decode('utf8'))
+            if self.transport.is_closing():
+                return
+        self._reset_timeout()
+
+    def add_idle_events(self, subsystems):
+        self.idle_events.update(subsystems)
+        if self.idling_on is not None:
+            self._finish_idle()
+
+    def _finish_idle(self, force=False):
+        changed = self.idle_events if not self.idling_on else self.idle_events & self.idling_on
+        if changed or force:
+            self.idle_events -= changed
+            self.idling_on = None
+            self._respond([('changed', subsystem) for subsystem in sorted(changed)])
+            self._reset_timeout()
+
+    def _handle_line(self, line):
+        self.server.commands_received += 1
+        if self.idling_on is not None:
+            if line == 'noidle':
+                self._finish_idle(force=True)
+            else:
+                # MPD doesn't allow anything but noidle during idle, and hangs up on clients that try.
+                self.transport.close()
+            return
+        if self.command_list is not None:
+            if line == 'command_list_end':
+                commands, self.command_list = self.command_list, None
+                self._run_command_list(commands)
+            else:
+                self.command_list.append(line)
+            return
+        if line in ('command_list_begin', 'command_list_ok_begin'):
+            self.command_list = []
+            self.command_list_ok = line == 'command_list_ok_begin'
+            return
+        if line == 'noidle':
+            # ignored if we aren't idling
+            return
+        try:
+            args = _split_args(line)
+            if args and args[0] == 'idle':
+                self.idling_on = frozenset(args[1:])
+                self._reset_timeout()
+                self._finish_idle()
+                return
+            response = self._run_command(args)
+        except CommandError as e:
+            self._error(e, line, 0)
+        else:
+            if response is not None:
+                self._respond(response)
+
+    def _run_command(self, args):
+        if not args:
+            raise CommandError(ACK_ERROR_UNKNOWN, 'No command given')
+        handler = getattr(self.server, 'cmd_' + args[0], None)
+        if handler is None:
+            raise CommandError(ACK_ERROR_UNKNOWN, 'unknown command "%s"' % args[0])
+        try:
+            return handler(self, *args[1:])
+        except TypeError:
+            raise CommandError(ACK_ERROR_ARG, 'wrong number of arguments for "%s"' % args[0])
+        except ValueError:
+            raise CommandError(ACK_ERROR_ARG, 'invalid argument for "%s"' % args[0])
+
+    def _run_command_list(self, commands):
+        response = []
+        for i, line in enumerate(commands):
+            try:
+                args = _split_args(line)
+                if args and args[0] in ('idle', 'noidle', 'command_list_begin', 'command_list_ok_begin'):
+                    raise CommandError(ACK_ERROR_NOT_LIST, '"%s" not allowed in command list' % args[0])
+                result = self._run_command(args)
+            except CommandError as e:
+                # whatever the commands before this one sent still goes out
+                self._send(self._format(response, None))
+                self._error(e, line, i)
+                return
+            response += result or []
+            if self.command_list_ok:
+                response.append(('list_OK', None))
+        self._respond(response)
+
+    def _error(self, error, line, index):
+        command = line.split(' ', 1)[0]
+        self._send(('ACK [%d@%d] {%s} %s\n' % (error.code, index, command, error.message)).encode('utf8'))
+
+    @staticmethod
+    def _format(response, ending=b'OK\n'):
+        out = []
+        for key, value in response:
+            if key == 'list_OK':
+                out.append(b'list_OK\n')
+            elif isinstance(value, bytes):
+                out.append(b'binary: %d\n' % len(value) + value + b'\n')
+            else:
+                out.append(('%s: %s\n' % (key, value)).encode('utf8'))
+        if ending:
+            out.append(ending)
+        return b''.join(out)
+
+    def _respond(self, response):
+        self._send(self._format(response))
+
+    def _send(self, data):
+        server = self.server
+        if not server.latency and not server.chunk_size and not self._outgoing:
+            self.transport.write(data)
+            return
+        self._outgoing.append((server._loop.time() + server.latency, data))
+        if self._pump_handle is None:
+            self._pump_handle = server._loop.call_at(self._outgoing[0][0], self._pump)
+
+    def _pump(self):
+        # Writes one piece of the oldest response per call, so the pieces go out in order with a trip round the event
+        # loop (or chunk_delay) in between.
+        self._pump_handle = None
+        if self.transport.is_closing():
+            self._outgoing.clear()
+            return
+        server = self.server
+        when, data = self._outgoing.popleft()
+        chunk_size = server.chunk_size or len(data)
+        self.transport.write(data[:chunk_size])
+        if len(data) > chunk_size:
+            self._outgoing.appendleft((when, data[chunk_size:]))
+            self._pump_handle = server._loop.call_later(server.chunk_delay, self._pump)
+        elif self._outgoing:
+            self._pump_handle = server._loop.call_at(max(self._outgoing[0][0], server._loop.time()), self._pump)
+
+
+if __name__ == '__main__':
+    # the jukebox connects to localhost:6600, so this lets it run on a machine without MPD (with fake_lcd for the rest)
+    import argparse
+    parser = argparse.ArgumentParser(description='Run a stand-in MPD server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6600)
+    parser.add_argument('--unix', metavar='PATH', help='listen on a Unix socket instead of TCP')
+    parser.add_argument('--artists', type=int, default=10, help='library size (each artist has 5 albums of 12 songs)')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--chunk-size', type=int)
+    parser.add_argument('--chunk-delay', type=float, default=0.0)
+    parser.add_argument('--music-directory', help='add the files under here to the library when asked to update')
+    args = parser.parse_args()
+    loop = asyncio.get_event_loop()
+    server = FakeMPDServer(FakeLibrary(args.artists), latency=args.latency, chunk_size=args.chunk_size,
+                           chunk_delay=args.chunk_delay, music_directory=args.music_directory, loop=loop)
+    if args.unix:
+        print('listening on', loop.run_until_complete(server.start_unix(args.unix)))
+    else:
+        print('listening on', loop.run_until_complete(server.start(args.host, args.port)))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        server.close()
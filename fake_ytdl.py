@@ -0,0 +1,60 @@
+"""A stand-in for yt_dlp.YoutubeDL, for testing jukebox.youtube without yt-dlp or a connection to YouTube.
+
+    youtube = jukebox.youtube.YouTube(ytdl_class=fake_ytdl.FakeYoutubeDL)
+
+It only does the parts of extract_info() that jukebox.youtube uses: ytsearch queries, which come back as a generator
+the way yt-dlp's own do, looking up a video's stream URL, and downloading it, which writes a file of junk the size of
+download_size.  Every query has search_results results, and every video exists, except that IDs starting with 'gone'
+fail the way deleted videos do.
+"""
+import os
+import re
+import time
+import urllib.parse
+
+__all__ = ['FakeYoutubeDL', 'FakeDownloadError']
+
+_SEARCH = re.compile(r'ytsearch(\d*|all):(.*)', re.DOTALL)
+
+
+class FakeDownloadError(Exception):
+    pass
+
+
+class FakeYoutubeDL:
+    search_results = 12
+    # how long the stream URLs it hands out work for
+    stream_lifetime = 6 * 3600
+    download_size = 1000
+
+    def __init__(self, params=None):
+        self.params = dict(params or {})
+
+    def extract_info(self, url, download=False, process=True):
+        match = _SEARCH.match(url)
+        if match:
+            count, query = match.groups()
+            count = self.search_results if count in ('', 'all') else min(int(count), self.search_results)
+            return {'_type': 'playlist', 'id': query, 'title': query, 'entries': self._search_results(query, count)}
+        video_id = urllib.parse.parse_qs(urllib.parse.urlparse(url).query).get('v', [url])[0]
+        if video_id.startswith('gone'):
+            raise FakeDownloadError('ERROR: [youtube] %s: Video unavailable' % video_id)
+        info = {'id': video_id, 'title': 'Video ' + video_id, 'uploader': 'Uploader of ' + video_id, 'ext': 'opus',
+                'url': 'https://rr1---sn-fake.googlevideo.com/videoplayback?expire=%d&id=%s'
+                       % (time.time() + self.stream_lifetime, video_id)}
+        if download:
+            path = self.prepare_filename(info)
+            with open(path, 'wb') as f:
+                f.write(bytes(self.download_size))
+            info['requested_downloads'] = [{'filepath': path}]
+        return info
+
+    def prepare_filename(self, info):
+        return self.params.get('outtmpl', '%(id)s.%(ext)s') % info
+
+    @staticmethod
+    def _search_results(query, count):
+        for i in range(count):
+            video_id = '%s-%d' % (query.replace(' ', '-'), i)
+            yield {'_type': 'url', 'ie_key': 'Youtube', 'id': video_id, 'title': '%s %d' % (query, i),
+                   'url': 'https://www.youtube.com/watch?v=' + video_id, 'channel': 'Channel %d' % (i % 3)}
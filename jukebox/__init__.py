@@ -10,13 +10,19 @@ import asyncio
 
 import my_aiompd
 from .screen import BaseScreen, EncoderTickWatcher
+from .state import PlayerState
 from .util import Buttons
 
 import ruamel.yaml
 
 BACKLIGHT_PWM_HZ = 5000
 
-DEFAULTS = {'text scroll time': 0.5, 'text scroll first time': 1.5, 'text scroll gap': 5}
+DEFAULTS = {'text scroll time': 0.5, 'text scroll first time': 1.5, 'text scroll gap': 5,
+            # only keep the songs around the current one, instead of a copy of the whole queue.
+            'lazy queue': False,
+            # add the artists and titles in the library to what the search screens guess you're typing, as well as
+            # what's been searched for before
+            'predict from library': False}
 
 
 class LCD:
@@ -272,8 +278,13 @@ class Display:
         if self.config is None:
             self.config = DEFAULTS.copy()
 
+        # kept up to date in the background for the screens to read from, so they don't each have to ask the server
+        self.player_state = PlayerState(mpdclient, self._loop,
+                                        lazy_queue=self.config.get('lazy queue', DEFAULTS['lazy queue']))
+        self.player_state.start()
 
     def shutdown(self):
+        self.player_state.stop()
         with open(self._config_location, 'w') as f:
             ruamel.yaml.safe_dump(self.config, f)
         # if we don't do this, after a few times rerunning the script, pigpiod will run out of resources
@@ -1,23 +1,30 @@
-from jukebox import Display, RotaryEncoder, LCD
+from jukebox import Display, RotaryEncoder, LCD, DEFAULTS
+from jukebox.predict import Predictor
 from jukebox.screen import Screen
 from jukebox.screen.alarm import AlarmClock
 from jukebox.screen.directory import Directory
+from jukebox.screen.library import LibraryBrowser
 from jukebox.screen.mpd import NowPlaying
+from jukebox.screen.numeric import VolumeControl
 from jukebox.screen.clock import Clock
 import pigpio
 import asyncio
 import my_aiompd
 from jukebox.screen.ytsearch import YTSearch
+from jukebox.youtube import YouTube, StreamRefresher, AudioCache
+from jukebox.screen.search import LibrarySearch
 import time
 
 
 if __name__ == '__main__':
     pi = pigpio.pi()
     print('pi connected')
+    youtube = None
+    audio_cache = None
     try:
         display = Display(
             pi,
-            my_aiompd.Client(),
+            my_aiompd.Client(dedicated_idle=True),
             LCD(pi, d4=24, d5=23, d6=22, d7=27, rs=6, e=5,
                 bl_red=18, bl_green=17, bl_blue=4  # PWM pins for common-anode RGB backlight
                 ),
@@ -41,12 +48,35 @@ if __name__ == '__main__':
             main_menu.children.append(('Now Playing', now_playing))
             clock = Clock(display, main_menu)
             main_menu.children.append(('Clock', clock))
-            main_menu.children.append(('YouTube search', YTSearch(display, main_menu, now_playing)))
+            main_menu.children.append(('Volume', VolumeControl(display, main_menu)))
+            LibraryBrowser('Browse library', main_menu, now_playing)  # adds itself to main_menu
+            library_predictor = Predictor(display.config, 'library history')
+            youtube_predictor = Predictor(display.config, 'youtube history')
+            if display.config.get('predict from library', DEFAULTS['predict from library']):
+                for predictor in (library_predictor, youtube_predictor):
+                    asyncio.get_event_loop().create_task(predictor.add_library_words(display.mpd_client))
+            main_menu.children.append(('Search library', LibrarySearch(display, main_menu, now_playing,
+                                                                       library_predictor)))
+            youtube = YouTube()
+            refresher = StreamRefresher(display.mpd_client, youtube, display.player_state)
+            refresher.start()
+            # e.g. {'directory': '/var/lib/mpd/music/youtube', 'mpd path': 'youtube', 'max size': 2000} (megabytes)
+            cache_config = display.config.get('youtube cache')
+            if cache_config:
+                audio_cache = AudioCache(youtube, display.mpd_client, cache_config['directory'],
+                                         cache_config['mpd path'], cache_config['max size'] * 1024 * 1024)
+                audio_cache.add_listener(refresher.use_local)
+            main_menu.children.append(('YouTube search', YTSearch(display, main_menu, now_playing, youtube,
+                                                                  refresher, audio_cache, youtube_predictor)))
             main_menu.children.append(('Alarm (beta)', AlarmClock(display, main_menu)))
             display.switch_screen(main_menu)
             display.mainloop()  # run one iteration of the main loop and schedule the next one
             asyncio.get_event_loop().run_forever()
         finally:
+            if audio_cache is not None:
+                audio_cache.close()
+            if youtube is not None:
+                youtube.shutdown()
             display.shutdown()  # the destructor calls this, but it must run before pi.stop() happens.
     finally:
         pi.stop()
@@ -0,0 +1,149 @@
+from typing import Optional
+
+from unidecode import unidecode_expect_ascii as unidecode
+
+import my_aiompd
+
+ALPHABET = b' abcdefghijklmnopqrstuvwxyz'
+
+
+class _Node:
+    __slots__ = ('children', 'weight', 'end_weight', 'best')
+
+    def __init__(self):
+        self.children = {}  # character (an int) -> _Node
+        self.weight = 0  # total weight of everything that goes through here, for ranking it against its siblings
+        self.end_weight = 0  # total weight of the text that ends here, however many times it's been added
+        self.best: Optional[tuple] = None  # (end_weight, text) of the likeliest thing that starts with this prefix
+
+
+class Predictor:
+    """Guesses what's being typed into a TextInputScreen from what's been typed into it before, and optionally from the
+    artists and titles in the library.
+
+    The guesses come from a trie, where each node knows which of its children are likeliest and the single likeliest
+    complete entry below it, so the work per keystroke is one step down the trie no matter how much is in it.  Past
+    queries are kept in display.config under `key` (at most max_history of them), so they survive restarts.  The trie
+    stops taking library words once it's max_nodes big, so a huge library costs no more than a small one.
+    """
+    max_history = 200
+    max_nodes = 20000
+    # how much one past query counts for compared to one word from the library
+    history_weight = 10
+
+    def __init__(self, config: dict, key, alphabet=ALPHABET):
+        self.config = config
+        self.key = key
+        self.alphabet = alphabet
+        self._allowed = frozenset(alphabet)
+        self._library_words = []
+        self._build()
+
+    def _build(self):
+        self._root = _Node()
+        self._nodes = 1
+        for query in self.config.get(self.key, ()):
+            self._add(self.normalise(query), self.history_weight)
+        for word in self._library_words:
+            if not self._add(word, 1, limit=True):
+                break
+
+    def normalise(self, text) -> bytes:
+        """Boil text down to what can be typed with the alphabet: ASCII, lower case, and single spaces.
+        """
+        if isinstance(text, (bytes, bytearray)):
+            text = text.decode('ascii', 'replace')
+        text = unidecode(text).lower().encode('ascii', 'replace')
+        words = (bytes(c for c in word if c in self._allowed) for word in text.split())
+        return b' '.join(word for word in words if word)
+
+    def _add(self, text: bytes, weight, limit=False):
+        """Add `weight` to `text` and all its prefixes.  With `limit`, adds nothing and returns False if it would take
+        the trie over max_nodes.  Weight added to the same text more than once adds up, and a prefix's best guess only
+        changes to a different text once that text's total is more than the best guess's (so ties go to whichever got
+        there first).
+        """
+        if not text:
+            return True
+        if limit:
+            node, new = self._root, 0
+            for c in text:
+                node = node.children.get(c) if node is not None else None
+                if node is None:
+                    new += 1
+            if self._nodes + new > self.max_nodes:
+                return False
+        path = [self._root]
+        node = self._root
+        for c in text:
+            child = node.children.get(c)
+            if child is None:
+                child = node.children[c] = _Node()
+                self._nodes += 1
+            node = child
+            path.append(node)
+        node.end_weight += weight
+        total = node.end_weight
+        for node in path:
+            node.weight += weight
+            if node.best is None or node.best[1] == text or total > node.best[0]:
+                node.best = (total, text)
+        return True
+
+    def remember(self, text):
+        """Record that `text` was searched for.
+        """
+        text = self.normalise(text)
+        if not text:
+            return
+        # Repeats are kept, so that something searched for often still counts for more after the trie is rebuilt.
+        history = list(self.config.get(self.key, ()))
+        history.append(text.decode('ascii'))
+        dropped = len(history) > self.max_history
+        self.config[self.key] = history[-self.max_history:]
+        if dropped:
+            # Taking weight back out would leave stale best guesses all the way up; starting again is simpler, and
+            # only happens once every so often.
+            self._build()
+        else:
+            self._add(text, self.history_weight)
+
+    async def add_library_words(self, client: my_aiompd.Client, tags=('artist', 'title')):
+        """Add every value of `tags` in the library, for as long as there's room.
+        """
+        for tag in tags:
+            key = tag.capitalize()
+            async for value in client.stream_command('list', tag, delimiters=frozenset([key]),
+                                                     record_type=lambda pairs: pairs[0][1]):
+                word = self.normalise(value)
+                if not word:
+                    continue
+                self._library_words.append(word)
+                if not self._add(word, 1, limit=True):
+                    self._library_words.pop()
+                    return
+
+    def lookup(self, prefix: bytes, node: Optional[_Node] = None, start=0) -> Optional[_Node]:
+        """The node for `prefix`, or None if nothing known starts with it.  If the node for prefix[:start] is already
+        known, pass it as `node`, and only the rest of the way is walked.
+        """
+        if node is None:
+            node, start = self._root, 0
+        for c in prefix[start:]:
+            node = node.children.get(c)
+            if node is None:
+                return None
+        return node
+
+    def order(self, node: Optional[_Node], charset: bytes) -> bytes:
+        """`charset`, with whatever's likeliest to come after `node` first, and the rest in the order they were in.
+        """
+        if node is None or not node.children:
+            return charset
+        likely = sorted((c for c in node.children if c in charset), key=lambda c: -node.children[c].weight)
+        chosen = set(likely)
+        return bytes(likely) + bytes(c for c in charset if c not in chosen)
+
+    @staticmethod
+    def completion(node: Optional[_Node]) -> Optional[bytes]:
+        return node.best[1] if node is not None and node.best is not None else None
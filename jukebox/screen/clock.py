@@ -4,6 +4,42 @@ import time
 
 COLORS = ((0,0),(0,1),(0.25,1),(0.5,1),(0.75,1))
 
+# Segments for drawing digits three characters wide and two lines tall, uploaded to CGRAM 0-7.
+BIG_DIGIT_CHARACTERS = bytes((
+    # 0: top left corner
+    0b00111, 0b01111, 0b11111, 0b11111, 0b11111, 0b11111, 0b11111, 0b11111,
+    # 1: bar along the top
+    0b11111, 0b11111, 0b11111, 0b00000, 0b00000, 0b00000, 0b00000, 0b00000,
+    # 2: top right corner
+    0b11100, 0b11110, 0b11111, 0b11111, 0b11111, 0b11111, 0b11111, 0b11111,
+    # 3: bottom left corner
+    0b11111, 0b11111, 0b11111, 0b11111, 0b11111, 0b11111, 0b01111, 0b00111,
+    # 4: bar along the bottom
+    0b00000, 0b00000, 0b00000, 0b00000, 0b00000, 0b11111, 0b11111, 0b11111,
+    # 5: bottom right corner
+    0b11111, 0b11111, 0b11111, 0b11111, 0b11111, 0b11111, 0b11110, 0b11100,
+    # 6: bars along the top and bottom, for the top half of 2, 3, 5, 6, 8 and 9
+    0b11111, 0b11111, 0b11111, 0b00000, 0b00000, 0b00000, 0b11111, 0b11111,
+    # 7: thin bar along the top and thick one along the bottom, for the bottom half of 5
+    0b11111, 0b00000, 0b00000, 0b00000, 0b00000, 0b11111, 0b11111, 0b11111,
+))
+
+# (top line, bottom line) for each digit.  0xff is the solid block from the character ROM.
+BIG_DIGITS = (
+    (b'\x00\x01\x02', b'\x03\x04\x05'),
+    (b'\x01\x02 ',     b'\x04\xff\x04'),
+    (b'\x06\x06\x02', b'\x03\x04\x04'),
+    (b'\x06\x06\x02', b'\x04\x04\x05'),
+    (b'\x03\x04\xff', b'  \xff'),
+    (b'\xff\x06\x06', b'\x07\x04\x05'),
+    (b'\x00\x06\x06', b'\x03\x04\x05'),
+    (b'\x01\x01\x02', b'  \xff'),
+    (b'\x00\x06\x02', b'\x03\x04\x05'),
+    (b'\x00\x06\x02', b'  \xff'),
+)
+# the middle dot from the character ROM, one on each line
+BIG_COLON = b'\xa5'
+
 class Clock(Screen):
     def __init__(self, display, next_screen):
         super().__init__(display, next_screen)
@@ -13,33 +49,94 @@ class Clock(Screen):
         self.twenty_four_hour = False
         self.color = 0
         self.brightness = 0
+        self.big_digits = True
+        self._frame = None  # the (top, bottom) lines as they are on the LCD, so only what's changed gets sent
+        self._update_callback = None
 
     def on_switched_to(self):
         self.display.lcd.set_color(*COLORS[self.color])
+        self.display.lcd.upload_custom_chars(BIG_DIGIT_CHARACTERS)
+        self._redraw()
+        self.brightness = int(self.display.lcd.backlight_brightness * 256)
+
+    def _redraw(self):
         self.display.clear()
+        self._frame = (b' ' * 16, b' ' * 16)
         self.show_time()
-        self.brightness = int(self.display.lcd.backlight_brightness * 256)
 
     def show_time(self):
         t = time.time()
-        index = (self.twenty_four_hour) << 2 | (self.seconds_shown) << 1 | (self.blinking and t % 1 > 0.5)
-        format = ('%I:%M %p', '%I %M %p', '%I:%M:%S %p', '%I %M %S %p',
-                  '%H:%M',    '%H %M',    '%H:%M:%S',    '%H %M %S')[index]
-        string = time.strftime(format)
-        self.display.write(0, string.center(16))
-        self.display.call_later(0.5 - t % 0.5, self.show_time)
+        colon_off = self.blinking and t % 1 >= 0.5
+        if self.big_digits:
+            frame = self._big_frame(time.localtime(t), colon_off)
+        else:
+            index = (self.twenty_four_hour) << 2 | (self.seconds_shown) << 1 | colon_off
+            format = ('%I:%M %p', '%I %M %p', '%I:%M:%S %p', '%I %M %S %p',
+                      '%H:%M',    '%H %M',    '%H:%M:%S',    '%H %M %S')[index]
+            frame = (time.strftime(format, time.localtime(t)).center(16).encode('ascii'), b' ' * 16)
+        for line, (old, new) in enumerate(zip(self._frame, frame)):
+            self._write_changes(line * 64, old, new)
+        self._frame = frame
+        # Nothing changes in between seconds, except the colon going off halfway through one when it's blinking.
+        # (+1ms, so the callback doesn't land a hair before the boundary and show the second that's just ending)
+        period = 0.5 if self.blinking else 1
+        if self._update_callback is not None:
+            self._update_callback.cancel()
+        self._update_callback = self.display.call_later(period - t % period + 0.001, self.show_time)
+
+    def _write_changes(self, column, old, new):
+        # one write per run of changed characters, which is usually just the digit that's ticked over
+        start = None
+        for i in range(len(new) + 1):
+            changed = i < len(new) and old[i] != new[i]
+            if changed and start is None:
+                start = i
+            elif not changed and start is not None:
+                self.display.write(column + start, new[start:i])
+                start = None
+
+    def _big_frame(self, now: time.struct_time, colon_off):
+        """The time in digits two lines tall, as HH:MM with the seconds small in the top right corner and AM/PM
+        underneath them, when they're shown.
+        """
+        hour = now.tm_hour if self.twenty_four_hour else (now.tm_hour - 1) % 12 + 1
+        digits = '%2d%02d' % (hour, now.tm_min) if not self.twenty_four_hour else '%02d%02d' % (hour, now.tm_min)
+        top, bottom = bytearray(), bytearray()
+        for i, digit in enumerate(digits):
+            if i == 2:
+                colon = b' ' if colon_off else BIG_COLON
+                top += colon
+                bottom += colon
+            upper, lower = BIG_DIGITS[int(digit)] if digit != ' ' else (b'   ', b'   ')
+            top += upper
+            bottom += lower
+        corner_top = '%02d' % now.tm_sec if self.seconds_shown else '  '
+        corner_bottom = ('AM' if now.tm_hour < 12 else 'PM') if not self.twenty_four_hour else '  '
+        if corner_top.strip() or corner_bottom.strip():
+            top += b' ' + corner_top.encode('ascii')
+            bottom += b' ' + corner_bottom.encode('ascii')
+            return bytes(top), bytes(bottom)
+        return bytes(top).center(16), bytes(bottom).center(16)
+
+    @on_button_pressed(Buttons.ENCODER)
+    def toggle_big_digits(self):
+        self.big_digits = not self.big_digits
+        self._redraw()
 
     @on_button_pressed(Buttons.PAUSE)
     def toggle_blink(self):
         self.blinking = not self.blinking
+        self.show_time()
 
     @on_button_pressed(Buttons.REPEAT)
     def toggle_24hr(self):
         self.twenty_four_hour = not self.twenty_four_hour
+        self.show_time()
 
     @on_button_pressed(Buttons.SHUFFLE)
     def toggle_seconds(self):
         self.seconds_shown = not self.seconds_shown
+        self.show_time()
 
     @on_button_pressed(Buttons.PREVIOUS)
     def previous_color(self):
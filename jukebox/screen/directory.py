@@ -36,6 +36,24 @@ class Directory(BaseScreen):
         self.cursor += n
         self.show()
 
+    # The entries are looked up through these, rather than by going to self.children directly, so that a subclass can
+    # list something other than a fixed set of screens (see LibraryBrowser).
+    def entry_count(self):
+        return len(self.children)
+
+    def entry_name(self, index):
+        return self.children[index][0]
+
+    def open_entry(self, index):
+        self.display.switch_screen(self.children[index][1])
+
+    def go_back(self):
+        self.display.switch_screen(self.parent)
+
+    def back_name(self):
+        # what slides in from the left on the way back
+        return self.parent.name
+
     @on_button_pressed(Buttons.PAUSE)
     @on_button_pressed(Buttons.ENCODER)
     async def enter(self):
@@ -43,19 +61,19 @@ class Directory(BaseScreen):
         lcd = self.display.lcd
         if self.cursor == -1:
             # 114 = 128 - 16 + 2
-            self.display.write(114, self.children[self.cursor][0])
+            self.display.write(114, self.back_name())
             for i in range(16):
                 lcd._lcd_write(0b11100, False)
                 await asyncio.sleep(0.1)
             self.disallow_popups = False
-            self.display.switch_screen(self.parent)
+            self.go_back()
         else:
-            self.display.write(18, self.children[self.cursor][0])
+            self.display.write(18, self.entry_name(self.cursor))
             for i in range(16):
                 lcd._lcd_write(0b11000, False)
                 await asyncio.sleep(0.1)
             self.disallow_popups = False
-            self.display.switch_screen(self.children[self.cursor][1])
+            self.open_entry(self.cursor)
 
     def on_switched_to(self):
         self.display.lcd.set_color(0, 0)  # set display to white (hue 0 saturation 0)
@@ -65,14 +83,14 @@ class Directory(BaseScreen):
         self.show()
 
     def show(self):
-        if self.cursor >= len(self.children):
-            self.cursor = len(self.children) - 1
+        if self.cursor >= self.entry_count():
+            self.cursor = self.entry_count() - 1
         if self.cursor < -1:
             self.cursor = -1
         if self.cursor == -1 and self.parent is None:
             self.cursor = 0
         self.display.write(64,
-                           (self.children[self.cursor][0] if self.cursor >= 0 else 'Back').ljust(16).encode('ascii'))
+                           (self.entry_name(self.cursor) if self.cursor >= 0 else 'Back').ljust(16).encode('ascii'))
 
 
 
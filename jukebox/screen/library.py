@@ -0,0 +1,198 @@
+import asyncio
+import collections
+from typing import Optional
+
+from unidecode import unidecode_expect_ascii as unidecode
+
+import my_aiompd
+from .directory import Directory
+
+
+def _entry(pairs):
+    """Boil an lsinfo record down to what the browser needs: (kind, uri, label), where kind is 'directory', 'file' or
+    'playlist' and label is what gets shown for it.
+    """
+    kind, uri = pairs[0]
+    label = None
+    if kind == 'file':
+        for key, value in pairs:
+            if key == 'Title':
+                label = value
+                break
+    if label is None:
+        label = uri.rpartition('/')[2]
+    return kind, uri, unidecode(label)
+
+
+class _Listing:
+    """The entries of one directory, filled in as lsinfo streams in, so that the first screenful can be shown long
+    before the last one has arrived.
+    """
+    def __init__(self, loop):
+        self.entries = []
+        self.complete = False
+        self.error: Optional[Exception] = None
+        self.cursor = 0  # where the cursor was the last time we were in here
+        self.task: Optional[asyncio.Task] = None
+        self._loop = loop
+        self._waiter: Optional[asyncio.Future] = None
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def wait_for(self, index):
+        """Wait until entry `index` has arrived, or it turns out there isn't one.
+        """
+        while index >= len(self.entries) and not self.complete:
+            if self._waiter is None or self._waiter.done():
+                self._waiter = self._loop.create_future()
+            await asyncio.shield(self._waiter)
+
+
+class LibraryBrowser(Directory):
+    """Browse the music library like a Directory: one entry per line, the knob or PREVIOUS/NEXT to move, and ENCODER
+    or PAUSE to go into a folder, or to queue up and play a song or playlist.
+
+    Listings come from lsinfo, which can't be asked for a range, so instead they're streamed: whatever the cursor is
+    on is shown as soon as it arrives, and the rest carries on arriving in the background a page at a time.  Only the
+    most recently visited directories are kept (each with where the cursor was): no more than cache_size of them, and
+    no more than max_entries entries between them, each boiled down to what it takes to show it.  The one you're in is
+    always kept whole, though, however big it is, since lsinfo has no way to send only part of it.
+    """
+    # entries that arrive before anyone waiting for one is woken up
+    page_size = 16
+    cache_size = 8
+    max_entries = 2000
+
+    def __init__(self, name: str, parent, next_screen):
+        super().__init__(name, parent)
+        self.success_screen = next_screen
+        self.path = ''
+        self._listings = collections.OrderedDict()  # path -> _Listing, least recently used first
+        self._listing: Optional[_Listing] = None
+        self._show_task: Optional[asyncio.Task] = None
+        # Never waited on; only looked at to see whether the cached listings are out of date.
+        self._database_changes = self.display.mpd_client.subscribe_idle('database')
+
+    def _get_listing(self, path):
+        if self._database_changes.get_nowait():
+            for listing in self._listings.values():
+                listing.task.cancel()
+            self._listings.clear()
+        listing = self._listings.get(path)
+        if listing is not None:
+            self._listings.move_to_end(path)
+            return listing
+        listing = self._listings[path] = _Listing(asyncio.get_event_loop())
+        # persistent, so that a listing keeps coming in if you go into a folder before it's finished
+        listing.task = self.display.create_task(self._fill(listing, path), persist=True)
+        self._evict()
+        return listing
+
+    def _evict(self):
+        # least recently used first, and never the most recent one, which is the one we're in
+        total = sum(len(listing.entries) for listing in self._listings.values())
+        while len(self._listings) > 1 and (len(self._listings) > self.cache_size or total > self.max_entries):
+            _, evicted = self._listings.popitem(last=False)
+            evicted.task.cancel()
+            total -= len(evicted.entries)
+
+    async def _fill(self, listing: _Listing, path):
+        args = (path,) if path else ()
+        try:
+            async for entry in self.display.mpd_client.stream_command('lsinfo', *args, record_type=_entry):
+                listing.entries.append(entry)
+                if len(listing.entries) % self.page_size == 0:
+                    listing._wake()
+                    self._evict()
+            self._evict()
+        except (my_aiompd.MPDError, ConnectionError) as e:
+            listing.error = e
+            # try again next time
+            if self._listings.get(path) is listing:
+                del self._listings[path]
+        finally:
+            listing.complete = True
+            listing._wake()
+
+    def _title(self, path):
+        return unidecode(path.rpartition('/')[2]) if path else self.name
+
+    def on_switched_to(self, path=None):
+        if self._listing is not None:
+            self._listing.cursor = self.cursor
+        self.path = path or ''
+        self._listing = self._get_listing(self.path)
+        self.cursor = self._listing.cursor
+        self.display.lcd.set_color(0, 0)
+        self.display.clear()
+        self.display.write(0, b'  ' + self._title(self.path)[:14].encode('ascii'))
+        self.show()
+
+    def entry_count(self):
+        return len(self._listing.entries)
+
+    def entry_name(self, index):
+        if index >= len(self._listing.entries):
+            return 'Loading...'
+        return self._listing.entries[index][2]
+
+    def show(self):
+        listing = self._listing
+        if listing.complete and self.cursor >= len(listing.entries):
+            self.cursor = len(listing.entries) - 1
+        if self.cursor < -1:
+            self.cursor = -1
+        if self._show_task is not None:
+            self._show_task.cancel()
+            self._show_task = None
+        if listing.error is not None and not listing.entries:
+            text = 'Error'
+        elif self.cursor == -1:
+            text = 'Back'
+        else:
+            text = self.entry_name(self.cursor)
+            if self.cursor >= len(listing.entries):
+                self._show_task = self.display.create_task(self._show_when_loaded(listing, self.cursor))
+        self.display.write(64, text[:16].ljust(16).encode('ascii'))
+
+    async def _show_when_loaded(self, listing, index):
+        await listing.wait_for(index)
+        self._show_task = None
+        if listing is self._listing:
+            self.show()
+
+    def open_entry(self, index):
+        if index >= len(self._listing.entries):
+            # Went in before it had arrived.  Come back to the same place, which also puts the display back where it
+            # was after the animation.
+            self.display.switch_screen(self, self.path)
+            return
+        kind, uri, label = self._listing.entries[index]
+        if kind == 'directory':
+            self.display.switch_screen(self, uri)
+        else:
+            self.display.create_task(self._play(kind, uri))
+
+    async def _play(self, kind, uri):
+        client = self.display.mpd_client
+        if kind == 'playlist':
+            position = dict(await client.send_command('status'))['playlistlength']
+            await client.send_command('load', uri)
+            await client.send_command('play', position)
+        else:
+            id_ = dict(await client.send_command('addid', uri))['Id']
+            await client.send_command('playid', id_)
+        self.display.switch_screen(self.success_screen)
+
+    def go_back(self):
+        if self.path:
+            self.display.switch_screen(self, self.path.rpartition('/')[0])
+        else:
+            super().go_back()
+
+    def back_name(self):
+        if self.path:
+            return self._title(self.path.rpartition('/')[0])
+        return super().back_name()
@@ -1,4 +1,5 @@
 import asyncio
+import collections
 import posixpath
 import pprint
 import urllib.parse
@@ -6,7 +7,7 @@ from unidecode import unidecode_expect_ascii as unidecode
 
 from . import Screen, on_button_pressed, on_button_held
 from ..util import Buttons
-from my_aiompd import Client
+from my_aiompd import Client, Song
 import time
 
 
@@ -77,11 +78,80 @@ CUSTOM_CHARACTERS = bytes((
     # # For 0/5 we just use the hyphen, and for 5/5 we use the full block (in the default charset at 0xff)
 ))
 
+def song_title(song: Song) -> str:
+    """What NowPlaying shows for a song: "Artist - Title" if it has tags, otherwise the stream name or the file name,
+    in ASCII.
+    """
+    if song.title is not None:
+        if song.artist is not None:
+            return f"{unidecode(song.artist).strip()} - {unidecode(song.title).strip()}"
+        return unidecode(song.title).strip()
+    if '://' in song.file:
+        pos = song.file.find('#StreamName=')
+        if pos != -1:
+            title = urllib.parse.unquote(song.file[pos+12:])
+        else:
+            title = '[Web Stream]'
+    else:
+        title = posixpath.splitext(posixpath.basename(song.file))[0]
+    return unidecode(title).strip()
+
+
+class TitleCache:
+    """song_title() for queue entries, remembered by song ID, so that repainting on every pause, seek or option change
+    doesn't mean running unidecode over the same tags again.
+
+    An entry is only used if the tags it was made from are still the same, since a stream keeps its ID when its title
+    changes.  (The queue version would tell us that too, but it changes whenever anything anywhere in the queue does.)
+    """
+    max_size = 32
+
+    def __init__(self):
+        # song ID -> (song, file, artist, title, rendered title), least recently used first
+        self._titles = collections.OrderedDict()
+
+    def _lookup(self, song: Song):
+        cached = self._titles.get(song.id)
+        if cached is None:
+            return None
+        # usually it's the very same Song, from the queue copy
+        if cached[0] is song or cached[1:4] == (song.file, song.artist, song.title):
+            return cached
+        return None
+
+    def has(self, song: Song) -> bool:
+        return self._lookup(song) is not None
+
+    def get(self, song: Song) -> str:
+        if song.id is None:
+            return song_title(song)
+        cached = self._lookup(song)
+        if cached is not None:
+            self._titles.move_to_end(song.id)
+            return cached[4]
+        title = song_title(song)
+        self._titles[song.id] = (song, song.file, song.artist, song.title, title)
+        self._titles.move_to_end(song.id)
+        while len(self._titles) > self.max_size:
+            self._titles.popitem(last=False)
+        return title
+
+
+def _time_line(state, elapsed, duration_text):
+    return '%s %2d:%02d / %s' % ('\x00' if state == 'play' else '\x01', elapsed // 60, int(elapsed % 60), duration_text)
+
+
+def _duration_text(duration):
+    return '%d:%02d' % (duration // 60, int(duration % 60)) if duration else '??:??'
+
+
 class NowPlaying(Screen):
+    # When the server says something's happened to playback this close to the end of a song, assume it's gone on to
+    # the next one, and show that straight away instead of waiting to hear back about the status.
+    track_end_window = 2.0
+
     def __init__(self, display, next_screen):
         super().__init__(display, next_screen)
-        self._playlist = []
-        self._playlist_ver = None
         self._shuffle_state = False
         self._repeat_state = 0
         self._song_title = None
@@ -90,6 +160,10 @@ class NowPlaying(Screen):
         self._update_timer_callback = None
         self._status = None
         self._config = {'text wrap gap': 5}
+        self._titles = TitleCache()
+        self._warm_callback = None
+        # (song ID, duration text, title) for the next song, ready to be put up the moment it starts
+        self._next_frame = None
 
     async def on_switched_to(self):
         self.display.lcd.upload_custom_chars(CUSTOM_CHARACTERS)
@@ -100,26 +174,61 @@ class NowPlaying(Screen):
         self._shuffle_state = None
         self._repeat_state = None
         self._status = None
-        await self.on_status_change()
-        while True:
-            for subsys in await self.display.mpd_client.idle('player', 'playlist', 'options'):
-                if subsys in ('player', 'options'):
-                    await self.on_status_change()
-                elif subsys == 'playlist':
-                    await self.on_playlist_change()
+        state = self.display.player_state
+        # The state is kept up to date in the background, so all we have to do is repaint whenever it changes.
+        # Listeners can't be coroutines, so this one just wakes us up.
+        wakeup = asyncio.Event()
+        def on_state_change(changed):
+            wakeup.set()
+        state.add_listener(on_state_change)
+        state.add_listener(self._on_early_change, early=True)
+        try:
+            if not state.synced:
+                await state.wait_synced()
+            while True:
+                wakeup.clear()
+                await self.on_status_change()
+                await wakeup.wait()
+        finally:
+            state.remove_listener(on_state_change)
+            state.remove_listener(self._on_early_change, early=True)
+
+    def _on_early_change(self, changed):
+        state = self.display.player_state
+        if 'player' not in changed or state.state != 'play' or not state.duration or state.elapsed is None:
+            return
+        if state.duration - state.elapsed < self.track_end_window:
+            self._show_next_frame()
+
+    def _show_next_frame(self):
+        """Paint the next song as though it had just started, before the server has told us it has.  The real status
+        follows a round trip later and puts right anything this got wrong.
+        """
+        frame = self._next_frame
+        if frame is None or frame[0] != self.display.player_state.next_song_id:
+            return
+        self._next_frame = None
+        _, duration_text, title = frame
+        state = self.display.player_state.state
+        if self._update_timer_callback:
+            self._update_timer_callback.cancel()
+            self._update_timer_callback = None
+        self.display.write(0, _time_line(state, 0, duration_text))
+        if state == 'play':
+            self._playback_start_time = time.monotonic()
+            self._update_timer_callback = self.display.call_later(1, self._update_timer)
+        self._show_title(title)
 
     async def on_status_change(self):
-        status = self._status = dict(await self.display.mpd_client.send_command('status'))
+        state = self.display.player_state
+        status = self._status = state.status
 
         if self._update_timer_callback:
             self._update_timer_callback.cancel()
             self._update_timer_callback = None
         if status['state'] in ('play', 'pause'):
-            duration = float(status['duration']) if 'duration' in status else None
-            elapsed = float(status['elapsed'])
-            self.display.write(0, '%s %2d:%02d / ' % ('\x00' if status['state'] == 'play' else '\x01',
-                                                             elapsed // 60, int(elapsed % 60)) +
-                               ('%d:%02d' % (duration // 60, int(duration % 60)) if duration else '??:??'))
+            elapsed = state.elapsed
+            self.display.write(0, _time_line(status['state'], elapsed, _duration_text(state.duration)))
             if status['state'] == 'play':
                 self._playback_start_time = time.monotonic() - elapsed
                 # arrange for update_timer to be called precisely at the start of the next integer second.
@@ -128,41 +237,12 @@ class NowPlaying(Screen):
         elif status['state'] == 'stop':
             self.display.write(0, '\x02  Stopped      ')
 
-        if status['playlist'] != self._playlist_ver:
-            await self.on_playlist_change()
-            del self._playlist[int(status['playlistlength']):]
-            self._playlist_ver = status['playlist']
-        if 'song' in status:
-            entry: dict = self._playlist[int(status['song'])]
-            if 'Title' in entry:
-                if 'Artist' in entry:
-                    title = f"{unidecode(entry['Artist']).strip()} - {unidecode(entry['Title']).strip()}"
-                else:
-                    title = unidecode(entry['Title']).strip()
-            else:
-                if '://' in entry['file']:
-                    pos = entry['file'].find('#StreamName=')
-                    if pos != -1:
-                        title = urllib.parse.unquote(entry['file'][pos+12:])
-                    else:
-                        title = '[Web Stream]'
-                else:
-                    title = posixpath.splitext(posixpath.basename(entry['file']))[0]
-                title = unidecode(title).strip()
-        else:
-            title = None
-        if title != self._song_title:
-            if self._song_scroll_callback is not None:
-                self._song_scroll_callback.cancel()
-            self._song_scroll_callback = None
-            self._song_title = title
-            if title is not None:
-                self._song_scroll(0)
-            else:
-                self.display.write(64, ' '*16)
+        # current_song is there as a fallback in case the queue hasn't caught up yet
+        entry = state.queue.get(state.song_pos) or state.current_song
+        self._show_title(self._titles.get(entry) if entry is not None else None)
 
-        shuffle_state = status['random'] == '1'
-        repeat_state = 0 if status['repeat'] == '0' else 2 if status['single'] == '1' else 1
+        shuffle_state = state.random
+        repeat_state = state.repeat_mode
         if shuffle_state != self._shuffle_state:
             self.display.show_popup(3, 'Shuffle On' if shuffle_state else 'Shuffle Off', 2)
         if repeat_state != self._repeat_state:
@@ -175,40 +255,32 @@ class NowPlaying(Screen):
         self._shuffle_state = shuffle_state
         self._repeat_state = repeat_state
 
-    async def on_playlist_change(self):
-        if self._playlist_ver is None:
-            data = await self.display.mpd_client.send_command('playlistinfo')
+        # Get the next song's frame ready now, after the display's been updated, so that it can go up the moment the
+        # song starts.
+        if self._warm_callback is not None:
+            self._warm_callback.cancel()
+            self._warm_callback = None
+        next_entry = state.queue.get(state.next_song_pos)
+        if next_entry is None:
+            self._next_frame = None
+        elif self._next_frame is None or self._next_frame[0] != next_entry.id or not self._titles.has(next_entry):
+            self._warm_callback = self.display.call_later(0, self._prepare_next_frame, next_entry)
+
+    def _prepare_next_frame(self, entry):
+        self._warm_callback = None
+        self._next_frame = (entry.id, _duration_text(entry.duration), self._titles.get(entry))
+
+    def _show_title(self, title):
+        if title == self._song_title:
+            return
+        if self._song_scroll_callback is not None:
+            self._song_scroll_callback.cancel()
+        self._song_scroll_callback = None
+        self._song_title = title
+        if title is not None:
+            self._song_scroll(0)
         else:
-            data = await self.display.mpd_client.send_command('plchanges', self._playlist_ver)
-        item = None
-        for k,v in data:
-            if k == 'file':
-                # The first line of each new entry is always 'file:' so we can use it as a delimiter.
-                if item is not None:
-                    while len(self._playlist) <= item['Pos']:
-                        # pad the playlist with Nones out until we have a slot we can put this item into, in case the
-                        # server sent entries out of order (or in case we're extending the list)
-                        # there shouldn't be any Nones left after we finish.
-                        self._playlist.append(None)
-                    self._playlist[item['Pos']] = item
-                item = {'file':v}
-            else:
-                if k in ('Pos','Id'):
-                    v = int(v)
-                elif k in ('duration',):
-                    v = float(v)
-                item[k] = v
-        # The last item in the list won't have had a file: after it, so the above code won't have put it into the array
-        # item will only be None here if the playlist was empty
-        if item is not None:
-            while len(self._playlist) <= item['Pos']:
-                # pad the playlist with Nones out until we have a slot we can put this item into, in case the
-                # server sent entries out of order (or in case we're extending the list)
-                # there shouldn't be any Nones left after we finish.
-                self._playlist.append(None)
-            self._playlist[item['Pos']] = item
-
-        assert None not in self._playlist
+            self.display.write(64, ' '*16)
 
     def _song_scroll(self, offset):
         gap = self._config['text wrap gap']
@@ -237,12 +309,11 @@ class NowPlaying(Screen):
     @on_button_pressed(Buttons.PAUSE)
     async def play_pause(self):
         await self.display.mpd_client.send_command('pause')
-        await self.on_status_change()
 
     @on_button_pressed(Buttons.NEXT)
     async def next(self):
+        self._show_next_frame()
         await self.display.mpd_client.send_command('next')
-        await self.on_status_change()
 
     # Important note here: this decorator does not modify the class namespace.
     # All this decorator does is flag the function as having an event attached to it, then when the metaclass __init__
@@ -255,13 +326,11 @@ class NowPlaying(Screen):
     @on_button_pressed(Buttons.PREVIOUS)
     async def previous(self):
         await self.display.mpd_client.send_command('previous')
-        await self.on_status_change()
 
     @on_button_pressed(Buttons.SHUFFLE)
     async def toggle_shuffle(self):
-        new_random = 0 if self._status['random'] == '1' else 1
+        new_random = 0 if self.display.player_state.random else 1
         await self.display.mpd_client.send_command('random', str(new_random))
-        await self.on_status_change()
 
     @on_button_held(Buttons.SHUFFLE, 1)
     async def shuffle(self):
@@ -270,10 +339,9 @@ class NowPlaying(Screen):
 
     @on_button_pressed(Buttons.REPEAT)
     async def toggle_repeat(self):
-        new_repeat = (self._repeat_state + 1) % 3
-        await self.display.mpd_client.send_command('repeat', '1' if new_repeat >= 1 else '0')
-        await self.display.mpd_client.send_command('single', '1' if new_repeat == 2 else '0')
-        await self.on_status_change()
+        new_repeat = (self.display.player_state.repeat_mode + 1) % 3
+        await self.display.mpd_client.command_list(('repeat', '1' if new_repeat >= 1 else '0'),
+                                                   ('single', '1' if new_repeat == 2 else '0'))
 
 
 
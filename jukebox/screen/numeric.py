@@ -1,5 +1,9 @@
+import asyncio
+import inspect
 import time
+from typing import Optional
 
+import my_aiompd
 from . import Screen, on_encoder_tick
 
 custom_characters = bytes([
@@ -50,29 +54,76 @@ custom_characters = bytes([
     0b11111,
 ])
 
+
+async def _call(func, *args):
+    """Call a getter or setter, which can be a plain function or a coroutine function.
+    """
+    result = func(*args)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
 class NumericInput(Screen):
-    def __init__(self, display, previous_screen, title, getter, setter, value_min, value_max):
+    """A knob for a number: the value goes up and down with the encoder and is shown as a bar graph on the second line,
+    80 steps across.
+
+    `getter` and `setter` can be coroutine functions, for values that live on the server.  The bar follows the knob
+    straight away, but the setter is only ever called once at a time, with whatever the value has got to by the time
+    the previous call has finished, so spinning the knob sends a handful of commands rather than one per detent.  If
+    `subsystems` are given, the value is read again whenever the server says they've changed (and nothing of ours is
+    on its way), so that changes from elsewhere show up too.
+    """
+    # spinning the knob faster than this many seconds per pulse moves the value further per pulse
+    fast_tick = 0.02
+    fast_step = 4
+
+    def __init__(self, display, previous_screen, title, getter, setter, value_min, value_max, subsystems=()):
         super().__init__(display, previous_screen)
         self.getter = getter
         self.setter = setter
         self.min = value_min
         self.max = value_max
         self.title = title
+        self.subsystems = subsystems
+        self.value = None  # what's being shown, which is what the server will have once our setter calls catch up
         self._last_tick = None
+        self._pending = None  # the latest value the setter hasn't been called with yet
+        self._sender: Optional[asyncio.Task] = None
 
-    def on_switched_to(self):
+    async def on_switched_to(self):
         self.display.clear()
-        self.display.write(0, self.title)
-        # populate the custom  characters
-        # send command byte 0x40 (set data pointer to the first byte of the first custom character)
-        self.display.lcd._lcd_write(0x40, False)
-        # then dump 40 successive bytes to the data register
-        self.display.lcd._lcd_write(custom_characters, True)
-        self.show_value(self.getter())
+        self.display.write(0, self.title[:12])
+        # populate the custom characters
+        self.display.lcd.upload_custom_chars(custom_characters)
+        self.value = None
+        self._pending = None
+        if self.subsystems:
+            with self.display.mpd_client.subscribe_idle(*self.subsystems) as changes:
+                await self._reconcile()
+                async for _ in changes:
+                    await self._reconcile()
+        else:
+            await self._reconcile()
+
+    async def _reconcile(self):
+        if self._pending is not None or (self._sender is not None and not self._sender.done()):
+            # we're about to change it anyway, and whatever we read now would be out of date by then.  The event for
+            # the last of our changes will bring us back here once they're all done.
+            return
+        value = await _call(self.getter)
+        if self._pending is None and (self._sender is None or self._sender.done()) and value != self.value:
+            self.show_value(value)
 
     def show_value(self, current_value):
+        self.value = current_value
+        if current_value is None:
+            self.display.write(12, ' ' * 4)
+            self.display.write(64, b' ' * 16)
+            return
+        self.display.write(12, str(current_value).rjust(4)[:4])
         display_value = int((current_value - self.min) / (self.max - self.min) * 80)
-        full, part = divmod(display_value, 5)
+        full, part = divmod(max(0, min(80, display_value)), 5)
         # each character is 5x8 pixels
         # we're building a bar graph so we need characters that are vertical lines of varying widths.
         # our custom characters are set up as follows:
@@ -83,19 +134,60 @@ class NumericInput(Screen):
         # 0x04 = full block
         # and of course
         # 0x20 = ASCII space = empty
-        data = b'\x04'*full + bytes([ (0x20, 0, 1, 2, 3)[part] ]) + b' '*(16-full-1)
+        data = (b'\x04'*full + bytes([ (0x20, 0, 1, 2, 3)[part] ]) + b' '*(16-full-1))[:16]
         # column 64 is the first character of the second line
         self.display.write(64, data)
 
     @on_encoder_tick(1)
-    def on_tick(self):
+    def on_tick(self, n):
+        if self.value is None:
+            # haven't heard what it is yet
+            return
         now = time.monotonic()
         if self._last_tick is not None:
             time_delta = now - self._last_tick
         else:
             time_delta = 1
+        self._last_tick = now
+
+        if time_delta < self.fast_tick:
+            n *= self.fast_step
+        value = max(self.min, min(self.max, self.value + n))
+        if value == self.value:
+            return
+        self.show_value(value)
+        self._pending = value
+        if self._sender is None or self._sender.done():
+            # persistent, so that the last value still gets sent if the screen is switched away from straight after
+            self._sender = self.display.create_task(self._send(), persist=True)
+
+    async def _send(self):
+        while self._pending is not None:
+            value, self._pending = self._pending, None
+            try:
+                await _call(self.setter, value)
+            except (my_aiompd.MPDError, ConnectionError):
+                # whatever we'd got to next isn't going to work either; put back whatever it really is
+                self._pending = None
+                self.value = None
+                try:
+                    self.show_value(await _call(self.getter))
+                except (my_aiompd.MPDError, ConnectionError):
+                    pass
+                return
 
-        if time_delta < 0.
 
+class VolumeControl(NumericInput):
+    """NumericInput for MPD's volume.
+    """
+    def __init__(self, display, previous_screen, title='Volume'):
+        super().__init__(display, previous_screen, title, self._get_volume, self._set_volume, 0, 100,
+                         subsystems=('mixer',))
 
+    async def _get_volume(self):
+        # -1 (or nothing at all) means there's no mixer
+        volume = int(dict(await self.display.mpd_client.send_command('status')).get('volume', -1))
+        return volume if volume >= 0 else None
 
+    async def _set_volume(self, value):
+        await self.display.mpd_client.send_command('setvol', str(value))
@@ -0,0 +1,100 @@
+from unidecode import unidecode_expect_ascii as unidecode
+
+from . import Screen, on_button_pressed, on_encoder_tick
+from .text_entry import TextInputScreen
+from ..predict import Predictor
+from ..util import Buttons
+
+
+class LibrarySearch(Screen):
+    """Like YTSearch, but for the music library: type something in, then scroll through the songs that have it in any
+    of their tags.  The results come from the server a page at a time as you scroll (see my_aiompd.SearchResults), so
+    searching for "a" doesn't send the whole library down the wire before the first one can be shown.
+    """
+    page_size = 16
+    # start fetching the next page when the cursor gets this close to the end of the current one
+    prefetch_distance = 4
+
+    def __init__(self, display, previous_screen, next_screen, predictor: Predictor = None):
+        super().__init__(display, previous_screen)
+        self.predictor = predictor
+        # see the comment in YTSearch.__init__ about next_screen.
+        self.success_screen = next_screen
+        self.results = None
+        self.pos = 0
+        self._scroll_callback = None
+
+    def on_switched_to(self, query=None):
+        if query is None:
+            self.display.clear()
+            self.display.write(0, 'Search library:')
+            self.display.switch_screen(TextInputScreen(self.display, self, self.next_screen, predictor=self.predictor))
+            return
+        self.results = self.display.mpd_client.search(('any', 'contains', query.decode('ascii').strip()),
+                                                      sort='Artist', page_size=self.page_size)
+        self.pos = 0
+        self.display.create_task(self.show())
+
+    @on_encoder_tick(4)
+    def seek(self, n):
+        self.pos = max(0, self.pos + n)
+        if self.results is not None and self.results.length is not None:
+            self.pos = min(self.pos, max(0, self.results.length - 1))
+        self.display.create_task(self.show())
+
+    @on_button_pressed(Buttons.NEXT)
+    def next(self):
+        self.seek(1)
+
+    @on_button_pressed(Buttons.PREVIOUS)
+    def prev(self):
+        self.seek(-1)
+
+    async def show(self):
+        page = self.results.page(self.pos // self.page_size)
+        if not page.done():
+            if self._scroll_callback is not None:
+                self._scroll_callback.cancel()
+            self.display.clear()
+            self.display.write(0, 'Searching...')
+        song = await self.results.get(self.pos)
+        while song is None:
+            if self.results.length == 0:
+                self.display.clear()
+                self.display.write(0, 'No results')
+                return
+            # Scrolled past the end before we knew where it was.  That can take more than one try if there are fewer
+            # results than there were when the pages before were fetched, but each one brings the length down.
+            self.pos = self.results.length - 1
+            song = await self.results.get(self.pos)
+        if self.pos % self.page_size >= self.page_size - self.prefetch_distance:
+            self.results.prefetch(self.pos // self.page_size + 1)
+        self.display.write(0, unidecode(song.artist or song.albumartist or '')[:16].ljust(16))
+        if self._scroll_callback is not None:
+            self._scroll_callback.cancel()
+        self._scroll_text(unidecode(song.title or song.file), 0)
+
+    @on_button_pressed(Buttons.PAUSE)
+    @on_button_pressed(Buttons.ENCODER)
+    async def select(self):
+        song = await self.results.get(self.pos)
+        if song is None:
+            return
+        id_ = dict(await self.display.mpd_client.send_command('addid', song.file))['Id']
+        await self.display.mpd_client.send_command('playid', id_)
+        self.display.switch_screen(self.success_screen)
+
+    def _scroll_text(self, text, offset):
+        if len(text) <= 16:
+            self.display.write(64, text.ljust(16))
+            return
+        text_to_show = text[offset:offset+16]
+        gap = self.display.config['text scroll gap']
+        if len(text_to_show) < 16:
+            more_text = ' ' * gap + text[:16]
+            start_idx = max(0, offset - len(text_to_show))
+            text_to_show += more_text[start_idx:start_idx + (16 - len(text_to_show))]
+        self.display.write(64, text_to_show)
+        self._scroll_callback = self.display.call_later(self.display.config['text scroll first time'] if offset == 0
+                                                        else self.display.config['text scroll time'],
+                                                        self._scroll_text, text, (offset+1) % (len(text) + gap))
@@ -1,6 +1,9 @@
+from typing import Optional
+
 from jukebox.util import Buttons
 from . import BaseScreen, on_button_pressed, on_encoder_tick, on_button_held, on_button_released
 from .. import Display
+from ..predict import Predictor
 
 CHARACTERS = b' abcdefghijklmnopqrstuvwxyz'
 
@@ -16,9 +19,14 @@ CHARACTERS = b' abcdefghijklmnopqrstuvwxyz'
 # charset, so charsets are effectively each their own self-contained loops rather than being contigouous.
 # I can (and probably should) make this a config option.
 
+# With a Predictor, the characters in each charset are put in order of how likely they are to come next, given what's
+# before the cursor, so that the encoder starts on the likeliest one, and a new cell starts out on it.  The likeliest
+# way to finish the whole thing is shown after the end of the text, and Shuffle fills it in.
+
 class TextInputScreen(BaseScreen):
     disallow_popups = True
-    def __init__(self, display: Display, next_screen, cancel_screen, charsets=(b' abcdefghijklmnopqrstuvwxyz',)):
+    def __init__(self, display: Display, next_screen, cancel_screen, charsets=(b' abcdefghijklmnopqrstuvwxyz',),
+                 predictor: Optional[Predictor] = None):
         super().__init__()
         self.display = display
         self.next_screen = next_screen
@@ -34,6 +42,12 @@ class TextInputScreen(BaseScreen):
         self.selected_charset = self.detected_charset = 0
         self.current_character = 0
         self.last_encoder_position = 0
+        self.predictor = predictor
+        # the charsets as ordered for the cell under the cursor
+        self._ordered_charsets = charsets
+        # the predictor's node for each prefix of entered_text, as far as it's been worked out (and there is one)
+        self._path = [predictor.lookup(b'')] if predictor is not None else []
+        self._completion_shown = False
 
     def on_switched_to(self):
         self.display.reset_rotary_encoder()
@@ -67,9 +81,21 @@ class TextInputScreen(BaseScreen):
         self.selected_charset = self.detected_charset = (self.detected_charset + 1) % len(self.charsets)
         self.cycle(0)
 
+    @on_button_pressed(Buttons.SHUFFLE)
+    def complete(self):
+        completion = self._completion()
+        if completion is None:
+            return
+        self.entered_text[:] = completion
+        self.absolute_offset = len(self.entered_text) - 1
+        del self._path[len(self.entered_text):]
+        self.scroll(0, True)
+
     @on_button_pressed(Buttons.PAUSE)
     @on_button_held(Buttons.ENCODER, 1)
     def accept(self):
+        if self.predictor is not None:
+            self.predictor.remember(self.entered_text)
         # Turn the flashing cursor back off before we switch screens!
         self.display.lcd._lcd_write(0b1100, False)
         # pass self.entered_text as an argument to the next screen's on_switched_to()
@@ -81,8 +107,38 @@ class TextInputScreen(BaseScreen):
         self.display.lcd._lcd_write(0b1100, False)
         self.display.switch_screen(self.cancel_screen)
 
+    def _prefix_node(self, length):
+        """The predictor's node for entered_text[:length], picking up from wherever it was last worked out to.
+        """
+        if length > len(self.entered_text):
+            return None
+        path = self._path
+        while len(path) <= length and path[-1] is not None:
+            path.append(self.predictor.lookup(self.entered_text[len(path) - 1:len(path)], path[-1]))
+        return path[length] if length < len(path) else None
+
+    def _completion(self) -> Optional[bytes]:
+        if self.predictor is None:
+            return None
+        completion = self.predictor.completion(self._prefix_node(len(self.entered_text)))
+        if completion is None or len(completion) <= len(self.entered_text):
+            return None
+        return completion
+
+    def _show_completion(self):
+        completion = self._completion()
+        if completion is None and not self._completion_shown:
+            return
+        self._completion_shown = completion is not None
+        start = len(self.entered_text) - self.display_offset
+        if start >= 16:
+            return
+        tail = completion[len(self.entered_text):] if completion is not None else b''
+        self.display.lcd.write(64 + start, tail[:16 - start].ljust(16 - start))
+        self.display.lcd._lcd_write(0xC0 | (self.absolute_offset - self.display_offset), False)
+
     def cycle(self, n):
-        charset = self.charsets[self.detected_charset]
+        charset = self._ordered_charsets[self.detected_charset]
         charidx = (self.current_character + n) % len(charset)
         if n != 0:
             # don't bother writing back the result of the modulus if we're just cycling through charsets,
@@ -91,22 +147,30 @@ class TextInputScreen(BaseScreen):
             # even though 0-9 only has 10 elements.
             self.current_character = charidx
         character = self.entered_text[self.absolute_offset] = charset[charidx]
-        print(self.entered_text.decode('ascii'), '!')
+        del self._path[self.absolute_offset + 1:]
         offset = self.absolute_offset - self.display_offset
         self.display.lcd.write(offset+64, bytes([character]))
         self.display.lcd._lcd_write(0xC0 | offset, False)
+        if self.predictor is not None:
+            self._show_completion()
 
     def scroll(self, n, force_redraw=False):
         offset = self.absolute_offset = max(0, self.absolute_offset + n)
+        if self.predictor is not None:
+            node = self._prefix_node(offset)
+            self._ordered_charsets = tuple(self.predictor.order(node, charset) for charset in self.charsets)
+            if node is not None and node.children and len(self.entered_text) <= offset:
+                # start the new cell on the likeliest character
+                self.current_character = 0
         if len(self.entered_text) <= self.absolute_offset:
-            charset = self.charsets[self.selected_charset]
+            charset = self._ordered_charsets[self.selected_charset]
             character = charset[self.current_character % len(charset)]
             self.entered_text.extend(character for _ in range(self.absolute_offset - len(self.entered_text) + 1))
             force_redraw = True
             # we're moving into a brand new cell, use the last selected charset.
             # self.detected_charset = self.selected_charset
         else:
-            pos = self.charsets[self.selected_charset].find(self.entered_text[self.absolute_offset])
+            pos = self._ordered_charsets[self.selected_charset].find(self.entered_text[self.absolute_offset])
             if pos != -1:
                 self.detected_charset = self.selected_charset
                 self.current_character = pos
@@ -124,7 +188,7 @@ class TextInputScreen(BaseScreen):
                 # The second state variable, detected_charset, is the one turning the rotary encoder actually picks
                 # characters from, which is automatically switched out based on which character is under the cursor.
                 character = self.entered_text[self.absolute_offset]
-                for i, charset in enumerate(self.charsets):
+                for i, charset in enumerate(self._ordered_charsets):
                     pos = charset.find(character)
                     if pos != -1:
                         self.detected_charset = i
@@ -152,12 +216,19 @@ class TextInputScreen(BaseScreen):
         elif not force_redraw:
             # set cursor position to the second line at the given offset.
             self.display.lcd._lcd_write(0xC0 | screen_cursor_pos, False)
+            if self.predictor is not None:
+                self._show_completion()
             return
         # recompute the display offset
         self.display_offset = self.absolute_offset - screen_cursor_pos
         # display off, cursor off, cursor blink on
         self.display.lcd._lcd_write(0b1100,False)
-        self.display.lcd.write(64, self.entered_text[self.display_offset:self.display_offset+16].ljust(16))
+        line = self.entered_text[self.display_offset:self.display_offset+16]
+        completion = self._completion()
+        self._completion_shown = completion is not None
+        if completion is not None:
+            line += completion[len(self.entered_text):]
+        self.display.lcd.write(64, bytes(line[:16]).ljust(16))
         self.display.lcd._lcd_write(0xC0 | screen_cursor_pos, False)
         # display on, cursor on, cursor blink on
         self.display.lcd._lcd_write(0b1110,False)
@@ -1,23 +1,31 @@
-import urllib.parse
-
 from . import Screen, on_button_pressed, on_encoder_tick
 from .text_entry import TextInputScreen
-import yt_dlp
-from yt_dlp.extractor.youtube import YoutubeSearchIE
-import itertools
 from unidecode import unidecode_expect_ascii as unidecode
 
 from .. import Buttons
+from ..predict import Predictor
+from ..youtube import YouTube, StreamRefresher, AudioCache, mpd_uri
 
 
 class YTSearch(Screen):
-    def __init__(self, display, previous_screen, next_screen):
+    # results to have fetched beyond the one being shown, so that scrolling on doesn't have to wait
+    prefetch = 5
+    # how long the cursor has to stay on a result before we start looking up its stream URL, on the assumption that
+    # it's going to be picked
+    rest_time = 0.5
+
+    def __init__(self, display, previous_screen, next_screen, youtube: YouTube = None,
+                 refresher: StreamRefresher = None, audio_cache: AudioCache = None, predictor: Predictor = None):
         super().__init__(display, previous_screen)
-        self.ytdl = yt_dlp.YoutubeDL({'format': 'bestaudio'})
-        self.iterator = None
-        self.list = None
+        self.predictor = predictor  # if given, helps with typing in the query
+        self.youtube = youtube or YouTube()
+        self.refresher = refresher  # if given, told about everything we add to the queue
+        self.audio_cache = audio_cache  # if given, everything that's picked gets downloaded to it
+        self.results = None
         self.pos = 0
         self._scroll_callback = None
+        self._speculate_handle = None
+        self._speculating = None  # the video ID being looked up because the cursor rested on it
         # perhaps confusingly, the parent class (Screen) stores the previous screen in self.next_screen,
         # because I had written it with the intention of having a main cycle that you could loop through by pressing
         # Mode, and various menus that you could descend into from there.  I may redo it to be that at some point,
@@ -29,27 +37,62 @@ class YTSearch(Screen):
         if query is None:
             self.display.clear()
             self.display.write(0, 'Search query:')
-            self.display.switch_screen(TextInputScreen(self.display, self, self.next_screen))
+            self.display.switch_screen(TextInputScreen(self.display, self, self.next_screen, predictor=self.predictor))
             return
-        self.iterator = YoutubeSearchIE(self.ytdl)._search_results(query.decode('ascii'))
-        self.list = []
+        if self.results is not None:
+            self.results.cancel()
+        # fetched with display.create_task, so that it all stops when we switch away
+        self.results = self.youtube.search(query.decode('ascii'), create_task=self.display.create_task)
         self.pos = 0
         self.seek(0)
 
     @on_encoder_tick(4)
     def seek(self, n):
-        self.pos += n
-        if self.pos >= len(self.list):
+        self.pos = max(0, self.pos + n)
+        if self.results.complete:
+            self.pos = min(self.pos, max(0, len(self.results.entries) - 1))
+        self.display.create_task(self.show())
+
+    async def show(self):
+        pos = self.pos
+        if pos >= len(self.results.entries):
             if self._scroll_callback is not None:
                 self._scroll_callback.cancel()
             self.display.clear()
             self.display.write(0, 'Searching...')
-            self.list.extend(itertools.islice(self.iterator, self.pos-len(self.list)+1))
-        entry = self.list[self.pos]
-        self.display.write(0, unidecode(entry['uploader']).ljust(16))
+        try:
+            entry = await self.results.get(pos)
+        except Exception:
+            self.display.clear()
+            self.display.write(0, 'Search failed')
+            raise
+        if pos != self.pos:
+            # scrolled on while we were waiting; whoever's showing that one can do it
+            return
+        if entry is None:
+            if not self.results.entries:
+                self.display.clear()
+                self.display.write(0, 'No results')
+                return
+            self.pos = pos = len(self.results.entries) - 1
+            entry = self.results.entries[pos]
+        self.results.prefetch(pos + 1 + self.prefetch)
+        self.display.write(0, unidecode(entry['uploader'])[:16].ljust(16))
         if self._scroll_callback is not None:
             self._scroll_callback.cancel()
         self._scroll_text(unidecode(entry['title']), 0)
+        if self._speculate_handle is not None:
+            self._speculate_handle.cancel()
+        self._speculate_handle = self.display.call_later(self.rest_time, self._speculate, entry)
+
+    def _speculate(self, entry):
+        self._speculate_handle = None
+        video_id = entry['id'] or entry['url']
+        if self._speculating is not None and self._speculating != video_id:
+            # don't let the ones we scrolled past hold up this one
+            self.youtube.streams.cancel(self._speculating)
+        self._speculating = video_id
+        self.youtube.streams.prefetch(video_id, entry['url'])
 
     @on_button_pressed(Buttons.NEXT)
     def next(self):
@@ -62,16 +105,31 @@ class YTSearch(Screen):
     @on_button_pressed(Buttons.PAUSE)
     @on_button_pressed(Buttons.ENCODER)
     async def select(self):
-        if self._scroll_callback is not None:
-            self._scroll_callback.cancel()
-        self.display.clear()
-        self.display.write(0, 'Loading...')
-        info = self.ytdl.extract_info(self.list[self.pos]['url'], download=False)
-        url = info['url']
-        if 'title' in info:
-            url += '#StreamName='+urllib.parse.quote(info['title'])
-        id_ = dict(await self.display.mpd_client.send_command('addid', url))['Id']
+        if self.results is None or self.pos >= len(self.results.entries):
+            return
+        entry = self.results.entries[self.pos]
+        video_id = entry['id'] or entry['url']
+        self._speculating = None
+        if self.audio_cache is not None:
+            uri = self.audio_cache.get(video_id)
+            if uri is not None:
+                id_ = dict(await self.display.mpd_client.send_command('addid', uri))['Id']
+                await self.display.mpd_client.send_command('playid', id_)
+                self.display.switch_screen(self.success_screen)
+                return
+            # stream it this time, and it'll be swapped for the download once that's done, if it's still queued
+            self.audio_cache.enqueue(video_id, entry['url'])
+        info = self.youtube.streams.get_nowait(video_id)
+        if info is None:
+            if self._scroll_callback is not None:
+                self._scroll_callback.cancel()
+            self.display.clear()
+            self.display.write(0, 'Loading...')
+            info = await self.youtube.streams.resolve(video_id, entry['url'])
+        id_ = dict(await self.display.mpd_client.send_command('addid', mpd_uri(info)))['Id']
         await self.display.mpd_client.send_command('playid', id_)
+        if self.refresher is not None:
+            self.refresher.track(id_, video_id, entry['url'], info)
         self.display.switch_screen(self.success_screen)
 
     def _scroll_text(self, text, offset):
@@ -0,0 +1,328 @@
+import array
+import asyncio
+import time
+from typing import Optional
+
+import my_aiompd
+
+# The subsystems whose changes can affect anything PlayerState keeps track of.
+WATCHED_SUBSYSTEMS = ('player', 'mixer', 'options', 'playlist')
+
+
+class PlayerState:
+    """A copy of the server's playback state, shared by all the screens, so that they can paint straight away instead
+    of each asking the server for the status every time they're switched to or a button is pressed.
+
+    It's filled in by one batched request when it starts, and after that it only talks to the server when an idle event
+    says something changed.  Call add_listener() to find out when that happens.
+    """
+    def __init__(self, client: my_aiompd.Client, loop: asyncio.AbstractEventLoop = None, lazy_queue=False):
+        """If `lazy_queue` is True, only the songs around the current and next ones are kept (see QueueWindow) rather
+        than a copy of the whole queue.
+        """
+        self.client = client
+        self._loop = loop or asyncio.get_event_loop()
+        self.status = {}
+        self.current_song: Optional[my_aiompd.Song] = None
+        self._status_time = None  # what time.monotonic() was when self.status arrived
+        self._listeners = []
+        self._early_listeners = []
+        self._task: Optional[asyncio.Task] = None
+        self.queue = QueueWindow(client) if lazy_queue else QueueMirror(client)
+        self._synced = asyncio.Event()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = self._loop.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    @property
+    def synced(self):
+        """True once the state has been fetched from the server at least once."""
+        return self._synced.is_set()
+
+    async def wait_synced(self):
+        await self._synced.wait()
+
+    def add_listener(self, callback, early=False):
+        """Arrange for callback to be called with the set of subsystems that changed, every time the state is updated.
+
+        If `early` is True, it's called as soon as the server says something has changed instead, before the new state
+        has been fetched, for when a guess now is better than being right a round trip later.
+        """
+        (self._early_listeners if early else self._listeners).append(callback)
+
+    def remove_listener(self, callback, early=False):
+        (self._early_listeners if early else self._listeners).remove(callback)
+
+    async def _run(self):
+        delay = self.client.reconnect_delay_min
+        while True:
+            try:
+                # subscribe before the first sync, so that nothing that changes in between gets missed.
+                with self.client.subscribe_idle(*WATCHED_SUBSYSTEMS) as changes:
+                    await self.refresh(frozenset(WATCHED_SUBSYSTEMS))
+                    delay = self.client.reconnect_delay_min
+                    async for changed in changes:
+                        changed = frozenset(changed)
+                        for callback in list(self._early_listeners):
+                            callback(changed)
+                        await self.refresh(changed)
+            except (my_aiompd.MPDError, OSError):
+                # The server isn't there, or went away in the middle of something.  Start again from the top after a
+                # while, backing off the same way the client does; the full refresh then picks up whatever we missed.
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.client.reconnect_delay_max)
+
+    async def refresh(self, changed=frozenset(WATCHED_SUBSYSTEMS)):
+        # mixer and options changes only show up in the status, so don't bother asking for the current song.
+        if changed.isdisjoint(('player', 'playlist')) and self.synced:
+            status, = await self.client.command_list('status')
+        else:
+            status, song = await self.client.command_list('status', 'currentsong')
+            self.current_song = my_aiompd.Song.from_pairs(song) if song else None
+        self.status = dict(status)
+        self._status_time = time.monotonic()
+        # does nothing if the queue hasn't changed (and, for a QueueWindow, playback hasn't moved out of it)
+        await self.queue.update(self.playlist_version, self.song_pos, self.next_song_pos)
+        self._synced.set()
+        for callback in list(self._listeners):
+            callback(changed)
+
+    @property
+    def state(self):
+        """'play', 'pause' or 'stop'."""
+        return self.status.get('state', 'stop')
+
+    @property
+    def elapsed(self) -> Optional[float]:
+        """How far into the current song playback is, extrapolated from the last status so that it can be read at any
+        time without asking the server.
+        """
+        if 'elapsed' not in self.status:
+            return None
+        elapsed = float(self.status['elapsed'])
+        if self.state == 'play':
+            elapsed += time.monotonic() - self._status_time
+        return elapsed
+
+    @property
+    def duration(self) -> Optional[float]:
+        return float(self.status['duration']) if 'duration' in self.status else None
+
+    @property
+    def song_pos(self) -> Optional[int]:
+        return int(self.status['song']) if 'song' in self.status else None
+
+    @property
+    def song_id(self) -> Optional[int]:
+        return int(self.status['songid']) if 'songid' in self.status else None
+
+    @property
+    def next_song_pos(self) -> Optional[int]:
+        return int(self.status['nextsong']) if 'nextsong' in self.status else None
+
+    @property
+    def next_song_id(self) -> Optional[int]:
+        return int(self.status['nextsongid']) if 'nextsongid' in self.status else None
+
+    @property
+    def playlist_version(self) -> Optional[int]:
+        return int(self.status['playlist']) if 'playlist' in self.status else None
+
+    @property
+    def playlist_length(self) -> int:
+        return int(self.status.get('playlistlength', 0))
+
+    @property
+    def volume(self) -> Optional[int]:
+        # -1 means there's no mixer
+        volume = int(self.status.get('volume', -1))
+        return volume if volume >= 0 else None
+
+    @property
+    def random(self) -> bool:
+        return self.status.get('random') == '1'
+
+    @property
+    def repeat_mode(self) -> int:
+        """0 for repeat off, 1 for repeat all, and 2 for repeat one."""
+        return 0 if self.status.get('repeat', '0') == '0' else 2 if self.status.get('single') == '1' else 1
+
+
+class QueueMirror:
+    """A copy of the server's queue, kept up to date by asking only for what has changed.
+
+    Moving songs around only costs a list of positions and IDs (plchangesposid).  The tags of a song are only fetched
+    the first time its ID shows up, so reshuffling a queue of thousands of songs doesn't download any of them again.
+    """
+    # how many songs to ask for in a single command list when fetching the ones we haven't seen before.
+    fetch_batch_size = 200
+
+    def __init__(self, client: my_aiompd.Client):
+        self.client = client
+        self.version: Optional[int] = None  # the queue version this is a copy of
+        self._ids = array.array('q')  # the song ID at each position, -1 if we don't know it yet
+        self._songs = {}  # song ID -> Song
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, pos) -> my_aiompd.Song:
+        return self._songs[self._ids[pos]]
+
+    def get(self, pos) -> Optional[my_aiompd.Song]:
+        """Return the song at the given position, or None if there isn't one.
+        """
+        if pos is None or not 0 <= pos < len(self._ids):
+            return None
+        return self._songs.get(self._ids[pos])
+
+    def get_by_id(self, song_id) -> Optional[my_aiompd.Song]:
+        return self._songs.get(song_id)
+
+    def id_at(self, pos) -> int:
+        return self._ids[pos]
+
+    async def update(self, version: Optional[int] = None, song_pos=None, next_song_pos=None):
+        """Bring the copy up to date.  If `version` is given and the copy is already at that version, do nothing.
+        The other arguments are only there so this can be called the same way as QueueWindow.update().
+        """
+        if version is not None and version == self.version:
+            return
+        if self.version is None:
+            await self._load(version)
+            return
+        # Ask for the status in the same command list, so that the length and version we get match the changes exactly.
+        try:
+            changes, status = await self.client.command_list(('plchangesposid', str(self.version)), 'status')
+        except my_aiompd.MPDError:
+            self.version = None
+            await self._load(version)
+            return
+        status = dict(status)
+        length = int(status['playlistlength'])
+        del self._ids[length:]
+        if len(self._ids) < length:
+            self._ids.extend([-1] * (length - len(self._ids)))
+        changed_ids = []
+        pos = None
+        for k, v in changes:
+            if k == 'cpos':
+                pos = int(v)
+            elif k == 'Id':
+                song_id = self._ids[pos] = int(v)
+                changed_ids.append(song_id)
+        try:
+            await self._fetch_missing(changed_ids)
+        except my_aiompd.MPDError:
+            # One of them was deleted again before we got to it, so the queue has already moved on and there's another
+            # change on its way.  Staying at the old version means that one asks for everything since then again.
+            return
+        self._forget_removed()
+        self.version = int(status['playlist'])
+
+    async def _load(self, version):
+        # The version might be out of date by the time the queue arrives, but that's fine: the next update() will ask
+        # for everything that's changed since then, which includes anything that changed before we got here.
+        ids = array.array('q')
+        songs = {}
+        async for song in self.client.stream_command('playlistinfo', record_type=my_aiompd.Song.from_pairs):
+            ids.append(song.id)
+            songs[song.id] = song
+        self._ids = ids
+        self._songs = songs
+        self.version = version
+
+    async def _fetch_missing(self, song_ids):
+        # Streams get asked for again even if we've seen them, since their tags change when the station starts playing
+        # something else.
+        missing = [song_id for song_id in song_ids
+                   if song_id not in self._songs or '://' in self._songs[song_id].file]
+        for i in range(0, len(missing), self.fetch_batch_size):
+            responses = await self.client.command_list(*(('playlistid', str(song_id))
+                                                         for song_id in missing[i:i + self.fetch_batch_size]))
+            for response in responses:
+                song = my_aiompd.Song.from_pairs(response)
+                self._songs[song.id] = song
+
+    def _forget_removed(self):
+        if len(self._songs) > len(self._ids):
+            in_queue = set(self._ids)
+            for song_id in [song_id for song_id in self._songs if song_id not in in_queue]:
+                del self._songs[song_id]
+
+
+class QueueWindow:
+    """Keeps only the songs around the current and next song, for when a copy of the whole queue would be a waste (huge
+    queues, or internet radio, where all you ever want to know about is what's playing).  Costs the same no matter how
+    long the queue is.
+    """
+    # how many songs to keep around each of the current and next song, and how many of those come before it.
+    size = 8
+    before = 2
+
+    def __init__(self, client: my_aiompd.Client):
+        self.client = client
+        self.version: Optional[int] = None
+        self._songs = {}  # position -> Song, for the positions in the window
+
+    def __len__(self):
+        return len(self._songs)
+
+    def get(self, pos) -> Optional[my_aiompd.Song]:
+        """Return the song at the given position, or None if it's outside the window.
+        """
+        return self._songs.get(pos)
+
+    def get_by_id(self, song_id) -> Optional[my_aiompd.Song]:
+        for song in self._songs.values():
+            if song.id == song_id:
+                return song
+        return None
+
+    async def update(self, version: Optional[int], song_pos: Optional[int] = None, next_song_pos: Optional[int] = None):
+        """Refetch the window if the queue has changed, or if the current or next song has moved out of it.
+        """
+        wanted = [pos for pos in (song_pos, next_song_pos) if pos is not None]
+        if version == self.version and all(pos in self._songs for pos in wanted):
+            return
+        # The next song can be at the other end of the queue from the current one (when repeating), so work out a range
+        # around each of them and only merge them if they overlap.
+        ranges = []
+        for pos in sorted(wanted):
+            start = max(0, pos - self.before)
+            end = start + self.size
+            if ranges and start <= ranges[-1][1]:
+                ranges[-1][1] = max(ranges[-1][1], end)
+            else:
+                ranges.append([start, end])
+        songs = {}
+        if ranges:
+            try:
+                responses = await self.client.command_list(
+                    *(('playlistinfo', '%d:%d' % (start, end)) for start, end in ranges))
+            except my_aiompd.MPDError:
+                # The queue got shorter between the status and now, so a range starts past the end of it.  That's
+                # another change on its way; staying at the old version means it fetches the window again.
+                return
+            for (start, end), response in zip(ranges, responses):
+                for pos, pairs in enumerate(_split_records(response), start):
+                    songs[pos] = my_aiompd.Song.from_pairs(pairs)
+        self._songs = songs
+        self.version = version
+
+
+def _split_records(pairs):
+    record = []
+    for pair in pairs:
+        if pair[0] == 'file' and record:
+            yield record
+            record = []
+        record.append(pair)
+    if record:
+        yield record
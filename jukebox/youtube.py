@@ -0,0 +1,664 @@
+import asyncio
+import collections
+import concurrent.futures
+import itertools
+import json
+import os
+import posixpath
+import re
+import time
+import urllib.parse
+from typing import Optional
+
+import my_aiompd
+
+# Everything that actually talks to YouTube happens in worker processes, because yt-dlp is synchronous from top to
+# bottom and takes seconds to do anything: run on the event loop, it would freeze the buttons, the display and the idle
+# loop until it was done.  It's also only imported in the workers, which saves the main process the memory.
+_ytdl = None
+_ytdl_params = {'format': 'bestaudio', 'quiet': True, 'no_warnings': True}
+# search ID -> (the generator of its results, how many of them it's handed out), for searches that are still
+# being scrolled through.  Each worker process has its own.
+_searches = collections.OrderedDict()
+_MAX_SEARCHES = 4
+
+
+def _init_worker(ytdl_class=None):
+    global _ytdl
+    if ytdl_class is None:
+        import yt_dlp
+        ytdl_class = yt_dlp.YoutubeDL
+    _ytdl = ytdl_class(_ytdl_params)
+
+
+def _summarize(entry):
+    # only what the screens need, so there's less to pickle on the way back
+    return {'id': entry.get('id'), 'url': entry['url'], 'title': entry.get('title') or entry['url'],
+            'uploader': entry.get('uploader') or entry.get('channel') or ''}
+
+
+def _search(search_id, query, start, count):
+    generator, position = _searches.pop(search_id, (None, None))
+    if position != start:
+        # Either this is the first batch, or the earlier ones were fetched by another worker.  Either way, start from
+        # the top and skip what's already been handed out.  Unprocessed, a search's entries are a generator that only
+        # fetches another page of results when it runs out of the one before.
+        generator = iter(_ytdl.extract_info('ytsearchall:' + query, download=False, process=False)['entries'])
+        for _ in itertools.islice(generator, start):
+            pass
+    results = [_summarize(entry) for entry in itertools.islice(generator, count)]
+    _searches[search_id] = (generator, start + len(results))
+    while len(_searches) > _MAX_SEARCHES:
+        _searches.popitem(last=False)
+    return results
+
+
+def _download(url, directory, name):
+    ydl = type(_ytdl)(dict(_ytdl_params, outtmpl=os.path.join(directory, name + '.%(ext)s')))
+    info = ydl.extract_info(url, download=True)
+    downloads = info.get('requested_downloads')
+    path = downloads[0]['filepath'] if downloads else ydl.prepare_filename(info)
+    return os.path.basename(path), os.path.getsize(path)
+
+
+def _extract(url):
+    info = _ytdl.extract_info(url, download=False)
+    return {'id': info.get('id'), 'url': info['url'], 'title': info.get('title'),
+            'uploader': info.get('uploader') or info.get('channel') or ''}
+
+
+_EXPIRE = re.compile(r'[?&/]expire[=/](\d+)')
+
+
+def stream_expiry(url) -> Optional[float]:
+    """When a stream URL stops working, as a time.time() timestamp, going by the expire parameter googlevideo puts in
+    them (either in the query string or, on some, as a path segment).  None if it doesn't have one.
+    """
+    match = _EXPIRE.search(url)
+    return float(match.group(1)) if match else None
+
+
+def mpd_uri(info) -> str:
+    """What to give MPD for a resolved video: the stream URL, with the title tacked on the end where MPD will find it.
+    """
+    url = info['url']
+    if info.get('title'):
+        url += '#StreamName=' + urllib.parse.quote(info['title'])
+    return url
+
+
+class YouTube:
+    """Runs yt-dlp in a pool of worker processes, for the event loop to await.
+
+    Cancelling a call only helps if it hasn't started yet: a worker that's already talking to YouTube can't be
+    interrupted, so it finishes and the answer gets thrown away.
+    """
+    def __init__(self, max_workers=2, loop: Optional[asyncio.AbstractEventLoop] = None, ytdl_class=None):
+        """`ytdl_class` stands in for yt_dlp.YoutubeDL in the workers, for testing without YouTube (see
+        fake_ytdl.FakeYoutubeDL).  It has to be importable from a module, since it gets pickled over to them.
+        """
+        self._max_workers = max_workers
+        self._ytdl_class = ytdl_class
+        self._loop = loop or asyncio.get_event_loop()
+        self._executor = None
+        self._search_ids = itertools.count()
+        self.streams = StreamCache(self)
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(self._max_workers, initializer=_init_worker,
+                                                                    initargs=(self._ytdl_class,))
+        return self._executor
+
+    async def _run(self, func, *args):
+        executor = self._get_executor()
+        try:
+            return await self._loop.run_in_executor(executor, func, *args)
+        except concurrent.futures.process.BrokenProcessPool:
+            # A worker died (out of memory, most likely).  Start a fresh pool for next time.
+            if self._executor is executor:
+                self._executor = None
+            raise
+
+    def search(self, query, create_task=None) -> 'YouTubeSearch':
+        """Start a search.  Nothing is fetched until the results are asked for.
+
+        `create_task` is what gets used to start fetching in the background: pass Display.create_task to have it
+        stop when the screen is left.
+        """
+        return YouTubeSearch(self, query, next(self._search_ids), create_task or self._loop.create_task)
+
+    async def extract(self, url) -> dict:
+        """Look up a video, returning a dict with its id, title, uploader, and the URL of its audio stream.
+        """
+        return await self._run(_extract, url)
+
+    async def download(self, url, directory, name):
+        """Download the audio of a video into `directory`, as `name` plus whatever extension suits the format, and
+        return (the file's name, its size in bytes).
+        """
+        return await self._run(_download, url, directory, name)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class YouTubeSearch:
+    """The results of a YouTube search, fetched in batches as they're asked for.  Each one is a dict with id, url,
+    title and uploader keys.
+    """
+    batch_size = 5
+
+    def __init__(self, youtube: YouTube, query, search_id, create_task):
+        self._youtube = youtube
+        self.query = query
+        self._search_id = search_id
+        self._create_task = create_task
+        self.entries = []
+        self.complete = False
+        self.error: Optional[Exception] = None
+        self._wanted = 0  # fetch until there are at least this many entries
+        self._task: Optional[asyncio.Task] = None
+        self._waiters = []
+
+    def prefetch(self, count):
+        """Start fetching in the background until there are at least `count` results (or there are no more).
+        """
+        self._wanted = max(self._wanted, count)
+        if not self.complete and len(self.entries) < self._wanted and (self._task is None or self._task.done()):
+            self._task = self._create_task(self._fill())
+
+    async def get(self, index):
+        """Return result number `index`, waiting for it to be fetched if it hasn't been yet, or None if there are
+        fewer results than that.
+        """
+        while index >= len(self.entries) and not self.complete:
+            self.prefetch(index + 1)
+            waiter = asyncio.get_event_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+        if self.error is not None and not self.entries:
+            raise self.error
+        return self.entries[index] if index < len(self.entries) else None
+
+    def cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    def _wake(self, cancelled=False):
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if cancelled:
+                waiter.cancel()
+            elif not waiter.done():
+                waiter.set_result(None)
+
+    async def _fill(self):
+        try:
+            while len(self.entries) < self._wanted and not self.complete:
+                batch = await self._youtube._run(_search, self._search_id, self.query, len(self.entries),
+                                                 self.batch_size)
+                self.entries.extend(batch)
+                if len(batch) < self.batch_size:
+                    self.complete = True
+                self._wake()
+        except asyncio.CancelledError:
+            # nobody's going to wake them up now
+            self._wake(cancelled=True)
+            raise
+        except Exception as e:
+            self.error = e
+            self.complete = True
+            self._wake()
+
+
+class StreamCache:
+    """Stream URLs (and titles) that have already been looked up, by video ID, each kept until shortly before the URL
+    expires.  Lookups that are still running are shared, so asking for something that's already being resolved in the
+    background just waits for that to finish.
+    """
+    # consider a URL expired this many seconds before it really is, so there's time to actually play it
+    margin = 300
+    # for URLs that don't say when they expire
+    default_lifetime = 3600
+    max_size = 64
+
+    def __init__(self, youtube: YouTube):
+        self._youtube = youtube
+        self._entries = collections.OrderedDict()  # video ID -> (info from YouTube.extract(), expiry), oldest first
+        self._pending = {}  # video ID -> task resolving it
+
+    def get_nowait(self, video_id, fresh_for=0) -> Optional[dict]:
+        """Return what's known about a video if it'll still be good for `fresh_for` seconds, otherwise None.
+        """
+        cached = self._entries.get(video_id)
+        if cached is None:
+            return None
+        info, expiry = cached
+        if expiry - self.margin - fresh_for <= time.time():
+            if fresh_for == 0:
+                del self._entries[video_id]
+            return None
+        self._entries.move_to_end(video_id)
+        return info
+
+    def prefetch(self, video_id, url, fresh_for=0) -> Optional[asyncio.Task]:
+        """Start resolving a video in the background, unless it's already cached (and good for `fresh_for` more
+        seconds) or being resolved.  Returns the task doing it, if there is one.
+        """
+        if self.get_nowait(video_id, fresh_for) is not None:
+            return None
+        task = self._pending.get(video_id)
+        # (one that's done is on its way out, but its done callback hasn't got round to it yet)
+        if task is None or task.done():
+            task = self._pending[video_id] = asyncio.ensure_future(self._resolve(video_id, url))
+            task.add_done_callback(self._resolved)
+        return task
+
+    async def resolve(self, video_id, url, fresh_for=0) -> dict:
+        """Return the stream URL and title of a video, from the cache if possible.
+        """
+        while True:
+            info = self.get_nowait(video_id, fresh_for)
+            if info is not None:
+                return info
+            task = self.prefetch(video_id, url, fresh_for)
+            try:
+                # shielded, so that whoever's waiting giving up doesn't stop it for anyone else
+                return await asyncio.shield(task)
+            except asyncio.CancelledError:
+                if not task.cancelled():
+                    raise
+                # someone else called it off (see cancel()); we still want it, so go round again
+
+    def cancel(self, video_id):
+        """Stop resolving a video in the background, if it hasn't got going yet.
+        """
+        task = self._pending.get(video_id)
+        if task is not None:
+            task.cancel()
+
+    def _store(self, info):
+        expiry = stream_expiry(info['url']) or time.time() + self.default_lifetime
+        self._entries[info['id']] = (info, expiry)
+        self._entries.move_to_end(info['id'])
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _resolved(self, task):
+        # a callback rather than a finally in _resolve(), because a task cancelled before it starts never runs that
+        for video_id, pending in self._pending.items():
+            if pending is task:
+                del self._pending[video_id]
+                return
+
+    async def _resolve(self, video_id, url):
+        info = await self._youtube.extract(url)
+        info['id'] = video_id
+        self._store(info)
+        return info
+
+
+class _Tracked:
+    __slots__ = ('video_id', 'page_url', 'expiry', 'retry_at', 'failures')
+
+    def __init__(self, video_id, page_url, expiry):
+        self.video_id = video_id
+        self.page_url = page_url
+        self.expiry = expiry
+        self.retry_at = 0  # time.time() before which not to try again after a failure
+        self.failures = 0
+
+
+class StreamRefresher:
+    """Keeps YouTube streams that we've put in the queue playable.  Their URLs only work for a few hours, so if one
+    gets played long after it was added, MPD just skips it.  This watches the queue, and before a tracked entry's URL
+    expires (or before it's next up and won't last through the current song), looks it up again and swaps the new URL
+    in at the same position.
+
+    The entry gets a new ID when that happens (MPD can't change what an ID points to), but it stays where it was, and
+    the currently playing entry is never touched.  Lookups are done a few at a time, at most one batch every
+    min_interval seconds, so that a queue full of YouTube doesn't hammer it all at once.
+    """
+    # refresh this long before a URL expires
+    refresh_margin = 1800
+    batch_size = 4
+    min_interval = 10
+
+    def __init__(self, client: my_aiompd.Client, youtube: YouTube, player_state,
+                 loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.client = client
+        self.youtube = youtube
+        self.player_state = player_state
+        self._loop = loop or asyncio.get_event_loop()
+        self._tracked = {}  # song ID -> _Tracked
+        self._queue_changed = True  # whether to check which tracked entries are still in the queue
+        self._local = {}  # video ID -> URI of a downloaded copy, for tracked entries to be switched over to
+        self._wakeup: Optional[asyncio.Future] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self.player_state.add_listener(self._on_change)
+            self._task = self._loop.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self.player_state.remove_listener(self._on_change)
+            self._task.cancel()
+            self._task = None
+
+    def track(self, song_id, video_id, page_url, info):
+        """Start looking after a queue entry made from `info` (as returned by YouTube.extract()).
+        """
+        self._tracked[int(song_id)] = _Tracked(video_id, page_url,
+                                               stream_expiry(info['url']) or time.time() + StreamCache.default_lifetime)
+        self._wake()
+
+    def use_local(self, video_id, uri):
+        """Switch the tracked entries for a video over to a local copy (see AudioCache.add_listener()).  The one
+        that's playing, if there is one, is switched once it isn't anymore.
+        """
+        if any(tracked.video_id == video_id for tracked in self._tracked.values()):
+            self._local[video_id] = uri
+            self._wake()
+
+    def _on_change(self, changed):
+        if 'playlist' in changed:
+            self._queue_changed = True
+        if not changed.isdisjoint(('player', 'playlist')):
+            # the next song might be a different one now
+            self._wake()
+
+    def _wake(self):
+        if self._wakeup is not None and not self._wakeup.done():
+            self._wakeup.set_result(None)
+
+    def _needed_for(self, song_id, now):
+        """How long the URL of a tracked entry has to keep working from now on, if it's needed any sooner than the
+        usual refresh_margin before it expires.
+        """
+        state = self.player_state
+        if song_id == state.next_song_id and state.duration is not None and state.elapsed is not None:
+            return max(0, state.duration - state.elapsed) + self.refresh_margin
+        return self.refresh_margin
+
+    def _due(self, now):
+        return [song_id for song_id, tracked in self._tracked.items()
+                if song_id != self.player_state.song_id and tracked.retry_at <= now
+                and tracked.video_id not in self._local and tracked.expiry - self._needed_for(song_id, now) <= now]
+
+    def _next_check(self, now) -> Optional[float]:
+        times = [max(tracked.expiry - self._needed_for(song_id, now), tracked.retry_at) - now
+                 for song_id, tracked in self._tracked.items() if song_id != self.player_state.song_id]
+        return max(1, min(times)) if times else None
+
+    async def _positions(self):
+        positions = {}
+        pos = None
+        for k, v in await self.client.send_command('plchangesposid', '0'):
+            if k == 'cpos':
+                pos = v
+            elif k == 'Id':
+                positions[int(v)] = pos
+        return positions
+
+    async def _run(self):
+        await self.player_state.wait_synced()
+        while True:
+            try:
+                if self._queue_changed and self._tracked:
+                    self._queue_changed = False
+                    positions = await self._positions()
+                    for song_id in [song_id for song_id in self._tracked if song_id not in positions]:
+                        del self._tracked[song_id]
+                if self._local and any(tracked.video_id in self._local for song_id, tracked in self._tracked.items()
+                                       if song_id != self.player_state.song_id):
+                    await self._swap_local()
+                now = time.time()
+                due = self._due(now)
+                if due:
+                    await self._refresh(due[:self.batch_size], now)
+                    await asyncio.sleep(self.min_interval)
+                    continue
+            except ConnectionError:
+                # The server's gone away for now.  Once it's back, find out what's still in the queue before anything
+                # else.
+                self._queue_changed = True
+                await asyncio.sleep(self.min_interval)
+                continue
+            self._wakeup = self._loop.create_future()
+            try:
+                await asyncio.wait_for(self._wakeup, self._next_check(now))
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._wakeup = None
+
+    async def _swap_local(self):
+        positions = await self._positions()
+        commands = []
+        for song_id, tracked in list(self._tracked.items()):
+            uri = self._local.get(tracked.video_id)
+            if uri is None or song_id == self.player_state.song_id:
+                continue
+            del self._tracked[song_id]
+            if song_id in positions:
+                commands += [('deleteid', str(song_id)), ('addid', uri, positions[song_id])]
+        # keep the ones that are still waiting for the playing entry to finish
+        waiting = {tracked.video_id for tracked in self._tracked.values()}
+        for video_id in [video_id for video_id in self._local if video_id not in waiting]:
+            del self._local[video_id]
+        if commands:
+            try:
+                await self.client.command_list(*commands)
+            except (my_aiompd.MPDError, ConnectionError):
+                self._queue_changed = True
+
+    async def _refresh(self, song_ids, now):
+        results = await asyncio.gather(*(
+            self.youtube.streams.resolve(self._tracked[song_id].video_id, self._tracked[song_id].page_url,
+                                         fresh_for=self._needed_for(song_id, now))
+            for song_id in song_ids), return_exceptions=True)
+        # Look the positions up only now, after the slow part, so they're as fresh as they can be.  The delete goes
+        # first so that if an entry has vanished in the meantime, the command list stops before adding a stray copy.
+        positions = await self._positions()
+        commands = []
+        replaced = []
+        for song_id, info in zip(song_ids, results):
+            tracked = self._tracked.get(song_id)
+            if tracked is None:
+                continue
+            if isinstance(info, Exception):
+                tracked.failures += 1
+                tracked.retry_at = now + self.min_interval * 2 ** min(tracked.failures, 8)
+                continue
+            if song_id not in positions:
+                del self._tracked[song_id]
+                continue
+            if song_id == self.player_state.song_id:
+                continue
+            commands += [('deleteid', str(song_id)), ('addid', mpd_uri(info), positions[song_id])]
+            replaced.append((song_id, info))
+        if not commands:
+            return
+        try:
+            responses = await self.client.command_list(*commands)
+        except (my_aiompd.MPDError, ConnectionError):
+            # The queue changed under us, or the connection dropped halfway through (and the command list can't just be
+            # sent again, in case some of it was done).  Work out what's still there and try again next time round.
+            self._queue_changed = True
+            return
+        for (song_id, info), response in zip(replaced, responses[1::2]):
+            tracked = self._tracked.pop(song_id)
+            tracked.expiry = stream_expiry(info['url']) or time.time() + StreamCache.default_lifetime
+            tracked.failures = 0
+            # in case even a brand new URL won't last as long as it's needed for, don't go straight round again
+            tracked.retry_at = now + self.min_interval * 6
+            self._tracked[int(dict(response)['Id'])] = tracked
+
+
+class _CachedAudio:
+    __slots__ = ('filename', 'size', 'last_played')
+
+    def __init__(self, filename, size, last_played):
+        self.filename = filename
+        self.size = size
+        self.last_played = last_played
+
+
+class AudioCache:
+    """Downloaded copies of YouTube videos' audio, so that playing something again (or over a slow connection) doesn't
+    mean streaming it live.  The files go in `directory`, which has to be inside MPD's music directory, at `mpd_path`
+    relative to it, so MPD can play them like anything else once it's been told to look at them.
+
+    Downloads are done one at a time, in the background, in the order they were asked for.  Once the total size goes
+    over `max_bytes`, the ones that were played longest ago are deleted, except for any that are in MPD's queue, which
+    wait until they've gone from it before they can be.  What's in the cache is kept in an index file
+    in the same directory, so it survives restarts.
+    """
+    index_name = 'index.json'
+    # how long after something is played to write the new play time to the index, so playing a lot doesn't mean
+    # rewriting it a lot
+    save_delay = 30
+
+    def __init__(self, youtube: YouTube, client: my_aiompd.Client, directory, mpd_path, max_bytes,
+                 loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.youtube = youtube
+        self.client = client
+        self.directory = directory
+        self.mpd_path = mpd_path.strip('/')
+        self.max_bytes = max_bytes
+        self._loop = loop or asyncio.get_event_loop()
+        # video ID -> _CachedAudio, least recently played first
+        self._entries = collections.OrderedDict()
+        self.size = 0
+        self._queue = collections.OrderedDict()  # video ID -> URL, waiting to be downloaded
+        self._task: Optional[asyncio.Task] = None
+        self._save_handle: Optional[asyncio.Handle] = None
+        self._listeners = []
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.directory, self.index_name)) as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            index = {}
+        for video_id, (filename, size, last_played) in sorted(index.items(), key=lambda item: item[1][2]):
+            if os.path.exists(os.path.join(self.directory, filename)):
+                self._entries[video_id] = _CachedAudio(filename, size, last_played)
+                self.size += size
+        # yt-dlp's leftovers from downloads that never finished
+        for filename in os.listdir(self.directory):
+            if filename.endswith(('.part', '.ytdl')):
+                os.remove(os.path.join(self.directory, filename))
+
+    def _save(self):
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+        path = os.path.join(self.directory, self.index_name)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({video_id: (entry.filename, entry.size, entry.last_played)
+                       for video_id, entry in self._entries.items()}, f)
+        os.replace(path + '.tmp', path)
+
+    def add_listener(self, callback):
+        """Arrange for callback(video_id, uri) to be called whenever a download is ready to be played.
+        """
+        self._listeners.append(callback)
+
+    def get(self, video_id) -> Optional[str]:
+        """Return the URI for MPD to play a video from the cache, or None if it isn't in it (yet), and count it as
+        having just been played.
+        """
+        entry = self._entries.get(video_id)
+        if entry is None:
+            return None
+        entry.last_played = time.time()
+        self._entries.move_to_end(video_id)
+        if self._save_handle is None:
+            self._save_handle = self._loop.call_later(self.save_delay, self._save)
+        return self._uri(entry.filename)
+
+    def _uri(self, filename):
+        # (with no mpd_path, the directory is MPD's music directory itself)
+        return posixpath.join(self.mpd_path, filename)
+
+    def enqueue(self, video_id, url):
+        """Download a video in the background, unless it's already cached or on its way.
+        """
+        if video_id in self._entries or video_id in self._queue:
+            return
+        self._queue[video_id] = url
+        if self._task is None or self._task.done():
+            self._task = self._loop.create_task(self._run())
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._save_handle is not None:
+            self._save()
+
+    async def _run(self):
+        while self._queue:
+            video_id, url = next(iter(self._queue.items()))
+            try:
+                filename, size = await self.youtube.download(url, self.directory, video_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # leave it to be streamed; if it's picked again, it'll be tried again
+                del self._queue[video_id]
+                continue
+            del self._queue[video_id]
+            self._entries[video_id] = _CachedAudio(filename, size, time.time())
+            self.size += size
+            await self._evict(keep=video_id)
+            self._save()
+            # MPD won't play a file it hasn't seen in its database.
+            try:
+                await self._update_database()
+            except (my_aiompd.MPDError, ConnectionError):
+                continue
+            for callback in self._listeners:
+                callback(video_id, self._uri(filename))
+
+    async def _evict(self, keep):
+        for video_id in list(self._entries):
+            if self.size <= self.max_bytes:
+                break
+            entry = self._entries.get(video_id)
+            if video_id == keep or entry is None:
+                continue
+            # Deleting a file that's queued up (or playing) would have MPD skip it when it gets there, so it stays for
+            # now, over the limit or not, and goes the next time something is downloaded after it's left the queue.
+            last_played = entry.last_played
+            try:
+                if await self.client.send_command('playlistfind', 'file', self._uri(entry.filename)):
+                    continue
+            except (my_aiompd.MPDError, ConnectionError):
+                # can't tell, so leave everything where it is
+                return
+            if self._entries.get(video_id) is not entry or entry.last_played != last_played:
+                # handed out by get() while we were asking, so it's about to be queued
+                continue
+            del self._entries[video_id]
+            self.size -= entry.size
+            try:
+                os.remove(os.path.join(self.directory, entry.filename))
+            except FileNotFoundError:
+                pass
+
+    async def _update_database(self):
+        # (the whole directory, which takes care of anything that's been evicted too)
+        with self.client.subscribe_idle('update') as updates:
+            await self.client.send_command('update', self.mpd_path)
+            # the update runs in the background on the server; it's done once the status stops saying it's updating
+            while 'updating_db' in dict(await self.client.send_command('status')):
+                await updates.get()
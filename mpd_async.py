@@ -186,7 +186,7 @@ async def iter_channel_messages(channel):
     while True:
         m = loop.client.pending_messages.get(channel)
         while m:
-            yield m.pop(0)
+            yield m.popleft()
         await _await_channel_messages(channel)
 
 
@@ -206,7 +206,7 @@ class ChannelMessages:
         while True:
             m = loop.client.pending_messages.get(self.channel)
             if m:
-                return m.pop(0)
+                return m.popleft()
             yield MESSAGE, self.channel
 
 
@@ -1,3 +1,4 @@
+import collections
 import socket
 import re
 
@@ -26,6 +27,46 @@ def quote_string(s):
     return '"'+s.replace('\\','\\\\').replace('"', '\\"').replace("'", "\\'")+'"'
 
 
+# The comparisons a filter expression can make between a tag and a value.
+FILTER_OPERATORS = frozenset(['==', '!=', 'contains', '!contains', 'starts_with', '=~', '!~'])
+
+
+def filter_expression(*clauses, **tags) -> str:
+    """Build a filter expression for find, search, count, etc. out of (tag, operator, value) tuples and tag=value
+    keyword arguments, which all have to match:
+
+        filter_expression(('Title', 'contains', 'love'), Artist='AC/DC')
+        -> '((Title contains "love") AND (Artist == "AC/DC"))'
+
+    Values are escaped with quote_string(), so they can contain anything.  A clause can also be an expression that's
+    already been built, to combine it with others.
+    """
+    parts = []
+    for clause in clauses + tuple((tag, '==', value) for tag, value in tags.items()):
+        if isinstance(clause, str):
+            parts.append(clause)
+            continue
+        tag, op, value = clause
+        if op not in FILTER_OPERATORS:
+            raise ValueError('unknown filter operator %r' % op)
+        parts.append('(%s %s %s)' % (tag, op, quote_string(str(value))))
+    if not parts:
+        raise ValueError('a filter needs at least one clause')
+    return parts[0] if len(parts) == 1 else '(%s)' % ' AND '.join(parts)
+
+
+def _split_songs(pairs):
+    """Turn the flat list of pairs from find, search etc. into a list of dicts, one per song.
+    """
+    songs = []
+    for key, value in pairs:
+        if key == 'file':
+            songs.append({})
+        if songs:
+            songs[-1][key] = value
+    return songs
+
+
 class MPDClient:
     def __init__(self, host, port=6600):
         self.host = host
@@ -38,7 +79,7 @@ class MPDClient:
         self.partition: str = None
         self.subscriptions = set()  # list of C2C channels we're subscribed to
         self.last_cmdline = b''  # this turns into a list between a command_list_begin and a command_list_end
-        self.pending_messages = {}  # mapping channel names to lists of messages that we have retrieved from the server
+        self.pending_messages = {}  # mapping channel names to deques of messages that we have retrieved from the server
                                     # but that user code has not yet consumed.
 
     def set_idle_cancel_callback(self, callback):
@@ -64,6 +105,9 @@ class MPDClient:
             self.socket.connect(self.host)
         else:
             self.socket = socket.create_connection((self.host, self.port))
+            # Without this, a noidle followed straight away by another command sits in Nagle's buffer until the server's
+            # delayed ACK, which is 40ms on Linux.  (asyncio turns it off for my_aiompd by itself.)
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         self.readfile = self.socket.makefile('rb')
         version_line = self.readfile.readline().decode('ascii')
         parts = version_line.split()
@@ -106,11 +150,11 @@ class MPDClient:
         cmdline = cmd.encode('ascii') if isinstance(cmd, str) else cmd
         if args:
             cmdline += b' ' + b' '.join(
-                ('"'+arg.replace('\\', '\\\\').replace('"', '\\"')+'"'
+                (b'"' + arg.replace(b'\\', b'\\\\').replace(b'"', b'\\"') + b'"'
                  if forcequote or b' ' in arg or b'"' in arg or b'\\' in arg or b"'" in arg
                  else arg)
                 for uarg in args
-                for arg in (uarg.encode('ascii') if isinstance(uarg, str) else uarg,)
+                for arg in (uarg.encode('utf8') if isinstance(uarg, str) else uarg,)
             )
         cmdline += b'\n'
 
@@ -146,7 +190,7 @@ class MPDClient:
                 value = self.readfile.read(int(value))
                 self.readfile.readline()
             yield (key, value)
-            line = self.readfile.readline().decode('ascii')
+            line = self.readfile.readline().decode('utf8')
         if line.startswith('ACK'):
             raise MPDError(line)
 
@@ -183,8 +227,54 @@ class MPDClient:
         """
         return dict(self.do_command('config'))
 
-    def find(self, tag, comparison, value):
-        pass
+    def find(self, *clauses, sort=None, window=None, **tags):
+        """Return the songs matching a filter (see filter_expression()), case sensitively, as a list of dicts.
+        `sort` is a tag to sort by (with a - in front for descending order), and `window` a (start, end) pair to only
+        return part of the results.
+        """
+        return self._search('find', filter_expression(*clauses, **tags), sort, window)
+
+    def search(self, *clauses, sort=None, window=None, **tags):
+        """Like find(), but ignoring case.
+        """
+        return self._search('search', filter_expression(*clauses, **tags), sort, window)
+
+    def _search(self, command, expression, sort=None, window=None):
+        args = [expression]
+        if sort:
+            args += ['sort', sort]
+        if window is not None:
+            args += ['window', '%d:%d' % tuple(window)]
+        return _split_songs(self.do_command(command, *args))
+
+    def search_pages(self, *clauses, exact=False, sort=None, page_size=16, **tags) -> 'SearchPages':
+        """Like search() (or find(), if `exact` is True), but returning the results a page at a time as they're asked
+        for.  See SearchPages.
+        """
+        return SearchPages(self, filter_expression(*clauses, **tags), exact=exact, sort=sort, page_size=page_size)
+
+    def count(self, *clauses, group=None, **tags):
+        """Count the songs matching a filter.  Returns (number of songs, total playtime in seconds), or if `group` is a
+        tag, a dict mapping each value of that tag to (number of songs, total playtime).
+        """
+        args = [filter_expression(*clauses, **tags)]
+        if group is not None:
+            args += ['group', group]
+        response = self.do_command('count', *args)
+        if group is None:
+            response = dict(response)
+            return int(response['songs']), int(response['playtime'])
+        groups = {}
+        value = None
+        for k, v in response:
+            if k == group:
+                value = v
+                groups[value] = [0, 0]
+            elif k == 'songs':
+                groups[value][0] = int(v)
+            elif k == 'playtime':
+                groups[value][1] = int(v)
+        return {value: tuple(counts) for value, counts in groups.items()}
 
     def switch_partition(self, partition):
         self.do_command('partition', partition)
@@ -228,7 +318,7 @@ class MPDClient:
             if k == 'channel':
                 channel = v
             elif k == 'message':
-                self.pending_messages.setdefault(channel, []).append(v)
+                self.pending_messages.setdefault(channel, collections.deque()).append(v)
 
     def send_idle(self, subsystems):
         """
@@ -267,3 +357,61 @@ class MPDClient:
         return subsystems
 
 
+
+
+class SearchPages:
+    """The results of a search, fetched a page at a time as they're asked for using the server's window parameter, so
+    a search that matches half the library only transfers the part of it that actually gets looked at.  Pages are kept
+    once fetched.  Created by MPDClient.search_pages().
+    """
+    def __init__(self, client: MPDClient, expression: str, exact=False, sort=None, page_size=16):
+        self.client = client
+        self.expression = expression
+        self.command = 'find' if exact else 'search'
+        self.sort = sort
+        self.page_size = page_size
+        self._pages = {}
+        self.length = None  # how many results there are, once we know
+
+    def page(self, n):
+        """Return the list of results on page `n`, which is empty if there aren't that many pages.
+        """
+        if n < 0:
+            raise IndexError(n)
+        if n not in self._pages:
+            start = n * self.page_size
+            if self.length is not None and start >= self.length:
+                return []
+            page = self.client._search(self.command, self.expression, self.sort, (start, start + self.page_size))
+            if len(page) < self.page_size and (self.length is None or start + len(page) < self.length):
+                # A short page is the last one.  An empty one further on only tells us the end is somewhere before it,
+                # but that's enough to stop anyone asking for the pages after it; the page the end is really on lowers
+                # it again when it's fetched.
+                self.length = start + len(page)
+            self._pages[n] = page
+        return self._pages[n]
+
+    def get(self, index):
+        """Return result number `index`, or None if there aren't that many.
+        """
+        page = self.page(index // self.page_size)
+        index %= self.page_size
+        return page[index] if index < len(page) else None
+
+    def count(self):
+        """Find out how many results there are (with a count command, if we haven't already found the end).
+        """
+        if self.length is None:
+            response = dict(self.client.do_command('count' if self.command == 'find' else 'searchcount',
+                                                   self.expression))
+            self.length = int(response['songs'])
+        return self.length
+
+    def __iter__(self):
+        n = 0
+        while True:
+            page = self.page(n)
+            yield from page
+            if len(page) < self.page_size:
+                return
+            n += 1
@@ -1,37 +1,156 @@
+import heapq
+import itertools
 import time
 
 import mpdclient
-import sched
-from collections import namedtuple
 import select
 
 
-def accumulate(func, iterable, *, default=None):
-    try:
-        current=next(iterable)
-    except StopIteration:
-        return default
-    for item in iterable:
-        current = func(current, item)
-    return current
+class _Waiter:
+    __slots__ = ('subsystems', 'channel', 'func', 'args', 'kw', 'active')
 
+    def __init__(self, subsystems, channel, func, args, kw):
+        self.subsystems = subsystems
+        self.channel = channel
+        self.func = func
+        self.args = args
+        self.kw = kw
+        self.active = True
+
+
+class _Timer:
+    __slots__ = ('when', 'func', 'args', 'kw', 'done')
+
+    def __init__(self, when, func, args, kw):
+        self.when = when
+        self.func = func
+        self.args = args
+        self.kw = kw
+        self.done = False
 
-_Waiter = namedtuple('_Waiter', ['subsystems', 'channel', 'func', 'args','kw'])
 
 _message_subsystem = frozenset(['message'])
 
-class MPDLoop:
+
+class BaseMPDLoop:
+    """The bookkeeping for tasks waiting on idle events and channel messages, which is the same whatever the waiting is
+    actually done with: MPDLoop here, or aio_mpdloop.AsyncioMPDLoop.  Subclasses need to provide self.client (with a
+    pending_messages dict), call_soon() and the waiting itself, and call _dispatch() with whatever changed.
+    """
+    def __init__(self):
+        # subsystem -> waiters for it, and channel -> waiters for messages on it.  The inner dicts are used as ordered
+        # sets (the values are all None), so that waiters fire in the order they were added and can be taken out in O(1)
+        self._waiters = {}
+        self._channel_waiters = {}
+        # subsystem -> how many waiters want it.  The keys are what we idle on.
+        self._refcounts = {}
+        self._idle_subsystems = frozenset()
+        self._idle_subsystems_stale = False
+
+    def _subsystems_changed(self):
+        """Called whenever a subsystem gains its first waiter or loses its last one.
+        """
+        pass
+
+    def _incref(self, subsystems):
+        for subsystem in subsystems:
+            count = self._refcounts.get(subsystem, 0)
+            if count == 0:
+                self._idle_subsystems_stale = True
+                self._subsystems_changed()
+            self._refcounts[subsystem] = count + 1
+
+    def _decref(self, subsystems):
+        for subsystem in subsystems:
+            count = self._refcounts[subsystem] - 1
+            if count == 0:
+                del self._refcounts[subsystem]
+                self._idle_subsystems_stale = True
+                self._subsystems_changed()
+            else:
+                self._refcounts[subsystem] = count
+
+    def _wanted_subsystems(self):
+        # only build a new set when a subsystem has actually been added or dropped, so that the client sees the same
+        # set as last time and doesn't re-send the idle.
+        if self._idle_subsystems_stale:
+            self._idle_subsystems = frozenset(self._refcounts)
+            self._idle_subsystems_stale = False
+        return self._idle_subsystems
+
+    def _dispatch(self, subsystems):
+        """Wake up everyone waiting on any of `subsystems`.  Any messages must already be in client.pending_messages.
+        """
+        # Work out everyone who's getting woken up before calling any of them, so that a waiter added by one of the
+        # callbacks doesn't get woken up by events that happened before it existed.
+        ready = {}
+        for subsystem in subsystems:
+            waiters = self._waiters.get(subsystem)
+            if waiters:
+                ready.update(waiters)
+        if 'message' in subsystems and self._channel_waiters:
+            for channel, messages in self.client.pending_messages.items():
+                if messages and channel in self._channel_waiters:
+                    ready.update(self._channel_waiters[channel])
+        for waiter in ready:
+            # one of the callbacks before it might have cancelled it
+            if waiter.active:
+                self._remove_waiter(waiter)
+                waiter.func(subsystems, *waiter.args, **waiter.kw)
+
+    def add_subsystem_waiter(self, subsystems, func, *args, **kw):
+        waiter = _Waiter(frozenset(subsystems), None, func, args, kw)
+        for subsystem in waiter.subsystems:
+            self._waiters.setdefault(subsystem, {})[waiter] = None
+        self._incref(waiter.subsystems)
+        return waiter
+
+    def add_channel_waiter(self, channel, func, *args, **kw):
+        waiter = _Waiter(_message_subsystem, channel, func, args, kw)
+        self._channel_waiters.setdefault(channel, {})[waiter] = None
+        self._incref(waiter.subsystems)
+        return waiter
+
+    def _remove_waiter(self, waiter):
+        if not waiter.active:
+            return
+        waiter.active = False
+        if waiter.channel is not None:
+            index, keys = self._channel_waiters, (waiter.channel,)
+        else:
+            index, keys = self._waiters, waiter.subsystems
+        for key in keys:
+            waiters = index[key]
+            del waiters[waiter]
+            if not waiters:
+                del index[key]
+        self._decref(waiter.subsystems)
+
+    def cancel(self, waiter):
+        if isinstance(waiter, _Waiter):
+            self._remove_waiter(waiter)
+        else:
+            raise TypeError
+
+
+class MPDLoop(BaseMPDLoop):
     def __init__(self, host='localhost', port=6600):
+        super().__init__()
         self.client = mpdclient.MPDClient(host, port)
         self.client.set_idle_cancel_callback(self._handle_idle_results)
-        self.scheduler = sched.scheduler(delayfunc=self._idle)
-        self.waiters: list[_Waiter] = []
+        # heap of (when, sequence number, _Timer).  Cancelled timers are left where they are and skipped when they come
+        # up, since taking something out of the middle of a heap means rebuilding it.
+        self._timers = []
+        self._timer_sequence = itertools.count()
+        self._cancelled_timers = 0
 
     def _idle(self, timeout):
-        subsystems = accumulate(frozenset.union, (x.subsystems for x in self.waiters))
+        subsystems = self._wanted_subsystems()
         if not subsystems:
-            time.sleep(timeout)
+            if timeout is not None:
+                time.sleep(timeout)
             return
+        # does nothing if there's already an idle running for the same subsystems
         self.client.send_idle(subsystems)
         if select.select([self.client], [], [], timeout)[0]:
             subsystems = self.client.receive_idle()
@@ -41,39 +160,55 @@ class MPDLoop:
         #print('!', subsystems)
         if 'message' in subsystems:
             self.client.read_messages()
-        i = 0
-        while i < len(self.waiters):
-            waiter = self.waiters[i]
-            if not waiter.subsystems.isdisjoint(subsystems) and (
-                    not waiter.channel or self.client.pending_messages.get(waiter.channel)):
-                waiter.func(subsystems, *waiter.args, **waiter.kw)
-                del self.waiters[i]
-            else:
-                i += 1
-
-    def add_subsystem_waiter(self, subsystems, func, *args, **kw):
-        waiter = _Waiter(frozenset(subsystems), None, func, args, kw)
-        self.waiters.append(waiter)
-        return waiter
-
-    def add_channel_waiter(self, channel, func, *args, **kw):
-        waiter = _Waiter(_message_subsystem, channel, func, args, kw)
-        self.waiters.append(waiter)
-        return waiter
+        self._dispatch(subsystems)
 
     def call_soon(self, seconds, func, *args, **kwargs):
-        return self.scheduler.enter(seconds, 0, func, args, kwargs)
+        timer = _Timer(time.monotonic() + seconds, func, args, kwargs)
+        heapq.heappush(self._timers, (timer.when, next(self._timer_sequence), timer))
+        return timer
 
     def cancel(self, waiter):
-        if isinstance(waiter, _Waiter):
-            self.waiters.remove(waiter)
-        elif isinstance(waiter, sched.Event):
-            self.scheduler.cancel(waiter)
+        if isinstance(waiter, _Timer):
+            if not waiter.done:
+                waiter.done = True
+                self._cancelled_timers += 1
+                if self._cancelled_timers > 64 and self._cancelled_timers > len(self._timers) // 2:
+                    # mostly tombstones; clear them out so the heap doesn't grow forever.
+                    self._timers = [entry for entry in self._timers if not entry[2].done]
+                    heapq.heapify(self._timers)
+                    self._cancelled_timers = 0
         else:
-            raise TypeError
+            super().cancel(waiter)
+
+    def _next_timer(self):
+        while self._timers and self._timers[0][2].done:
+            heapq.heappop(self._timers)
+            self._cancelled_timers -= 1
+        return self._timers[0][2] if self._timers else None
+
+    def _run_timers(self):
+        # Only the ones that were due when we started: anything they schedule for right away waits for the next round,
+        # so a task that keeps rescheduling itself can't lock everything else out.
+        now = time.monotonic()
+        while True:
+            timer = self._next_timer()
+            if timer is None or timer.when > now:
+                return
+            heapq.heappop(self._timers)
+            timer.done = True
+            timer.func(*timer.args, **timer.kw)
 
     def run(self):
-        self.scheduler.run()
-        while self.waiters:
-            self._idle(None)
-            self.scheduler.run()
+        while True:
+            self._run_timers()
+            timer = self._next_timer()
+            if timer is not None:
+                timeout = timer.when - time.monotonic()
+                if timeout <= 0:
+                    # something's due already; don't bother starting an idle just to cancel it straight away.
+                    continue
+            elif self._refcounts:
+                timeout = None
+            else:
+                return
+            self._idle(timeout)
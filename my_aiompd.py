@@ -1,12 +1,140 @@
 import asyncio
+import sys
 from typing import Optional
 import re
 import collections
-__all__ = ['Client', 'MPDError']
+__all__ = ['Client', 'MPDError', 'IdleSubscription', 'ChannelSubscription', 'RecordStream', 'SearchResults', 'Song', 'RECORD_DELIMITERS',
+           'ALL_SUBSYSTEMS', 'LIST_OK', 'FILTER_OPERATORS', 'filter_expression']
+
+# Keys that the server sends as the first line of each entry in a listing (lsinfo, playlistinfo, listallinfo, etc.)
+RECORD_DELIMITERS = frozenset(['file', 'directory', 'playlist'])
+
+
+def _quote(arg: bytes, forcequote=False) -> bytes:
+    if forcequote or b' ' in arg or b'"' in arg or b'\\' in arg or b"'" in arg:
+        return b'"' + arg.replace(b'\\', b'\\\\').replace(b'"', b'\\"') + b'"'
+    return arg
+
+
+def _format_command(command, args, forcequote=False):
+    cmdline = command.encode('ascii') if isinstance(command, str) else command
+    if args:
+        cmdline += b' ' + b' '.join(_quote(arg.encode('utf8') if isinstance(arg, str) else arg, forcequote)
+                                    for arg in args)
+    return cmdline + b'\n'
+
+
+# The comparisons a filter expression can make between a tag and a value.
+FILTER_OPERATORS = frozenset(['==', '!=', 'contains', '!contains', 'starts_with', '=~', '!~'])
+
+
+def filter_expression(*clauses, **tags) -> str:
+    """Build a filter expression for find, search, count, etc. out of (tag, operator, value) tuples and tag=value
+    keyword arguments, which all have to match:
+
+        filter_expression(('Title', 'contains', 'love'), Artist='AC/DC')
+        -> '((Title contains "love") AND (Artist == "AC/DC"))'
+
+    Values are quoted and escaped the same way command arguments are, so they can contain anything.  The result is a
+    single argument, to be passed to send_command() like any other.  A clause can also be an expression that's
+    already been built, to combine it with others.
+    """
+    parts = []
+    for clause in clauses + tuple((tag, '==', value) for tag, value in tags.items()):
+        if isinstance(clause, str):
+            parts.append(clause)
+            continue
+        tag, op, value = clause
+        if op not in FILTER_OPERATORS:
+            raise ValueError('unknown filter operator %r' % op)
+        parts.append('(%s %s %s)' % (tag, op, _quote(str(value).encode('utf8'), forcequote=True).decode('utf8')))
+    if not parts:
+        raise ValueError('a filter needs at least one clause')
+    return parts[0] if len(parts) == 1 else '(%s)' % ' AND '.join(parts)
+
+
+# Stands in for the list_OK line the server sends after each command in a command list started with
+# command_list_ok_begin.
+LIST_OK = ('list_OK', None)
+
+# Every subsystem the server can report from idle.  Used to tell subscribers that anything might have changed after
+# we've been disconnected for a while.
+ALL_SUBSYSTEMS = ('database', 'update', 'stored_playlist', 'playlist', 'player', 'mixer', 'output', 'options',
+                  'partition', 'sticker', 'subscription', 'message', 'neighbor', 'mount')
+
+# Commands that don't change anything on the server.
+READ_ONLY_COMMANDS = frozenset([
+    b'status', b'currentsong', b'stats', b'playlistinfo', b'playlistid', b'playlistfind', b'playlistsearch',
+    b'plchanges', b'plchangesposid', b'lsinfo', b'listall', b'listallinfo', b'listfiles', b'find', b'search', b'count',
+    b'searchcount', b'list', b'listplaylists', b'listplaylist', b'listplaylistinfo', b'outputs', b'config',
+    b'readcomments', b'albumart', b'readpicture', b'getvol', b'ping', b'commands', b'notcommands', b'tagtypes',
+    b'replay_gain_status', b'decoders', b'urlhandlers', b'listmounts', b'listneighbors', b'listpartitions', b'channels',
+])
+# Commands that leave the server in the same state no matter how many times they're run, and so can safely be sent
+# again if the connection dropped before we heard back about them.  pause is only safe with an argument (a bare
+# pause toggles), which _is_replayable() takes care of.
+IDEMPOTENT_COMMANDS = READ_ONLY_COMMANDS | frozenset([
+    b'setvol', b'random', b'repeat', b'single', b'consume', b'crossfade', b'mixrampdb', b'replay_gain_mode',
+    b'play', b'playid', b'stop', b'seek', b'seekid', b'enableoutput', b'disableoutput', b'pause',
+])
+
+# Read-only commands whose results can be kept until an idle event says they've changed, and which subsystems those are.
+# status and stats aren't here because they include the elapsed time and uptime, which change without any events.
+CACHEABLE_COMMANDS = {
+    b'currentsong': frozenset(['player', 'playlist']),
+    b'playlistinfo': frozenset(['playlist']),
+    b'playlistid': frozenset(['playlist']),
+    b'lsinfo': frozenset(['database', 'stored_playlist']),
+    b'listplaylists': frozenset(['stored_playlist']),
+    b'outputs': frozenset(['output']),
+}
+
+# Commands that aren't read-only, but don't change anything a read-only command could see either, so they don't have to
+# throw away the read cache.  The idle loop sends a readmessages every time a C2C message arrives.
+MESSAGE_COMMANDS = frozenset([b'sendmessage', b'readmessages'])
+
+
+def _command_name(cmdline: bytes):
+    return cmdline.rstrip(b'\n').partition(b' ')[0]
+
+
+def _read_depends_on(cmdline: bytes, changed: frozenset):
+    # anything we don't know the subsystems of, like status, might be affected by any of them
+    subsystems = CACHEABLE_COMMANDS.get(_command_name(cmdline))
+    return subsystems is None or not subsystems.isdisjoint(changed)
+
+
+def _is_replayable(cmdline: bytes):
+    if cmdline.startswith(b'command_list'):
+        # a command list can be sent again if everything in it can.
+        lines = cmdline.rstrip(b'\n').split(b'\n')
+        return all(_is_replayable(line) for line in lines[1:-1])
+    name, _, args = cmdline.rstrip(b'\n').partition(b' ')
+    if name == b'pause':
+        return bool(args)
+    return name in IDEMPOTENT_COMMANDS
 
 
 class Client(asyncio.Protocol):
-    def __init__(self, host='localhost', port=6600, loop=None):
+    # If the connection drops, keep trying to reestablish it in the background, waiting this long after the first
+    # failed attempt and twice as long after each one after that, up to reconnect_delay_max.
+    reconnect_delay_min = 0.1
+    reconnect_delay_max = 30
+    # The reference implementation drops connections that haven't sent anything in a while (connection_timeout,
+    # 60 seconds by default), except for ones that are idling.  Send a ping if we've been quiet for this long.
+    keepalive_interval = 25
+    # With dedicated_idle, idle() keeps collecting changes for this long after it returns, so that a caller that calls
+    # it in a loop doesn't miss anything in between; after that, nobody's calling it anymore and they're dropped.
+    idle_call_linger = 10
+
+    def __init__(self, host='localhost', port=6600, loop=None, dedicated_idle=False, cache_reads=False):
+        """If `dedicated_idle` is True, idle() and subscribe_idle() are served by a second connection that sits in idle
+        permanently, rather than by this one.  Commands then never have to interrupt an idle (noidle, wait for the
+        answer, send the command, re-send idle) and cost exactly one round trip.
+
+        If `cache_reads` is True, the results of the commands in CACHEABLE_COMMANDS are kept and handed out again until
+        the server reports a change to something that would affect them.
+        """
         self._transport: Optional[asyncio.Transport] = None
         self._response_fut: Optional[asyncio.Future] = None
         self._incoming_response = []
@@ -22,6 +150,38 @@ class Client(asyncio.Protocol):
         self._host = host
         self._port = port
         self._loop = loop or asyncio.get_event_loop()
+        self._dedicated_idle = dedicated_idle
+        self._idler: Optional[Client] = None  # the connection that does the idling, if dedicated_idle is set
+        self._idle_task: Optional[asyncio.Task] = None
+        self._subscriptions = set()  # IdleSubscriptions fed by _idle_loop()
+        # The subsystems _idle_loop() idles on: the union of everything in self._subscriptions, an empty set for all of
+        # them, or None if there are no subscriptions and the loop should stop.
+        self._idle_subsystems: Optional[frozenset] = None
+        # Subscriptions used by idle() when dedicated_idle is set, one for each distinct set of subsystems asked for, so
+        # that nothing that changes in between two calls to idle() gets missed.  Maps the set of subsystems to
+        # [subscription, how many idle() calls are waiting on it, the handle that closes it once nobody has for a while]
+        self._idle_call_subscriptions = {}
+        # channel name -> the ChannelSubscriptions reading it.  A channel is in here from the moment someone starts
+        # subscribing to it until the last of its subscriptions is closed, and for all that time idle_connection is
+        # subscribed to it on the server.
+        self._channels = {}
+        # The value of idle_connection._connection_count when the channels were last subscribed to.  If it's changed,
+        # the connection has been reopened and the server has forgotten them.
+        self._channels_connection = None
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._keepalive_handle: Optional[asyncio.TimerHandle] = None
+        self._closing = False  # set by close() so that connection_lost() knows not to reconnect
+        self._connection_count = 0  # how many times connection_made() has been called
+        # Read-only commands that have been asked for but not answered yet, mapping the command line to the task
+        # running it, so that anyone else who asks for the same thing in the meantime can wait for the same answer.
+        self._in_flight = {}
+        self._sent_reads = set()  # command lines in _in_flight that have been sent to the server
+        self._read_cache = {}  # command line -> response, for CACHEABLE_COMMANDS, if cache_reads is set
+        self._cache_subscription = None
+        if cache_reads:
+            # This subscription is never read from.  It's only there to make sure the idle loop keeps an eye on
+            # everything the cache depends on.
+            self._cache_subscription = self.subscribe_idle(*frozenset().union(*CACHEABLE_COMMANDS.values()))
 
     # async def _process_queue(self):
     #     while True:
@@ -32,33 +192,137 @@ class Client(asyncio.Protocol):
     #         self._transport.write(command)
 
     async def send_command(self, command, *args, forcequote=False, idle=False):
-        cmdline = command.encode('ascii') if isinstance(command, str) else command
-        if args:
-            cmdline += b' ' + b' '.join(
-                (b'"' + arg.replace(b'\\', b'\\\\').replace(b'"', b'\\"') + b'"'
-                 if forcequote or b' ' in arg or b'"' in arg or b'\\' in arg or b"'" in arg
-                 else arg)
-                for uarg in args
-                for arg in (uarg.encode('ascii') if isinstance(uarg, str) else uarg,)
-            )
-        return await self._send_command(cmdline+b'\n', idle=idle)
+        cmdline = _format_command(command, args, forcequote)
+        if not idle and _command_name(cmdline) in READ_ONLY_COMMANDS:
+            return await self._send_read_command(cmdline)
+        return await self._send_command(cmdline, idle=idle)
+
+    async def _send_read_command(self, cmdline):
+        # Identical read-only commands asked for at the same time (which happens a lot: every button handler asks for
+        # the status, and then so does the idle loop) all get the answer to the same request.  Each caller gets its
+        # own copy of the list, in case they decide to modify it.
+        if cmdline in self._read_cache:
+            return list(self._read_cache[cmdline])
+        task = self._in_flight.get(cmdline)
+        if task is None:
+            task = self._in_flight[cmdline] = self._loop.create_task(self._send_command(cmdline))
+            task.add_done_callback(lambda fut: self._read_command_done(cmdline, fut))
+        # shielded so that one caller giving up doesn't cancel the request for everyone else.
+        return list(await asyncio.shield(task))
+
+    def _read_command_done(self, cmdline, task: asyncio.Task):
+        if self._in_flight.get(cmdline) is not task:
+            # Something that might have changed the answer was sent after this was (or the connection was reset), so
+            # it's already been forgotten about, and it mustn't be cached either.
+            return
+        del self._in_flight[cmdline]
+        self._sent_reads.discard(cmdline)
+        if task.cancelled() or task.exception() is not None:
+            return
+        if self._cache_subscription is not None and _command_name(cmdline) in CACHEABLE_COMMANDS \
+                and self._idle_task is not None and not self._idle_task.done():
+            self._read_cache[cmdline] = task.result()
+
+    def _invalidate_read_cache(self, changed):
+        changed = frozenset(changed)
+        # A read that has been sent but not finished yet might have the old answer too (its response can arrive in the
+        # same go as the event), so, like after a write, it mustn't be handed out to anyone else or cached.
+        for cmdline in [cmdline for cmdline in self._sent_reads if _read_depends_on(cmdline, changed)]:
+            self._in_flight.pop(cmdline, None)
+            self._sent_reads.discard(cmdline)
+        for cmdline in list(self._read_cache):
+            if _read_depends_on(cmdline, changed):
+                del self._read_cache[cmdline]
+
+    async def command_list(self, *commands):
+        """Send several commands in a single round trip, and return a list of their responses.  Each command is either a
+        string, or a tuple of the command and its arguments.  If any of them fails, MPDError is raised and the ones
+        after it are not run.
+        """
+        cmdline = b'command_list_ok_begin\n' + b''.join(
+            _format_command(command, ()) if isinstance(command, (str, bytes))
+            else _format_command(command[0], command[1:])
+            for command in commands
+        ) + b'command_list_end\n'
+        responses = [[]]
+        for pair in await self._send_command(cmdline):
+            if pair is LIST_OK:
+                responses.append([])
+            else:
+                responses[-1].append(pair)
+        # there's nothing after the last list_OK.
+        del responses[-1]
+        return responses
+
+    async def stream_command(self, command, *args, forcequote=False, delimiters=RECORD_DELIMITERS, record_type=dict):
+        """Run a command and asynchronously iterate over its response one record at a time, rather than waiting for
+        the whole thing to arrive and holding all of it in memory at once.
+
+        A new record is started every time the server sends one of the keys in `delimiters` (by default, the keys
+        lsinfo, playlistinfo and friends start each entry with), and each record is passed to `record_type` as a list
+        of (key, value) pairs before being yielded.  If the consumer falls behind, the client stops reading from the
+        socket until it catches up.
+
+        If you stop iterating early, the rest of the response is read and thrown away in the background.  Note that the
+        command is not sent until the first record is requested.
+        """
+        cmdline = _format_command(command, args, forcequote)
+        stream = RecordStream(self, delimiters, record_type)
+        # The lock is released by the stream as soon as the server finishes sending the response (or the connection is
+        # lost), rather than when the consumer is done with it, so that a slow consumer doesn't tie up the connection
+        # any longer than it has to.
+        await self._lock.acquire()
+        try:
+            response = await self._begin_command(cmdline, sink=stream)
+        except BaseException:
+            self._lock.release()
+            raise
+        response.add_done_callback(stream._response_done)
+        try:
+            while True:
+                record = await stream.get()
+                if record is None:
+                    return
+                yield record
+        finally:
+            stream.discard()
+
+    def search(self, *clauses, exact=False, sort=None, page_size=16, record_type=None, **tags) -> 'SearchResults':
+        """Search the database for songs matching a filter (see filter_expression() for what the arguments mean).
+        Nothing is sent until the results are asked for, and then only a page at a time: see SearchResults.
+
+        If `exact` is True this uses find, which is case sensitive, rather than search, which isn't.  `sort` is a tag
+        to sort the results by, with a - in front for descending order.
+        """
+        return SearchResults(self, filter_expression(*clauses, **tags), exact=exact, sort=sort, page_size=page_size,
+                             record_type=record_type)
+
+    async def count(self, *clauses, group=None, **tags):
+        """Count the songs matching a filter.  Returns (number of songs, total playtime in seconds), or if `group` is a
+        tag, a dict mapping each value of that tag to (number of songs, total playtime).
+        """
+        args = [filter_expression(*clauses, **tags)]
+        if group is not None:
+            args += ['group', group]
+        response = await self.send_command('count', *args)
+        if group is None:
+            response = dict(response)
+            return int(response['songs']), int(response['playtime'])
+        groups = {}
+        value = None
+        for k, v in response:
+            if k == group:
+                value = v
+                groups[value] = [0, 0]
+            elif k == 'songs':
+                groups[value][0] = int(v)
+            elif k == 'playtime':
+                groups[value][1] = int(v)
+        return {value: tuple(counts) for value, counts in groups.items()}
 
     async def _send_command(self, command, *, idle=False):
         async with self._lock:
-            if self._transport is None:
-                await self.reconnect()
-            elif self._idling:
-                await self._cancel_idle()
-            # should be covered by the lock.
-            # if self._response_fut is not None:
-            #     # there's another command running, we have to wait in line
-            #     fut = self._loop.create_future()
-            #     self._queue.append(fut)
-            #     await fut
-            assert self._response_fut is None or self._response_fut.cancelled(), self._response_fut.command
-            self._response_fut = response = self._loop.create_future()
-            response.command = command  # for debugging purposes
-            self._transport.write(command)
+            response = await self._begin_command(command)
 
             if not idle:
                 return await response
@@ -76,7 +340,100 @@ class Client(asyncio.Protocol):
                 self._idling = True
                 return None
 
+    async def _begin_command(self, command, sink=None):
+        """Write a command to the server and return the future its response will be delivered to.  Must be called with
+        the lock held.  If `sink` is passed, response lines are appended to it instead of being collected into a list.
+        """
+        if self._transport is None:
+            await self._ensure_connected()
+        elif self._idling:
+            await self._cancel_idle()
+        # should be covered by the lock.
+        # if self._response_fut is not None:
+        #     # there's another command running, we have to wait in line
+        #     fut = self._loop.create_future()
+        #     self._queue.append(fut)
+        #     await fut
+        assert self._response_fut is None or self._response_fut.cancelled(), self._response_fut.command
+        self._response_fut = response = self._loop.create_future()
+        response.command = command  # for debugging purposes
+        if sink is not None:
+            self._incoming_response = sink
+        name = _command_name(command)
+        if name in READ_ONLY_COMMANDS:
+            # only the ones other callers can be handed the answer to (see _send_read_command()); streamed and plain
+            # _send_command() reads never go through _in_flight
+            if self._in_flight.get(command) is asyncio.current_task():
+                self._sent_reads.add(command)
+        elif name != b'idle' and name not in MESSAGE_COMMANDS:
+            # This might change something, so anything read before now is out of date, and any read that's already
+            # been sent shouldn't be handed out to anyone who asks for it after this.  Reads that are still waiting
+            # for their turn will be sent after this one, so they're fine.
+            for cmdline in self._sent_reads:
+                self._in_flight.pop(cmdline, None)
+            self._sent_reads.clear()
+            self._read_cache.clear()
+        self._transport.write(command)
+        self._schedule_keepalive()
+        return response
+
+    async def _ensure_connected(self):
+        if self._transport is not None:
+            return
+        if self._reconnect_task is None or self._reconnect_task.done():
+            # Always in a task, so that everyone who finds the connection closed at the same time (the idle loop doesn't
+            # hold the lock when it checks) waits for the same attempt rather than opening one each.
+            self._reconnect_task = self._loop.create_task(self.reconnect())
+        # shielded so that a command getting cancelled while it waits doesn't stop the reconnection for everyone else
+        await asyncio.shield(self._reconnect_task)
+
+    async def _reconnect_with_backoff(self):
+        delay = self.reconnect_delay_min
+        while self._transport is None and not self._closing:
+            try:
+                await self.reconnect()
+            except OSError:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.reconnect_delay_max)
+
+    def _schedule_keepalive(self):
+        if self._keepalive_handle is not None:
+            self._keepalive_handle.cancel()
+            self._keepalive_handle = None
+        if self.keepalive_interval and self._transport is not None:
+            self._keepalive_handle = self._loop.call_later(self.keepalive_interval, self._keepalive)
+
+    def _keepalive(self):
+        self._keepalive_handle = None
+        if self._idling or self._lock.locked():
+            # idling connections are exempt from the timeout, and if a command is running we aren't quiet anyway.
+            self._schedule_keepalive()
+        else:
+            self._loop.create_task(self._ping())
+
+    async def _ping(self):
+        try:
+            await self.send_command('ping')
+        except (MPDError, ConnectionError):
+            # the reconnect logic will take it from here.
+            pass
+
     async def idle(self, *subsystems):
+        if self._dedicated_idle:
+            key = frozenset(subsystems)
+            entry = self._idle_call_subscriptions.get(key)
+            if entry is None:
+                entry = self._idle_call_subscriptions[key] = [self.subscribe_idle(*subsystems), 0, None]
+            elif entry[2] is not None:
+                entry[2].cancel()
+                entry[2] = None
+            entry[1] += 1
+            try:
+                return await entry[0].get()
+            finally:
+                entry[1] -= 1
+                if entry[1] == 0 and self._idle_call_subscriptions.get(key) is entry:
+                    entry[2] = self._loop.call_later(self.idle_call_linger, self._drop_idle_call_subscription, key)
         # if someone is trying to cancel an idle command, ensure that this method cannot start until it finishes
         # whatever it is trying to do.
 
@@ -85,23 +442,244 @@ class Client(asyncio.Protocol):
         response_fut.add_done_callback(self._cancel_idle_on_future_cancelled)
         return [x[1] for x in (await response_fut) if x[0] == 'changed']
 
+    def _drop_idle_call_subscription(self, key):
+        subscription, callers, handle = self._idle_call_subscriptions.pop(key)
+        subscription.close()
+
+    def subscribe_idle(self, *subsystems) -> 'IdleSubscription':
+        """Start watching for changes to the given subsystems (or all of them, if none are given).  Changes are
+        collected by the returned subscription until they're read out of it, so nothing gets missed in between reads.
+
+        Any number of subscriptions can exist at once; they all share a single idle command covering every subsystem
+        anyone is subscribed to.  Without dedicated_idle, that idle runs on this connection and gets interrupted by
+        every command, so don't mix subscriptions with calling idle() yourself.
+        """
+        subscription = IdleSubscription(self, subsystems)
+        self._subscriptions.add(subscription)
+        self._update_idle_subsystems()
+        return subscription
+
+    def _unsubscribe_idle(self, subscription: 'IdleSubscription'):
+        self._subscriptions.discard(subscription)
+        self._update_idle_subsystems()
+
+    async def subscribe_channel(self, channel, maxlen=256, drop='oldest') -> 'ChannelSubscription':
+        """Subscribe to a client-to-client (C2C) channel, and return a ChannelSubscription that collects the messages
+        sent to it.  Messages are picked up by the idle loop, all of them at once with a single readmessages whenever
+        the server says there are some, and the subscription is renewed whenever the connection is reopened.
+
+        Up to `maxlen` messages are kept until they're read (None for no limit).  Past that, `drop` says which to lose:
+        'oldest' makes room for each new message by throwing away the oldest one, and 'newest' ignores new messages
+        until there's room again.
+        """
+        if drop not in ('oldest', 'newest'):
+            raise ValueError("drop must be 'oldest' or 'newest', not %r" % drop)
+        subscriptions = self._channels.get(channel)
+        if subscriptions is None:
+            # Put the channel in before we've heard back, so that if a close() of the last subscription to it has an
+            # unsubscribe waiting to be sent, it knows not to bother.
+            self._channels[channel] = []
+            conn = self.idle_connection
+            try:
+                await self._send_subscribe(conn, channel)
+            except BaseException:
+                if not self._channels.get(channel):
+                    del self._channels[channel]
+                raise
+            if self._channels_connection is None:
+                self._channels_connection = conn._connection_count
+            subscriptions = self._channels.setdefault(channel, [])
+        subscription = ChannelSubscription(self, channel, maxlen, drop)
+        subscriptions.append(subscription)
+        self._update_idle_subsystems()
+        return subscription
+
+    @staticmethod
+    async def _send_subscribe(conn: 'Client', channel):
+        try:
+            await conn.send_command('subscribe', channel)
+        except MPDError as e:
+            if e.code != 56:  # already subscribed
+                raise
+
+    def _unsubscribe_channel(self, subscription: 'ChannelSubscription'):
+        subscriptions = self._channels.get(subscription.channel)
+        if subscriptions is None or subscription not in subscriptions:
+            return
+        subscriptions.remove(subscription)
+        if not subscriptions:
+            del self._channels[subscription.channel]
+            self._loop.create_task(self._send_unsubscribe(subscription.channel))
+        self._update_idle_subsystems()
+
+    async def _send_unsubscribe(self, channel):
+        if channel in self._channels:
+            # someone subscribed to it again in the meantime
+            return
+        try:
+            await self.idle_connection.send_command('unsubscribe', channel)
+        except (MPDError, ConnectionError):
+            # either we weren't subscribed anymore anyway, or the connection's gone and the subscription with it.
+            pass
+
+    async def _restore_channels(self, conn: 'Client'):
+        self._channels_connection = conn._connection_count
+        for channel in list(self._channels):
+            await self._send_subscribe(conn, channel)
+
+    async def _read_messages(self, conn: 'Client'):
+        channel = None
+        received = set()
+        for k, v in await conn.send_command('readmessages'):
+            if k == 'channel':
+                channel = self._channels.get(v, ())
+            elif k == 'message':
+                for subscription in channel:
+                    subscription._put(v)
+                    received.add(subscription)
+        for subscription in received:
+            subscription._wake()
+
+    def _update_idle_subsystems(self):
+        if not self._subscriptions and not self._channels:
+            subsystems = None
+        elif any(not subscription.subsystems for subscription in self._subscriptions):
+            subsystems = frozenset()
+        else:
+            subsystems = frozenset().union(*(subscription.subsystems for subscription in self._subscriptions))
+            if self._channels:
+                subsystems |= {'message'}
+        if subsystems == self._idle_subsystems and self._idle_task is not None and not self._idle_task.done():
+            return
+        self._idle_subsystems = subsystems
+        if subsystems is None:
+            if self._idle_task is not None:
+                self._idle_task.cancel()
+                self._idle_task = None
+        elif self._idle_task is None or self._idle_task.done():
+            self._idle_task = self._loop.create_task(self._idle_loop())
+        else:
+            # Ask the running idle to finish early, and the loop will start the next one with the new subsystems.
+            # Whatever it reports on the way out still gets passed along.
+            self.idle_connection._interrupt_idle()
+
+    @property
+    def idle_connection(self) -> 'Client':
+        """The connection the idle loop runs on: the second connection if dedicated_idle is set, otherwise this one.
+        The server only reports 'message' events to the connection that subscribed to the channel, so C2C channel
+        subscriptions (and the readmessages that goes with them) have to be done on this connection.
+        """
+        if not self._dedicated_idle:
+            return self
+        if self._idler is None:
+            self._idler = Client(self._host, self._port, loop=self._loop)
+        return self._idler
+
+    def _interrupt_idle(self):
+        if self._idling and self._transport is not None:
+            # The server ignores noidle if it isn't idling, so it doesn't matter if this races with something else
+            # cancelling the idle.
+            self._transport.write(b'noidle\n')
+
+    async def _idle_loop(self):
+        # There's no gap in which changes can be missed between one idle command finishing and the next one being sent:
+        # the server remembers everything that changed while a connection wasn't idling, and reports it as soon as the
+        # next idle command arrives.
+        conn = self.idle_connection
+        try:
+            while self._idle_subsystems is not None:
+                if self._channels:
+                    # Channel subscriptions have to be back in place before the idle, or messages would go nowhere
+                    # until something else made us reconnect.
+                    await conn._ensure_connected()
+                    if self._channels_connection != conn._connection_count:
+                        try:
+                            await self._restore_channels(conn)
+                        except ConnectionError:
+                            # dropped again already; round we go
+                            continue
+                subsystems = self._idle_subsystems
+                await conn.send_command('idle', *sorted(subsystems), idle=True)
+                response_fut = conn._response_fut
+                response_fut.add_done_callback(conn._cancel_idle_on_future_cancelled)
+                if subsystems != self._idle_subsystems:
+                    # the subscriptions changed while we were waiting for our turn to send the idle.
+                    conn._interrupt_idle()
+                changed = [v for k, v in await response_fut if k == 'changed']
+                if conn._transport is None:
+                    # The connection dropped.  Once it's back, tell everyone that anything might have changed, since we
+                    # weren't around to hear about it.
+                    self._invalidate_read_cache(ALL_SUBSYSTEMS)
+                    await conn._ensure_connected()
+                    changed = ALL_SUBSYSTEMS
+                if 'message' in changed and self._channels:
+                    try:
+                        await self._read_messages(conn)
+                    except ConnectionError:
+                        # The messages went with the connection.  Everyone still gets told about `changed`, and the
+                        # top of the loop reconnects and subscribes again.
+                        pass
+                if changed:
+                    self._invalidate_read_cache(changed)
+                    for subscription in list(self._subscriptions):
+                        subscription._notify(changed)
+        except Exception as e:
+            # Pass the error along to the subscribers.  The next one to wait for something will start the loop back up.
+            for subscription in self._subscriptions:
+                subscription._set_exception(e)
+            for subscriptions in self._channels.values():
+                for subscription in subscriptions:
+                    subscription._set_exception(e)
+
+    def _ensure_idle_loop(self):
+        if (self._subscriptions or self._channels) and (self._idle_task is None or self._idle_task.done()):
+            self._update_idle_subsystems()
+
+    def close(self):
+        """Close the connection(s) to the server.  They will be reopened the next time you send a command.
+        """
+        self._closing = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            self._reconnect_task = None
+        if self._keepalive_handle is not None:
+            self._keepalive_handle.cancel()
+            self._keepalive_handle = None
+        if self._idle_task is not None:
+            self._idle_task.cancel()
+            self._idle_task = None
+        for subscription, callers, handle in self._idle_call_subscriptions.values():
+            if handle is not None:
+                handle.cancel()
+            subscription.close()
+        self._idle_call_subscriptions.clear()
+        if self._idler is not None:
+            self._idler.close()
+        if self._transport is not None:
+            self._transport.close()
+
     def _cancel_idle_on_future_cancelled(self, fut: asyncio.Future):
-        if fut.cancelled():
+        if fut.cancelled() and self._transport is not None:
             self._transport.write(b'noidle\n')
 
     async def _cancel_idle(self):
         assert self._idling
-        fut = self._response_fut
-        self._transport.write(b'noidle\n')
-        # for some reason Python does funny things if the future you're waiting on gets set to None before you wake up
-        # so we have to do this
+        if not self._response_fut.cancelled():
+            # (if it was cancelled, _cancel_idle_on_future_cancelled has already sent the noidle)
+            self._transport.write(b'noidle\n')
+        # Wait for the server to actually answer the idle, rather than for its future, which might have been cancelled
+        # long before the answer arrives.  If anything else got sent in between, every response after it would be
+        # handed to the wrong command.
+        done = self._loop.create_future()
+        self._queue.append(done)
         try:
-            await fut
+            await done
         finally:
             self._idling = False
 
 
     async def reconnect(self):
+        self._closing = False
         if '/' in self._host:
             await self._loop.create_unix_connection(lambda: self, self._host)
         else:
@@ -110,10 +688,24 @@ class Client(asyncio.Protocol):
     def connection_made(self, transport: asyncio.Transport) -> None:
         self._transport = transport
         self._version = None
+        self._connection_count += 1
+        if self._response_fut is not None and not self._idling:
+            # a command that was in flight when the connection dropped and was safe to send again.
+            transport.write(self._response_fut.command)
+        self._schedule_keepalive()
 
     def connection_lost(self, exc: Optional[Exception]) -> None:
         self._transport = None
-        self._lines = []
+        # throw away anything left over from a half-received response
+        replay = isinstance(self._incoming_response, list)
+        self._incoming_response = []
+        self._data_pending = b''
+        self._binary_length = None
+        self._binary = b''
+        self._version = None
+        if self._keepalive_handle is not None:
+            self._keepalive_handle.cancel()
+            self._keepalive_handle = None
         if self._idling:
             # The server isn't supposed to drop connection during an idle command, but on the off-chance it does,
             # we should treat it as though the idle was simply aborted and let the code that requested the idle
@@ -121,10 +713,23 @@ class Client(asyncio.Protocol):
             if not self._response_fut.cancelled():
                 self._response_fut.set_result([])
             self._idling = False
-        elif self._response_fut and not self._response_fut.cancelled():
+            self._response_fut = None
+            while self._queue:
+                waiter = self._queue.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+        elif self._response_fut is not None and not self._response_fut.cancelled() and not self._closing \
+                and replay and _is_replayable(self._response_fut.command):
+            # Leave the future where it is, and connection_made() will send the command again once we're back.
+            # Whoever is waiting on it is still holding the lock, so nothing else can sneak in first.
+            pass
+        elif self._response_fut:
             # if a command was running, cancel it
-            self._response_fut.set_exception(exc or ConnectionResetError)
-        self._response_fut = None
+            if not self._response_fut.cancelled():
+                self._response_fut.set_exception(exc or ConnectionResetError())
+            self._response_fut = None
+        if not self._closing and (self._reconnect_task is None or self._reconnect_task.done()):
+            self._reconnect_task = self._loop.create_task(self._reconnect_with_backoff())
 
     def data_received(self, data: bytes) -> None:
         if self._binary_length is not None:
@@ -135,16 +740,23 @@ class Client(asyncio.Protocol):
             self._binary_length -= len(binary)
             if self._binary_length == 0:
                 assert self._binary[-1:] == b'\n'
-                self._incoming_response.append(('binary', self._binary[:-1]))
+                self._incoming_response.append(('binary', bytes(self._binary[:-1])))
                 self._binary_length = None
         elif self._data_pending:
             data = self._data_pending + data
 
-        line, sep, data = data.partition(b'\n')
-        while sep:
+        # Walk through the data by index rather than partitioning off one line at a time: each partition copies
+        # everything after the line, which makes a big response (a whole playlistinfo arrives in 256k reads) quadratic.
+        pos = 0
+        end = data.find(b'\n')
+        while end != -1:
+            line = data[pos:end]
+            pos = end + 1
             if self._version is None:
                 assert line.startswith(b'OK ')
                 self._version = line[3:].strip().decode('ascii')
+            elif line == b'list_OK':
+                self._incoming_response.append(LIST_OK)
             elif line == b'OK':
                 assert self._response_fut is not None, 'no future waiting'
                 if not self._response_fut.cancelled():
@@ -152,8 +764,10 @@ class Client(asyncio.Protocol):
                 self._response_fut = None
                 self._idling = False
                 if self._queue:
-                    self._queue.popleft().set_result(None)
-                assert not data
+                    waiter = self._queue.popleft()
+                    if not waiter.done():
+                        waiter.set_result(None)
+                assert pos == len(data)
                 self._incoming_response = []
                 self._data_pending = b''
                 return
@@ -164,8 +778,10 @@ class Client(asyncio.Protocol):
                 self._response_fut = None
                 self._idling = False
                 if self._queue:
-                    self._queue.popleft().set_result(None)
-                assert not data
+                    waiter = self._queue.popleft()
+                    if not waiter.done():
+                        waiter.set_result(None)
+                assert pos == len(data)
                 self._incoming_response = []
                 self._data_pending = b''
                 return
@@ -177,17 +793,415 @@ class Client(asyncio.Protocol):
                     # XXX Having this code be replicated seems bad to me, but I don't really want to recurse.
                     assert self._binary_length is None, self._binary_length
                     binary_length = int(value) + 1  # add one byte for the newline at the end.
-                    self._binary = data[:binary_length]
-                    if binary_length > len(data):
-                        self._binary_length = binary_length-len(data)
+                    if binary_length > len(data) - pos:
+                        # the rest arrives in later reads; collect it in a bytearray so that isn't quadratic either.
+                        self._binary = bytearray(data[pos:])
+                        self._binary_length = binary_length - len(self._binary)
                     else:
+                        self._binary = data[pos:pos + binary_length]
                         assert self._binary[-1:] == b'\n'
                         self._incoming_response.append(('binary', self._binary[:-1]))
-                    data = data[binary_length:]
+                    pos += binary_length
                 else:
                     self._incoming_response.append((key, value))
-            line, sep, data = data.partition(b'\n')
-        self._data_pending = line
+            end = data.find(b'\n', pos)
+        self._data_pending = data[pos:]
+
+
+class IdleSubscription:
+    """Collects changes to a set of subsystems on behalf of one consumer.  Created by Client.subscribe_idle().
+
+    Changes are coalesced the same way the server does it: if the player changes three times before you get around to
+    reading the subscription, you find out once that the player changed.
+    """
+    def __init__(self, client: Client, subsystems):
+        self._client = client
+        self.subsystems = frozenset(subsystems)  # empty means all of them
+        self._pending = set()
+        self._waiter: Optional[asyncio.Future] = None
+        self._exception = None
+
+    def _notify(self, changed):
+        if self.subsystems:
+            changed = [x for x in changed if x in self.subsystems]
+        if changed:
+            self._pending.update(changed)
+            if self._waiter is not None and not self._waiter.done():
+                self._waiter.set_result(None)
+
+    def _set_exception(self, exc):
+        self._exception = exc
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def get_nowait(self) -> list:
+        """Return the list of subsystems that have changed since the last time this was called, which may be empty.
+        """
+        changed = sorted(self._pending)
+        self._pending.clear()
+        return changed
+
+    async def get(self) -> list:
+        """Wait for at least one subsystem to change, then return the list of everything that has.
+        """
+        while not self._pending:
+            if self._exception is not None:
+                exc, self._exception = self._exception, None
+                raise exc
+            self._client._ensure_idle_loop()
+            self._waiter = self._client._loop.create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        return self.get_nowait()
+
+    def close(self):
+        self._client._unsubscribe_idle(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.get()
+
+
+class ChannelSubscription:
+    """Collects the messages sent to a client-to-client channel on behalf of one consumer.  Created by
+    Client.subscribe_channel().
+
+    `messages` is the deque of messages that have arrived and haven't been read yet, oldest first.  `dropped` counts
+    the ones that had to be thrown away because it was full.
+    """
+    def __init__(self, client: Client, channel, maxlen, drop):
+        self._client = client
+        self.channel = channel
+        # with drop='oldest', the deque does the dropping itself
+        self.messages = collections.deque(maxlen=maxlen if drop == 'oldest' else None)
+        self.maxlen = maxlen
+        self.drop = drop
+        self.dropped = 0
+        self._waiter: Optional[asyncio.Future] = None
+        self._exception = None
+
+    def _put(self, message):
+        if self.maxlen is not None and len(self.messages) >= self.maxlen:
+            self.dropped += 1
+            if self.drop == 'newest':
+                return
+        self.messages.append(message)
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def _set_exception(self, exc):
+        self._exception = exc
+        self._wake()
+
+    def get_nowait(self) -> list:
+        """Return every message that has arrived since the last time this was called, which may be none.
+        """
+        messages = list(self.messages)
+        self.messages.clear()
+        return messages
+
+    async def _wait(self):
+        while not self.messages:
+            if self._exception is not None:
+                exc, self._exception = self._exception, None
+                raise exc
+            self._client._ensure_idle_loop()
+            self._waiter = self._client._loop.create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+
+    async def get(self) -> list:
+        """Wait for at least one message, then return all of them.
+        """
+        await self._wait()
+        return self.get_nowait()
+
+    def close(self):
+        self._client._unsubscribe_channel(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        # one message at a time, unlike get()
+        await self._wait()
+        return self.messages.popleft()
+
+
+class RecordStream:
+    """Receives the lines of a single response on behalf of Client.stream_command(), splitting them up into records and
+    buffering them until the consumer asks for them.
+    """
+    # Once this many records are waiting to be consumed, stop reading from the socket, and don't start again until the
+    # consumer has worked its way back down to low_water.
+    high_water = 256
+    low_water = 64
+
+    def __init__(self, client: Client, delimiters=RECORD_DELIMITERS, record_type=dict):
+        self._client = client
+        self._delimiters = delimiters
+        self._record_type = record_type
+        self._records = collections.deque()
+        self._record = []  # (key, value) pairs of the record currently being received
+        self._waiter: Optional[asyncio.Future] = None
+        self._done = False
+        self._exception = None
+        self._paused = False
+        self._discarding = False
+
+    def append(self, pair):
+        # called by Client.data_received() for every line of the response
+        if self._discarding:
+            return
+        if pair[0] in self._delimiters and self._record:
+            self._push_record()
+        self._record.append(pair)
+
+    def _push_record(self):
+        self._records.append(self._record_type(self._record))
+        self._record = []
+        if not self._paused and len(self._records) >= self.high_water and self._client._transport is not None:
+            self._client._transport.pause_reading()
+            self._paused = True
+        self._wakeup()
+
+    def _resume(self):
+        if self._paused:
+            self._paused = False
+            if self._client._transport is not None:
+                self._client._transport.resume_reading()
+
+    def _wakeup(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def _response_done(self, fut: asyncio.Future):
+        if fut.cancelled():
+            self._exception = asyncio.CancelledError()
+        elif fut.exception() is not None:
+            self._exception = fut.exception()
+        if self._record and not self._discarding:
+            self._push_record()
+        self._done = True
+        self._resume()
+        self._wakeup()
+        self._client._lock.release()
+
+    async def get(self):
+        """Return the next record, or None once the response is over.  Raises MPDError if the server sent an error
+        after the records that have already been returned.
+        """
+        while not self._records:
+            if self._done:
+                if self._exception is not None:
+                    raise self._exception
+                return None
+            self._waiter = self._client._loop.create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        record = self._records.popleft()
+        if len(self._records) <= self.low_water:
+            self._resume()
+        return record
+
+    def discard(self):
+        """Throw away any records that have not been consumed yet, and any that arrive from now on.
+        """
+        self._discarding = True
+        self._records.clear()
+        self._record = []
+        self._resume()
+
+
+class SearchResults:
+    """The results of a search, fetched a page at a time as they're asked for using the server's window parameter, so
+    a search that matches half the library only transfers the part of it that actually gets looked at.  Pages are
+    kept once fetched.  Created by Client.search().
+
+        results = client.search(('any', 'contains', 'love'), sort='Artist')
+        first_page = await results.page(0)
+        async for song in results:  # fetches the rest as it goes
+            ...
+    """
+    def __init__(self, client: Client, expression: str, exact=False, sort=None, page_size=16, record_type=None):
+        self._client = client
+        self.expression = expression
+        self.command = 'find' if exact else 'search'
+        self.sort = sort
+        self.page_size = page_size
+        self._record_type = record_type or Song.from_pairs
+        self._pages = {}  # page number -> task fetching it
+        self.length: Optional[int] = None  # how many results there are, once we know
+
+    def page(self, n) -> 'asyncio.Future':
+        """Return (an awaitable for) the list of results on page `n`, which is empty if there aren't that many pages.
+        Several callers asking for the same page share one request.
+        """
+        if n < 0:
+            raise IndexError(n)
+        task = self._pages.get(n)
+        if task is None or (task.done() and (task.cancelled() or task.exception() is not None)):
+            if self.length is not None and n * self.page_size >= self.length:
+                task = self._client._loop.create_future()
+                task.set_result([])
+            else:
+                task = self._client._loop.create_task(self._fetch(n))
+            self._pages[n] = task
+        return task
+
+    def prefetch(self, n):
+        """Start fetching page `n` (if there is one) without waiting for it.
+        """
+        if n >= 0 and (self.length is None or n * self.page_size < self.length):
+            self.page(n)
+
+    async def _fetch(self, n):
+        start = n * self.page_size
+        args = [self.expression]
+        if self.sort:
+            args += ['sort', self.sort]
+        args += ['window', '%d:%d' % (start, start + self.page_size)]
+        page = [record async for record in self._client.stream_command(self.command, *args,
+                                                                        record_type=self._record_type)]
+        if len(page) < self.page_size and (self.length is None or start + len(page) < self.length):
+            # A short page is the last one.  An empty one further on only tells us the end is somewhere before it (the
+            # results might have shrunk since the page before it was fetched), but that's enough to stop anyone asking
+            # for pages after it, and whichever page the end is really on lowers it again when that one is fetched.
+            self.length = start + len(page)
+        return page
+
+    async def get(self, index):
+        """Return result number `index`, or None if there aren't that many.
+        """
+        page = await self.page(index // self.page_size)
+        index %= self.page_size
+        return page[index] if index < len(page) else None
+
+    async def count(self) -> int:
+        """Find out how many results there are (with a count command, if we haven't already found the end).
+        """
+        if self.length is None:
+            response = dict(await self._client.send_command('count' if self.command == 'find' else 'searchcount',
+                                                            self.expression))
+            self.length = int(response['songs'])
+        return self.length
+
+    async def __aiter__(self):
+        n = 0
+        while True:
+            page = await self.page(n)
+            for record in page:
+                yield record
+            if len(page) < self.page_size:
+                return
+            n += 1
+
+
+class Song:
+    """One song from a listing, stored as compactly as is reasonable, for when there are tens of thousands of them.
+
+    The tags every screen cares about get their own slots, and everything else goes into `extra` as a tuple of (key,
+    value) pairs.  Values that tend to be shared by lots of songs (artist, album, genre...) are interned so that each of
+    them is only stored once, and numbers are parsed once, here, rather than every time someone needs them.
+    Pass Song.from_pairs as the record_type to Client.stream_command() to parse a response straight into these.
+    """
+    __slots__ = ('file', 'id', 'pos', 'duration', 'title', 'artist', 'album', 'albumartist', 'name', 'genre', 'date',
+                 'track', 'extra')
+
+    # MPD key -> slot, for the tags that get slots.  The ones in _INTERNED are interned.
+    _SLOTS = {'file': 'file', 'Title': 'title', 'Artist': 'artist', 'Album': 'album', 'AlbumArtist': 'albumartist',
+              'Name': 'name', 'Genre': 'genre', 'Date': 'date', 'Track': 'track'}
+    _INTERNED = frozenset(['Artist', 'Album', 'AlbumArtist', 'Genre', 'Date', 'Track', 'Name', 'Format', 'Composer',
+                           'Performer', 'Label', 'OriginalDate', 'Disc'])
+    # Keys that are different for almost every song and that nothing here looks at, so they aren't kept at all.
+    _DROPPED = frozenset(['Last-Modified', 'Added'])
+
+    def __init__(self, file):
+        self.file = file
+        self.id = None
+        self.pos = None
+        self.duration = None
+        self.title = None
+        self.artist = None
+        self.album = None
+        self.albumartist = None
+        self.name = None
+        self.genre = None
+        self.date = None
+        self.track = None
+        self.extra = None
+
+    @classmethod
+    def from_pairs(cls, pairs) -> 'Song':
+        song = cls(None)
+        extra = None
+        for k, v in pairs:
+            if k == 'Id':
+                song.id = int(v)
+            elif k == 'Pos':
+                song.pos = int(v)
+            elif k == 'duration':
+                song.duration = float(v)
+            elif k == 'Time':
+                # the old, rounded version of duration, which some servers send instead
+                if song.duration is None:
+                    song.duration = float(v)
+            elif k in cls._DROPPED:
+                continue
+            else:
+                if k in cls._INTERNED:
+                    v = sys.intern(v)
+                slot = cls._SLOTS.get(k)
+                if slot is None:
+                    if extra is None:
+                        extra = []
+                    extra.append((sys.intern(k), v))
+                elif getattr(song, slot) is None:
+                    setattr(song, slot, v)
+                else:
+                    # a tag with more than one value, e.g. several artists.
+                    setattr(song, slot, sys.intern(getattr(song, slot) + '; ' + v) if k in cls._INTERNED
+                            else getattr(song, slot) + '; ' + v)
+        if extra is not None:
+            song.extra = tuple(extra)
+        return song
+
+    def get_tag(self, key, default=None):
+        """Look up a tag by the name the server uses for it, e.g. 'Artist' or 'Composer'.
+        """
+        slot = self._SLOTS.get(key)
+        if slot is not None:
+            value = getattr(self, slot)
+            return default if value is None else value
+        for k, v in self.extra or ():
+            if k == key:
+                return v
+        return default
+
+    def __repr__(self):
+        return '<Song %r id=%r>' % (self.file, self.id)
 
 
 class MPDError(RuntimeError):
@@ -0,0 +1,1170 @@
+import asyncio
+import calendar
+import os
+import tempfile
+import time
+from unittest import TestCase
+from unittest.mock import AsyncMock, Mock, patch
+
+import fake_mpd
+import fake_ytdl
+from jukebox import youtube
+from jukebox.predict import Predictor
+from jukebox.screen import clock, mpd, numeric
+from jukebox.screen.library import LibraryBrowser
+from jukebox.screen.search import LibrarySearch
+from jukebox.state import PlayerState, QueueMirror, QueueWindow
+import my_aiompd
+from my_aiompd import Client
+
+
+class _Display:
+    """Just enough of jukebox.Display for a screen to draw on, without any hardware."""
+    def __init__(self, mpd_client=None):
+        self.mpd_client = mpd_client
+        self.lcd = Mock()
+        self.show_popup = Mock()
+        self.config = {'text scroll gap': 4, 'text scroll first time': 2, 'text scroll time': 0.5}
+        self.text = bytearray(b' ' * 128)
+        self.writes = []  # (column, text) for every write since the last clear
+        self.tasks = []
+        self.screen = None
+        self.screen_args = ()
+        self._loop = asyncio.get_event_loop()
+
+    def write(self, column, text):
+        if isinstance(text, str):
+            text = text.encode('ascii')
+        self.text[column:column + len(text)] = text
+        self.writes.append((column, bytes(text)))
+
+    def clear(self):
+        self.text = bytearray(b' ' * 128)
+        self.writes.clear()
+
+    def line(self, n):
+        return self.text[n * 64:n * 64 + 16].decode('ascii')
+
+    def call_later(self, delay, func, *args):
+        return self._loop.call_later(delay, func, *args)
+
+    def create_task(self, coro, *, persist=False):
+        task = self._loop.create_task(coro)
+        self.tasks.append(task)
+        return task
+
+    def switch_screen(self, screen, *args):
+        self.screen = screen
+        self.screen_args = args
+
+    async def settle(self):
+        """Wait for everything the screen has started to finish (or be cancelled)."""
+        while self.tasks:
+            task = self.tasks.pop(0)
+            await asyncio.wait([task])
+            if not task.cancelled():
+                task.result()
+
+
+class QueueMirrorTest(TestCase):
+    """QueueMirror against fake_mpd, with another client changing the queue underneath it."""
+    def setUp(self) -> None:
+        self.loop = asyncio.get_event_loop()
+        self.server = fake_mpd.FakeMPDServer(fake_mpd.FakeLibrary(artists=2, albums=2, tracks=5))
+        host, port = self.loop.run_until_complete(self.server.start())
+        self.client = Client(host, port)
+        self.other = Client(host, port)
+        self.mirror = QueueMirror(self.client)
+
+    def tearDown(self) -> None:
+        self.client.close()
+        self.other.close()
+        self.server.close()
+        self.loop.run_until_complete(asyncio.sleep(0))
+
+    async def _fill(self):
+        for directory in ('Artist 1/Album 0', 'Artist 1/Album 1'):
+            for uri in self.server.library.directories[directory][1]:
+                await self.other.send_command('add', uri)
+        await self.mirror.update(await self._version())
+
+    async def _version(self):
+        return int(dict(await self.other.send_command('status'))['playlist'])
+
+    async def _check(self):
+        """Update the mirror and compare it to what the server says is in the queue."""
+        await self.mirror.update(await self._version())
+        queue = [record async for record in self.other.stream_command('playlistinfo')]
+        self.assertEqual(len(self.mirror), len(queue))
+        self.assertEqual([self.mirror.id_at(pos) for pos in range(len(queue))], [int(r['Id']) for r in queue])
+        self.assertEqual([self.mirror[pos].file for pos in range(len(queue))], [r['file'] for r in queue])
+        self.assertEqual(set(self.mirror._songs), {int(r['Id']) for r in queue})
+
+    def test_changes(self):
+        async def run():
+            await self._fill()
+            songs = {self.mirror.id_at(pos): self.mirror[pos] for pos in range(len(self.mirror))}
+            await self.other.send_command('shuffle')
+            await self._check()
+            await self.other.send_command('delete', '2:4')
+            await self._check()
+            await self.other.send_command('move', '0:2', '5')
+            await self._check()
+            await self.other.send_command('move', '6', '1')
+            await self._check()
+            await self.other.send_command('deleteid', str(self.mirror.id_at(0)))
+            await self._check()
+            # all of that only moved songs that were already known, so none of them should have been fetched again
+            for pos in range(len(self.mirror)):
+                self.assertIs(self.mirror[pos], songs[self.mirror.id_at(pos)])
+            uri = self.server.library.directories['Artist 1/Album 0'][1][0]
+            await self.other.send_command('addid', uri, '3')
+            await self._check()
+            self.assertEqual(self.mirror[3].file, uri)
+            await self.other.send_command('clear')
+            await self._check()
+            self.assertIsNone(self.mirror.get(0))
+            await self.other.send_command('add', uri)
+            await self._check()
+        self.loop.run_until_complete(run())
+
+    def test_same_version_does_nothing(self):
+        async def run():
+            await self._fill()
+            received = self.server.commands_received
+            await self.mirror.update(self.mirror.version)
+            self.assertEqual(self.server.commands_received, received)
+        self.loop.run_until_complete(run())
+
+    def test_player_state(self):
+        async def run():
+            state = PlayerState(self.client)
+            changes = asyncio.Queue()
+            state.add_listener(changes.put_nowait)
+            state.start()
+            await state.wait_synced()
+            await changes.get()
+            for directory in ('Artist 1/Album 0', 'Artist 1/Album 1'):
+                for uri in self.server.library.directories[directory][1]:
+                    await self.other.send_command('add', uri)
+            await self.other.send_command('play', '4')
+            await self.other.send_command('shuffle')
+            await self.other.send_command('delete', '0')
+            while state.playlist_version != await self._version():
+                await changes.get()
+            if state.song_pos is not None:
+                self.assertEqual(state.queue.get(state.song_pos).id, state.current_song.id)
+                self.assertEqual(state.queue.id_at(state.song_pos), state.song_id)
+            self.assertEqual(len(state.queue), state.playlist_length)
+            state.stop()
+        self.loop.run_until_complete(run())
+
+    def test_player_state_retries(self):
+        async def run():
+            # nobody listening yet
+            self.server.close()
+            state = PlayerState(self.client)
+            state.start()
+            await asyncio.sleep(0.05)
+            self.assertFalse(state.synced)
+            await self.server.start(port=self.client._port)
+            await asyncio.wait_for(state.wait_synced(), 1)
+            # an error in the middle of a refresh doesn't stop it either
+            def fail_once(conn):
+                del self.server.cmd_currentsong
+                raise fake_mpd.CommandError(fake_mpd.ACK_ERROR_NO_EXIST, 'No such song')
+            self.server.cmd_currentsong = fail_once
+            changes = asyncio.Queue()
+            state.add_listener(changes.put_nowait)
+            await self.other.send_command('add', self.server.library.directories['Artist 1/Album 0'][1][0])
+            await asyncio.wait_for(changes.get(), 1)
+            self.assertEqual(state.playlist_length, 1)
+            self.assertEqual(state.queue[0].file, self.server.queue[0].song[0][1])
+            state.stop()
+        self.loop.run_until_complete(run())
+
+
+class QueueWindowTest(TestCase):
+    def setUp(self) -> None:
+        self.loop = asyncio.get_event_loop()
+        self.server = fake_mpd.FakeMPDServer(fake_mpd.FakeLibrary(artists=3, albums=2, tracks=5))
+        host, port = self.loop.run_until_complete(self.server.start())
+        self.client = Client(host, port)
+        self.window = QueueWindow(self.client)
+
+    def tearDown(self) -> None:
+        self.client.close()
+        self.server.close()
+        self.loop.run_until_complete(asyncio.sleep(0))
+
+    async def _fill(self):
+        for directory in ('Artist 1/Album 0', 'Artist 1/Album 1', 'Artist 2/Album 0', 'Artist 2/Album 1'):
+            for uri in self.server.library.directories[directory][1]:
+                await self.client.send_command('add', uri)
+
+    async def _update(self, song_pos, next_song_pos=None):
+        version = int(dict(await self.client.send_command('status'))['playlist'])
+        await self.window.update(version, song_pos, next_song_pos)
+
+    def _check(self, positions):
+        """Check that the window holds exactly `positions`, and that they're the songs the server has there."""
+        self.assertEqual(sorted(self.window._songs), list(positions))
+        for pos in positions:
+            self.assertEqual(self.window.get(pos).id, self.server.queue[pos].id)
+
+    def test_moving_window(self):
+        async def run():
+            await self._fill()
+            await self._update(0, 1)
+            self._check(range(0, 8))
+            received = self.server.commands_received
+            await self._update(5, 6)
+            self._check(range(0, 8))
+            # only the status was asked for, because both songs were already in the window
+            self.assertEqual(self.server.commands_received, received + 1)
+            # a window around each of them, overlapping
+            await self._update(7, 8)
+            self._check(range(5, 14))
+            await self._update(19)
+            self._check(range(17, 20))
+            # repeating, so the next song is back at the start: two separate ranges
+            await self._update(18, 0)
+            self._check([*range(0, 8), *range(16, 20)])
+            self.assertIsNone(self.window.get(10))
+            self.assertEqual(self.window.get_by_id(self.server.queue[17].id).id, self.server.queue[17].id)
+            self.assertIsNone(self.window.get_by_id(self.server.queue[10].id))
+        self.loop.run_until_complete(run())
+
+    def test_queue_changes(self):
+        async def run():
+            await self._fill()
+            await self._update(2, 3)
+            self._check(range(0, 9))
+            # the same positions, but a different queue version, so it has to be fetched again
+            await self.client.send_command('move', '1', '5')
+            await self._update(2, 3)
+            self._check(range(0, 9))
+            await self._update(14, 15)
+            self._check(range(12, 20))
+            # shrink the queue to below where the window was
+            await self.client.send_command('delete', '6:')
+            await self._update(4, 5)
+            self._check(range(2, 6))
+            await self.client.send_command('delete', '1:')
+            await self._update(0)
+            self._check([0])
+            await self.client.send_command('clear')
+            await self._update(None)
+            self._check([])
+            self.assertEqual(len(self.window), 0)
+        self.loop.run_until_complete(run())
+
+    def test_queue_shrinks_first(self):
+        async def run():
+            await self._fill()
+            await self._update(2, 3)
+            await self.client.send_command('move', '1', '5')
+            # the status says we're near the end, but the queue gets shorter before the window is asked for
+            version = int(dict(await self.client.send_command('status'))['playlist'])
+            await self.client.send_command('delete', '6:')
+            await self.window.update(version, 14, 15)
+            self.assertEqual(sorted(self.window._songs), list(range(0, 9)))
+            self.assertNotEqual(self.window.version, version)
+            # so the next update fetches it again
+            await self._update(4, 5)
+            self._check(range(2, 6))
+        self.loop.run_until_complete(run())
+
+
+class LibraryBrowserTest(TestCase):
+    def setUp(self) -> None:
+        self.loop = asyncio.get_event_loop()
+        # slow enough that the root listing is still arriving when the first page of it is shown
+        self.server = fake_mpd.FakeMPDServer(fake_mpd.FakeLibrary(artists=40, albums=2, tracks=3), chunk_size=256,
+                                             chunk_delay=0.002)
+        host, port = self.loop.run_until_complete(self.server.start())
+        self.client = Client(host, port)
+        self.display = _Display(self.client)
+        with patch('jukebox.screen.directory.Display', _Display):
+            self.screen = LibraryBrowser('Library', self.display, 'now playing')
+
+    def tearDown(self) -> None:
+        self.client.close()
+        self.server.close()
+        self.loop.run_until_complete(asyncio.sleep(0))
+
+    async def _visit(self, path=None):
+        self.screen.on_switched_to(path)
+        await self.display.settle()
+
+    def test_paging(self):
+        async def run():
+            self.screen.on_switched_to()
+            listing = self.screen._listing
+            self.assertEqual(self.display.line(1), 'Loading...'.ljust(16))
+            await self.screen._show_task
+            # shown as soon as the first page is in, long before the rest
+            self.assertEqual(self.display.line(1), 'Artist Unicode 0')
+            self.assertGreaterEqual(len(listing.entries), LibraryBrowser.page_size)
+            self.assertFalse(listing.complete)
+            await listing.wait_for(20)
+            self.assertGreater(len(listing.entries), 20)
+            self.screen.move(30)
+            await self.display.settle()
+            self.assertTrue(listing.complete)
+            self.assertEqual(self.display.line(1), 'Artist 30'.ljust(16))
+            # off the end stops at the last one
+            self.screen.move(100)
+            self.assertEqual(self.display.line(1), 'Artist 39'.ljust(16))
+            await listing.wait_for(100)
+            self.assertEqual(len(listing.entries), 40)
+        self.loop.run_until_complete(run())
+
+    def test_back(self):
+        async def run():
+            await self._visit()
+            self.screen.move(3)
+            self.screen.open_entry(self.screen.cursor)
+            self.assertEqual(self.display.screen_args, ('Artist 3',))
+            await self._visit('Artist 3')
+            self.assertEqual(self.display.line(1), 'Album 0'.ljust(16))
+            self.screen.move(-1)
+            self.assertEqual(self.display.line(1), 'Back'.ljust(16))
+            self.assertEqual(self.screen.back_name(), 'Library')
+            self.screen.open_entry(1)
+            await self._visit(*self.display.screen_args)
+            self.assertEqual(self.screen.back_name(), 'Artist 3')
+            self.screen.go_back()
+            self.assertEqual(self.display.screen_args, ('Artist 3',))
+            received = self.server.commands_received
+            await self._visit(*self.display.screen_args)
+            # the cursor is where we left it, and nothing had to be fetched again
+            self.assertEqual(self.screen.cursor, -1)
+            self.screen.go_back()
+            await self._visit(*self.display.screen_args)
+            self.assertEqual((self.screen.path, self.screen.cursor), ('', 3))
+            self.assertEqual(self.display.line(1), 'Artist 3'.ljust(16))
+            self.assertEqual(self.server.commands_received, received)
+            self.screen.go_back()
+            self.assertEqual((self.display.screen, self.display.screen_args), (None, ()))
+        self.loop.run_until_complete(run())
+
+    def test_open_before_arrival(self):
+        async def run():
+            self.screen.on_switched_to()
+            self.screen.open_entry(34)
+            # back to the same place rather than into anything
+            self.assertEqual((self.display.screen, self.display.screen_args), (self.screen, ('',)))
+            await self.display.settle()
+            self.screen.open_entry(34)
+            self.assertEqual(self.display.screen_args, ('Artist 34',))
+            await self._visit('Artist 34/Album 1')
+            self.screen.open_entry(2)
+            await self.display.settle()
+            self.assertEqual(self.display.screen, 'now playing')
+            self.assertEqual(self.server.queue[self.server.current].song[0][1],
+                             self.server.library.directories['Artist 34/Album 1'][1][2])
+        self.loop.run_until_complete(run())
+
+    def test_cache_size(self):
+        async def run():
+            # (Artist 7 is one of the non-ASCII ones)
+            for a in (1, 2, 3, 4, 5, 6, 8, 9, 10):
+                await self._visit('Artist %d' % a)
+            self.assertEqual(list(self.screen._listings), ['Artist %d' % a for a in (2, 3, 4, 5, 6, 8, 9, 10)])
+            received = self.server.commands_received
+            await self._visit('Artist 5')
+            self.assertEqual(self.server.commands_received, received)
+            await self._visit('Artist 1')
+            self.assertGreater(self.server.commands_received, received)
+            self.assertEqual(list(self.screen._listings)[-2:], ['Artist 5', 'Artist 1'])
+            self.assertNotIn('Artist 2', self.screen._listings)
+        self.loop.run_until_complete(run())
+
+    def test_max_entries(self):
+        async def run():
+            self.screen.max_entries = 10
+            # the one we're in is kept however big it is...
+            await self._visit()
+            self.assertEqual(len(self.screen._listings[''].entries), 40)
+            # ...but not once we've gone somewhere else
+            await self._visit('Artist 1')
+            await self._visit('Artist 2')
+            self.assertEqual(list(self.screen._listings), ['Artist 1', 'Artist 2'])
+            self.screen.max_entries = 42
+            await self._visit()
+            self.assertEqual(list(self.screen._listings), ['Artist 2', ''])
+        self.loop.run_until_complete(run())
+
+    def test_database_changes(self):
+        async def run():
+            changes = self.client.subscribe_idle('database')
+            await self._visit()
+            await self._visit('Artist 1')
+            self.server.library.add_song('Zzz/01 - New.flac', ('Title', 'New'))
+            self.server.notify('database')
+            await changes.get()
+            # everything is thrown away and fetched again
+            old = self.screen._listings['']
+            await self._visit()
+            self.assertEqual(list(self.screen._listings), [''])
+            self.assertIsNot(self.screen._listing, old)
+            self.screen.move(100)
+            self.assertEqual(self.display.line(1), 'Zzz'.ljust(16))
+            await self._visit('Zzz')
+            self.assertEqual(self.display.line(1), 'New'.ljust(16))
+            changes.close()
+        self.loop.run_until_complete(run())
+
+
+class LibrarySearchTest(TestCase):
+    def setUp(self) -> None:
+        self.loop = asyncio.get_event_loop()
+        self.server = fake_mpd.FakeMPDServer(fake_mpd.FakeLibrary(artists=3, albums=2, tracks=5))
+        host, port = self.loop.run_until_complete(self.server.start())
+        self.client = Client(host, port)
+        self.display = _Display(self.client)
+        self.screen = LibrarySearch(self.display, None, None)
+
+    def tearDown(self) -> None:
+        self.client.close()
+        self.server.close()
+        self.loop.run_until_complete(asyncio.sleep(0))
+
+    def test_scrolling_across_pages(self):
+        async def run():
+            self.screen.on_switched_to(b'track')
+            await self.display.settle()
+            self.assertEqual(self.display.line(0), 'Artist 1'.ljust(16))
+            self.screen.seek(13)
+            await self.display.settle()
+            # close enough to the end of the first page to start on the second
+            self.assertEqual(sorted(self.screen.results._pages), [0, 1])
+            self.screen.seek(100)
+            await self.display.settle()
+            self.assertEqual(self.screen.pos, 29)
+            self.assertEqual(self.screen.results.length, 30)
+        self.loop.run_until_complete(run())
+
+    def test_results_shrink(self):
+        async def run():
+            self.screen.on_switched_to(b'track')
+            await self.display.settle()
+            for song in self.server.library.songs[:20]:
+                self.server.library.remove_song(song[0][1])
+            # the second page is empty now, but the first was fetched while there were more than that
+            self.screen.seek(20)
+            await self.display.settle()
+            self.assertEqual(self.screen.pos, 15)
+            self.assertEqual(self.display.line(1), (await self.screen.results.get(15)).title[:16])
+            for song in list(self.server.library.songs):
+                self.server.library.remove_song(song[0][1])
+            self.screen.on_switched_to(b'track')
+            await self.display.settle()
+            self.assertEqual(self.display.line(0), 'No results'.ljust(16))
+        self.loop.run_until_complete(run())
+
+
+class YouTubeTest(TestCase):
+    """jukebox.youtube's worker processes, running fake_ytdl instead of yt-dlp."""
+    def setUp(self) -> None:
+        self.loop = asyncio.get_event_loop()
+        self.youtube = youtube.YouTube(max_workers=2, ytdl_class=fake_ytdl.FakeYoutubeDL)
+
+    def tearDown(self) -> None:
+        if self.youtube._executor is not None:
+            self.youtube._executor.shutdown(wait=True)
+        self.youtube.shutdown()
+
+    def test_search(self):
+        async def run():
+            results = self.youtube.search('cat videos')
+            first = await results.get(0)
+            self.assertEqual(first, {'id': 'cat-videos-0', 'url': 'https://www.youtube.com/watch?v=cat-videos-0',
+                                     'title': 'cat videos 0', 'uploader': 'Channel 0'})
+            self.assertEqual(len(results.entries), results.batch_size)
+            # the later batches carry on where the earlier ones left off, whichever worker they land on
+            self.assertEqual((await results.get(11))['title'], 'cat videos 11')
+            self.assertIsNone(await results.get(12))
+            self.assertTrue(results.complete)
+            self.assertEqual([entry['title'] for entry in results.entries],
+                             ['cat videos %d' % i for i in range(12)])
+        self.loop.run_until_complete(run())
+
+    def test_extract(self):
+        async def run():
+            info = await self.youtube.extract('https://www.youtube.com/watch?v=abc')
+            self.assertEqual(info['title'], 'Video abc')
+            self.assertGreater(youtube.stream_expiry(info['url']), time.time() + 3600)
+            self.assertEqual(youtube.mpd_uri(info), info['url'] + '#StreamName=Video%20abc')
+            with self.assertRaises(fake_ytdl.FakeDownloadError):
+                await self.youtube.extract('https://www.youtube.com/watch?v=gone')
+        self.loop.run_until_complete(run())
+
+    def test_stream_cache(self):
+        async def run():
+            streams = self.youtube.streams
+            url = 'https://www.youtube.com/watch?v=abc'
+            self.assertIsNone(streams.get_nowait('abc'))
+            # asking twice at once only looks it up once
+            first, second = await asyncio.gather(streams.resolve('abc', url), streams.resolve('abc', url))
+            self.assertIs(first, second)
+            self.assertIs(await streams.resolve('abc', url), first)
+            self.assertIs(streams.get_nowait('abc'), first)
+            self.assertEqual(streams._pending, {})
+            # not if it won't last long enough, though
+            self.assertIsNone(streams.get_nowait('abc', fresh_for=7 * 3600))
+            self.assertIsNot(await streams.resolve('abc', url, fresh_for=7 * 3600), first)
+            # or if it's about to expire
+            streams._store({'id': 'def', 'url': 'https://example.com/videoplayback?expire=%d' % (time.time() + 60)})
+            self.assertIsNone(streams.get_nowait('def'))
+            self.assertEqual((await streams.resolve('def', 'https://www.youtube.com/watch?v=def'))['id'], 'def')
+            with self.assertRaises(fake_ytdl.FakeDownloadError):
+                await streams.resolve('gone', 'https://www.youtube.com/watch?v=gone')
+            self.assertIsNone(streams.get_nowait('gone'))
+        self.loop.run_until_complete(run())
+
+    def test_stream_cache_cancel(self):
+        async def run():
+            streams = self.youtube.streams
+            task = streams.prefetch('abc', 'https://www.youtube.com/watch?v=abc')
+            self.assertIs(streams.prefetch('abc', 'https://www.youtube.com/watch?v=abc'), task)
+            waiting = asyncio.ensure_future(streams.resolve('abc', 'https://www.youtube.com/watch?v=abc'))
+            await asyncio.sleep(0)
+            streams.cancel('abc')
+            # whoever was waiting for it still wants it, so it gets looked up again
+            self.assertEqual((await waiting)['id'], 'abc')
+            self.assertTrue(task.cancelled())
+        self.loop.run_until_complete(run())
+
+
+class AudioCacheTest(TestCase):
+    def setUp(self) -> None:
+        self.loop = asyncio.get_event_loop()
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tempdir.name, 'youtube')
+        self.server = fake_mpd.FakeMPDServer(fake_mpd.FakeLibrary(artists=1, albums=1, tracks=1),
+                                             music_directory=self.tempdir.name, update_time=0.01)
+        host, port = self.loop.run_until_complete(self.server.start())
+        self.client = Client(host, port)
+        self.youtube = youtube.YouTube(max_workers=1, ytdl_class=fake_ytdl.FakeYoutubeDL)
+        self.ready = asyncio.Queue()
+
+    def tearDown(self) -> None:
+        if self.youtube._executor is not None:
+            self.youtube._executor.shutdown(wait=True)
+        self.youtube.shutdown()
+        self.client.close()
+        self.server.close()
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.tempdir.cleanup()
+
+    def _cache(self, max_bytes=10000, mpd_path='youtube'):
+        cache = youtube.AudioCache(self.youtube, self.client, self.directory, mpd_path, max_bytes)
+        cache.add_listener(lambda video_id, uri: self.ready.put_nowait((video_id, uri)))
+        return cache
+
+    def test_download(self):
+        async def run():
+            cache = self._cache()
+            cache.enqueue('abc', 'https://www.youtube.com/watch?v=abc')
+            cache.enqueue('gone', 'https://www.youtube.com/watch?v=gone')
+            cache.enqueue('def', 'https://www.youtube.com/watch?v=def')
+            self.assertIsNone(cache.get('abc'))
+            self.assertEqual(await self.ready.get(), ('abc', 'youtube/abc.opus'))
+            self.assertEqual(await self.ready.get(), ('def', 'youtube/def.opus'))
+            self.assertEqual(cache.get('abc'), 'youtube/abc.opus')
+            self.assertIsNone(cache.get('gone'))
+            self.assertEqual(cache.size, 2000)
+            # MPD has been told about them, so they can be played straight away
+            self.assertIn('youtube/def.opus', self.server.library.by_uri)
+            cache.close()
+            # and they're still there after a restart
+            cache = self._cache()
+            self.assertEqual(cache.get('def'), 'youtube/def.opus')
+            self.assertEqual(cache.size, 2000)
+            cache.close()
+        self.loop.run_until_complete(run())
+
+    def test_evict(self):
+        async def run():
+            cache = self._cache(max_bytes=2500)
+            for video_id in ('a', 'b'):
+                cache.enqueue(video_id, 'https://www.youtube.com/watch?v=' + video_id)
+                await self.ready.get()
+            # playing the first one again makes the second the one that was played longest ago
+            cache.get('a')
+            cache.enqueue('c', 'https://www.youtube.com/watch?v=c')
+            await self.ready.get()
+            self.assertEqual(sorted(os.listdir(self.directory)), ['a.opus', 'c.opus', 'index.json'])
+            self.assertIsNone(cache.get('b'))
+            self.assertEqual(cache.size, 2000)
+            self.assertNotIn('youtube/b.opus', self.server.library.by_uri)
+            cache.close()
+        self.loop.run_until_complete(run())
+
+    def test_evict_skips_queued(self):
+        async def run():
+            cache = self._cache(max_bytes=2500)
+            for video_id in ('a', 'b'):
+                cache.enqueue(video_id, 'https://www.youtube.com/watch?v=' + video_id)
+                await self.ready.get()
+            song_id = dict(await self.client.send_command('addid', 'youtube/a.opus'))['Id']
+            await self.client.send_command('playid', song_id)
+            cache.enqueue('c', 'https://www.youtube.com/watch?v=c')
+            await self.ready.get()
+            # the first one was played longest ago, but it's playing, so the second one goes instead
+            self.assertEqual(sorted(os.listdir(self.directory)), ['a.opus', 'c.opus', 'index.json'])
+            self.assertEqual(cache.get('a'), 'youtube/a.opus')
+            await self.client.send_command('deleteid', song_id)
+            cache.get('c')
+            cache.enqueue('d', 'https://www.youtube.com/watch?v=d')
+            await self.ready.get()
+            # and once it's gone from the queue, it can go
+            self.assertEqual(sorted(os.listdir(self.directory)), ['c.opus', 'd.opus', 'index.json'])
+            cache.close()
+        self.loop.run_until_complete(run())
+
+    def test_music_directory(self):
+        async def run():
+            # with no mpd_path, the cache is MPD's music directory itself
+            self.directory = self.tempdir.name
+            cache = self._cache(mpd_path='')
+            cache.enqueue('abc', 'https://www.youtube.com/watch?v=abc')
+            self.assertEqual(await self.ready.get(), ('abc', 'abc.opus'))
+            self.assertEqual(cache.get('abc'), 'abc.opus')
+            self.assertIn('abc.opus', self.server.library.by_uri)
+            cache.close()
+        self.loop.run_until_complete(run())
+
+
+class StreamRefresherTest(TestCase):
+    def setUp(self) -> None:
+        self.loop = asyncio.get_event_loop()
+        self.server = fake_mpd.FakeMPDServer(fake_mpd.FakeLibrary(artists=2, albums=1, tracks=5))
+        host, port = self.loop.run_until_complete(self.server.start())
+        self.client = Client(host, port)
+        self.youtube = youtube.YouTube(max_workers=1, ytdl_class=fake_ytdl.FakeYoutubeDL)
+        self.state = PlayerState(self.client)
+        self.refresher = youtube.StreamRefresher(self.client, self.youtube, self.state)
+        self.refresher.min_interval = 0.01
+
+    def tearDown(self) -> None:
+        self.refresher.stop()
+        self.state.stop()
+        if self.youtube._executor is not None:
+            self.youtube._executor.shutdown(wait=True)
+        self.youtube.shutdown()
+        self.client.close()
+        self.server.close()
+        self.loop.run_until_complete(asyncio.sleep(0))
+
+    async def _add_stream(self, video_id, pos, lifetime):
+        info = {'id': video_id, 'title': 'Video ' + video_id,
+                'url': 'https://rr1---sn-fake.googlevideo.com/videoplayback?expire=%d&id=%s'
+                       % (time.time() + lifetime, video_id)}
+        song_id = dict(await self.client.send_command('addid', youtube.mpd_uri(info), str(pos)))['Id']
+        self.refresher.track(song_id, video_id, 'https://www.youtube.com/watch?v=' + video_id, info)
+        return int(song_id), info
+
+    def test_expired_replaced_in_place(self):
+        async def run():
+            for uri in self.server.library.directories['Artist 1/Album 0'][1]:
+                await self.client.send_command('add', uri)
+            # about to expire, and not playing
+            old_id, old = await self._add_stream('soon', 1, 60)
+            # about to expire, but playing, so it has to be left alone
+            playing_id, playing = await self._add_stream('now', 4, 60)
+            # good for hours yet
+            fine_id, _ = await self._add_stream('later', 6, 6 * 3600)
+            await self.client.send_command('playid', str(playing_id))
+            files = [entry.song[0][1] for entry in self.server.queue]
+            self.state.start()
+            self.refresher.start()
+            # (done once the refresher has had the new ID back, not just when the server has swapped it)
+            for _ in range(200):
+                if old_id not in self.refresher._tracked:
+                    break
+                await asyncio.sleep(0.01)
+            queue = [(entry.id, entry.song[0][1]) for entry in self.server.queue]
+            self.assertEqual(len(queue), len(files))
+            new_id, new_uri = queue[1]
+            self.assertNotEqual(new_id, old_id)
+            self.assertNotEqual(new_uri, youtube.mpd_uri(old))
+            self.assertTrue(new_uri.endswith('#StreamName=Video%20soon'))
+            self.assertGreater(youtube.stream_expiry(new_uri), time.time() + 3600)
+            # everything else is where it was
+            self.assertEqual([file for pos, (_, file) in enumerate(queue) if pos != 1], files[:1] + files[2:])
+            self.assertEqual(queue[4][0], playing_id)
+            self.assertEqual(queue[6][0], fine_id)
+            self.assertEqual(sorted(self.refresher._tracked), sorted([new_id, playing_id, fine_id]))
+            self.assertEqual(self.server.current, 4)
+            # once it's finished playing, it's fair game
+            await self.client.send_command('next')
+            for _ in range(200):
+                if playing_id not in self.refresher._tracked:
+                    break
+                await asyncio.sleep(0.01)
+            self.assertNotEqual(self.server.queue[4].id, playing_id)
+            self.assertTrue(self.server.queue[4].song[0][1].endswith('#StreamName=Video%20now'))
+            self.assertNotEqual(self.server.queue[4].song[0][1], youtube.mpd_uri(playing))
+        self.loop.run_until_complete(run())
+
+    def test_connection_dropped(self):
+        async def run():
+            # Start the worker process before connecting, or it'd keep a copy of the server's end of the connection open
+            # after the server closes it.
+            await self.youtube.extract('warm-up')
+            for uri in self.server.library.directories['Artist 1/Album 0'][1]:
+                await self.client.send_command('add', uri)
+            old_id, old = await self._add_stream('soon', 1, 60)
+            drops = []
+            def drop(conn, song_id):
+                # the first time round, the connection goes before anything has been done
+                del self.server.cmd_deleteid
+                drops.append(song_id)
+                conn.transport.close()
+                raise fake_mpd.CommandError(fake_mpd.ACK_ERROR_NO_EXIST, 'gone')
+            self.server.cmd_deleteid = drop
+            self.state.start()
+            self.refresher.start()
+            for _ in range(200):
+                if old_id not in self.refresher._tracked:
+                    break
+                await asyncio.sleep(0.01)
+            self.assertEqual(drops, [str(old_id)])
+            self.assertFalse(self.refresher._task.done())
+            # and the next try went through
+            self.assertEqual(len(self.server.queue), 6)
+            self.assertNotEqual(self.server.queue[1].id, old_id)
+            self.assertTrue(self.server.queue[1].song[0][1].endswith('#StreamName=Video%20soon'))
+            self.assertEqual(list(self.refresher._tracked), [self.server.queue[1].id])
+        self.loop.run_until_complete(run())
+
+
+class PredictorTest(TestCase):
+    def setUp(self) -> None:
+        self.config = {}
+        self.predictor = Predictor(self.config, 'history')
+
+    def _guess(self, prefix, predictor=None):
+        predictor = predictor or self.predictor
+        return predictor.completion(predictor.lookup(prefix))
+
+    def test_repeated_prefix(self):
+        for _ in range(5):
+            self.predictor.remember('Pink')
+        self.predictor.remember('Pink Floyd')
+        # searched for five times, so it beats the longer one that starts with it, even at its own prefixes
+        self.assertEqual(self._guess(b'pi'), b'pink')
+        self.assertEqual(self._guess(b'pink'), b'pink')
+        self.assertEqual(self._guess(b'pink '), b'pink floyd')
+        for _ in range(5):
+            self.predictor.remember('pink floyd')
+        self.assertEqual(self._guess(b'pi'), b'pink floyd')
+        self.assertEqual(self._guess(b'pink'), b'pink floyd')
+        # and it all adds up the same way when it's rebuilt from the history
+        self.assertEqual(len(self.config['history']), 11)
+        rebuilt = Predictor(self.config, 'history')
+        self.assertEqual(self._guess(b'pi', rebuilt), b'pink floyd')
+        self.assertEqual(rebuilt.lookup(b'pink').weight, self.predictor.lookup(b'pink').weight)
+
+    def test_ties(self):
+        self.predictor.remember('abc')
+        self.predictor.remember('abd')
+        # the first one there keeps it...
+        self.assertEqual(self._guess(b'ab'), b'abc')
+        self.assertEqual(self._guess(b'abd'), b'abd')
+        self.predictor.remember('abc')
+        self.predictor.remember('abd')
+        self.assertEqual(self._guess(b'ab'), b'abc')
+        # ...until the other one is ahead
+        self.predictor.remember('abd')
+        self.assertEqual(self._guess(b'ab'), b'abd')
+        self.assertEqual(self._guess(b'a'), b'abd')
+
+    def test_library_words(self):
+        self.predictor.remember('queen')
+        for word in (b'queens of the stone age', b'quiet riot', b'quiet riot'):
+            self.predictor._add(word, 1)
+        # a search counts for more than several library words
+        self.assertEqual(self._guess(b'qu'), b'queen')
+        self.assertEqual(self._guess(b'qui'), b'quiet riot')
+        self.assertEqual(self.predictor.order(self.predictor.lookup(b'qu'), b'aeiou'), b'eiaou')
+        self.assertIsNone(self.predictor.lookup(b'qx'))
+        self.assertIsNone(self._guess(b'qx'))
+
+    def test_history_limit(self):
+        self.predictor.max_history = 3
+        for query in ('one', 'two', 'two', 'three'):
+            self.predictor.remember(query)
+        self.assertEqual(self.config['history'], ['two', 'two', 'three'])
+        self.assertIsNone(self.predictor.lookup(b'o'))
+        self.assertEqual(self.predictor.lookup(b't').weight, 3 * self.predictor.history_weight)
+        self.assertEqual(self._guess(b't'), b'two')
+
+    def test_normalise(self):
+        self.assertEqual(self.predictor.normalise('  Björk -  Jóga!! '), b'bjork joga')
+        self.predictor.remember('  ')
+        self.assertNotIn('history', self.config)
+
+
+class NumericInputTest(TestCase):
+    def setUp(self) -> None:
+        self.loop = asyncio.get_event_loop()
+        self.display = _Display()
+        self.value = 8
+        self.sent = []
+        # the knob's idea of the time, moved on by hand so that ticks are only fast when a test wants them to be
+        self.now = 1000.0
+        patcher = patch.object(numeric, 'time', Mock(monotonic=lambda: self.now))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _set(self, value):
+        self.sent.append(value)
+        self.value = value
+
+    def _screen(self):
+        screen = numeric.NumericInput(self.display, None, 'Thing', lambda: self.value, self._set, 0, 20)
+        self.loop.run_until_complete(screen.on_switched_to())
+        return screen
+
+    def _tick(self, screen, n, after=1.0):
+        self.now += after
+        screen.on_tick(n)
+
+    def test_clamping(self):
+        screen = self._screen()
+        self.assertEqual(self.display.text[12:16], b'   8')
+        self._tick(screen, 30)
+        self.assertEqual(screen.value, 20)
+        # the bar is full, and the number is shown straight away, before the setter has been called
+        self.assertEqual(self.display.text[64:80], b'\x04' * 16)
+        self.assertEqual(self.display.text[12:16], b'  20')
+        self._tick(screen, 1)
+        self._tick(screen, -50)
+        self.assertEqual(screen.value, 0)
+        self.assertEqual(self.display.text[64:80], b' ' * 16)
+        self._tick(screen, -1)
+        self.loop.run_until_complete(self.display.settle())
+        # it had got back down to 0 before the setter got a look in, so that's all it was called with
+        self.assertEqual(self.sent, [0])
+
+    def test_acceleration(self):
+        screen = self._screen()
+        self._tick(screen, 1)
+        self.assertEqual(screen.value, 9)
+        self._tick(screen, 1, after=0.01)
+        self.assertEqual(screen.value, 13)
+        self._tick(screen, -1, after=0.01)
+        self.assertEqual(screen.value, 9)
+        self._tick(screen, -1, after=0.5)
+        self.assertEqual(screen.value, 8)
+        self.loop.run_until_complete(self.display.settle())
+        self.assertEqual(self.value, 8)
+
+    def test_setter_fails(self):
+        def fail(value):
+            raise my_aiompd.MPDError('ACK [2@0] {setvol} nope')
+        screen = numeric.NumericInput(self.display, None, 'Thing', lambda: self.value, fail, 0, 20)
+        self.loop.run_until_complete(screen.on_switched_to())
+        self._tick(screen, 5)
+        self.assertEqual(screen.value, 13)
+        self.loop.run_until_complete(self.display.settle())
+        # put back to what it really is
+        self.assertEqual(screen.value, 8)
+        self.assertEqual(self.display.text[12:16], b'   8')
+
+
+class VolumeControlTest(TestCase):
+    def setUp(self) -> None:
+        self.loop = asyncio.get_event_loop()
+        self.server = fake_mpd.FakeMPDServer(latency=0.01)
+        self.address = self.loop.run_until_complete(self.server.start())
+        self.client = Client(*self.address)
+        self.display = _Display(self.client)
+        self.screen = numeric.VolumeControl(self.display, None)
+        self.setvols = []
+        setvol = self.server.cmd_setvol
+
+        def record_setvol(conn, value):
+            self.setvols.append(int(value))
+            return setvol(conn, value)
+        self.server.cmd_setvol = record_setvol
+
+    def tearDown(self) -> None:
+        self.client.close()
+        self.server.close()
+        self.loop.run_until_complete(asyncio.sleep(0))
+
+    async def _wait_for(self, condition):
+        for _ in range(200):
+            if condition():
+                return
+            await asyncio.sleep(0.01)
+        self.fail('timed out')
+
+    def test_coalescing(self):
+        async def run():
+            task = asyncio.ensure_future(self.screen.on_switched_to())
+            await self._wait_for(lambda: self.screen.value == 50)
+            # ten slow clicks (too far apart to speed up), but all before the first setvol has had an answer
+            with patch.object(numeric, 'time', Mock(monotonic=iter(range(100, 200)).__next__)):
+                for _ in range(10):
+                    self.screen.on_tick(1)
+                    await asyncio.sleep(0)
+            self.assertEqual(self.screen.value, 60)
+            await self.display.settle()
+            self.assertEqual(self.server.volume, 60)
+            # the first click's value, then wherever the knob had got to by the time that was done
+            self.assertEqual(self.setvols, [51, 60])
+            # the mixer events for our own changes don't make it jump back
+            await asyncio.sleep(0.1)
+            self.assertEqual(self.screen.value, 60)
+            # someone else changing it shows up
+            other = Client(*self.address)
+            await other.send_command('setvol', '25')
+            await self._wait_for(lambda: self.screen.value == 25)
+            self.assertEqual(self.display.text[12:16], b'  25')
+            other.close()
+            task.cancel()
+        self.loop.run_until_complete(run())
+
+
+class ClockTest(TestCase):
+    def setUp(self) -> None:
+        self.now = 0
+        # in UTC, so the times here don't depend on where the tests are run
+        patcher = patch.object(clock, 'time', Mock(time=lambda: self.now, localtime=time.gmtime,
+                                                   strftime=time.strftime))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.screens = []
+
+    def tearDown(self) -> None:
+        for screen in self.screens:
+            screen._update_callback.cancel()
+
+    def _set_time(self, hour, minute, second):
+        self.now = calendar.timegm((2026, 10, 19, hour, minute, second)) + 0.25
+
+    def _clock(self, **options):
+        display = _Display()
+        display.lcd.backlight_brightness = 0.5
+        screen = clock.Clock(display, None)
+        for name, value in options.items():
+            setattr(screen, name, value)
+        screen.on_switched_to()
+        self.screens.append(screen)
+        return screen, display
+
+    def _tick(self, screen, display):
+        """Move the clock on to self.now, and return the columns that were written to."""
+        display.writes.clear()
+        screen.show_time()
+        # and it should look just like a clock that was drawn from scratch at this time
+        self.assertEqual(display.text, self._clock(big_digits=screen.big_digits, seconds_shown=screen.seconds_shown,
+                                                   twenty_four_hour=screen.twenty_four_hour)[1].text)
+        return {column + i for column, text in display.writes for i in range(len(text))}
+
+    @staticmethod
+    def _digit(n, offset=0):
+        """The columns of big digit n (0 to 3, left to right), on both lines, when the first one starts at `offset`."""
+        start = offset + n * 3 + (n >= 2)
+        return {line + column for line in (0, 64) for column in range(start, start + 3)}
+
+    def _assert_redrawn(self, changed, digits, others=(), offset=0):
+        """Check that only `digits` (and the columns in `others`) were written to.  Not necessarily all of each digit,
+        since the parts a digit has in common with the one it replaces are left as they are.
+        """
+        allowed = set(others).union(*(self._digit(n, offset) for n in digits))
+        self.assertLessEqual(changed, allowed)
+        for n in digits:
+            self.assertTrue(changed & self._digit(n, offset), 'digit %d should have been redrawn' % n)
+        self.assertLessEqual(set(others), changed)
+
+    def test_minute(self):
+        self._set_time(12, 34, 58)
+        screen, display = self._clock()
+        self.assertEqual(bytes(display.text[14:16]) + bytes(display.text[78:80]), b'  PM')
+        self._set_time(12, 34, 59)
+        self.assertEqual(self._tick(screen, display), set())
+        self._set_time(12, 35, 0)
+        self._assert_redrawn(self._tick(screen, display), [3])
+        self._set_time(12, 40, 0)
+        self._assert_redrawn(self._tick(screen, display), [2, 3])
+
+    def test_twelve_to_one(self):
+        self._set_time(12, 59, 59)
+        screen, display = self._clock()
+        self.assertEqual(display.text[0:3], clock.BIG_DIGITS[1][0])
+        self._set_time(13, 0, 0)
+        # all four digits change (the 1 of 12 becoming a blank), but not the colon, or PM
+        self._assert_redrawn(self._tick(screen, display), [0, 1, 2, 3])
+        self.assertEqual(display.text[0:3], b'   ')
+        self.assertEqual(display.text[3:6], clock.BIG_DIGITS[1][0])
+        # and 11:59 to 12:00 is when AM turns into PM
+        self._set_time(11, 59, 0)
+        screen, display = self._clock()
+        self._set_time(12, 0, 0)
+        self._assert_redrawn(self._tick(screen, display), [1, 2, 3], others=[78])
+        self.assertEqual(bytes(display.text[78:80]), b'PM')
+
+    def test_24_hour(self):
+        self._set_time(23, 59, 59)
+        screen, display = self._clock(twenty_four_hour=True)
+        self._set_time(0, 0, 0)
+        self.now += 86400
+        changed = self._tick(screen, display)
+        # with nothing in the corner, it's centred, a column in from the left
+        self._assert_redrawn(changed, [0, 1, 2, 3], offset=1)
+        # the tops of a 9 and a 0 only differ in the middle
+        self.assertEqual(changed & self._digit(3, offset=1), {12, 75, 76, 77})
+
+    def test_seconds(self):
+        self._set_time(9, 15, 7)
+        screen, display = self._clock(seconds_shown=True)
+        self.assertEqual(bytes(display.text[14:16]), b'07')
+        self._set_time(9, 15, 8)
+        self.assertEqual(self._tick(screen, display), {15})
+        self._set_time(9, 15, 10)
+        self.assertEqual(self._tick(screen, display), {14, 15})
+
+    def test_small_digits(self):
+        self._set_time(9, 15, 7)
+        screen, display = self._clock(big_digits=False)
+        self.assertEqual(display.line(0), '    09:15 AM    ')
+        self._set_time(9, 16, 0)
+        self.assertEqual(self._tick(screen, display), {8})
+
+
+class TitleCacheTest(TestCase):
+    def setUp(self) -> None:
+        self.cache = mpd.TitleCache()
+        patcher = patch.object(mpd, 'song_title', wraps=mpd.song_title)
+        self.song_title = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def _song(song_id, title, file=None):
+        return my_aiompd.Song.from_pairs([('file', file or 'Artist/%d.flac' % song_id), ('Artist', 'Artist'),
+                                          ('Title', title), ('Id', str(song_id))])
+
+    def test_bounded(self):
+        songs = [self._song(i, 'Song %d' % i) for i in range(40)]
+        for song in songs[:32]:
+            self.cache.get(song)
+        # used again, so it's the most recent now
+        self.cache.get(songs[0])
+        for song in songs[32:]:
+            self.cache.get(song)
+        self.assertEqual(len(self.cache._titles), self.cache.max_size)
+        self.assertTrue(self.cache.has(songs[0]))
+        self.assertFalse(any(self.cache.has(song) for song in songs[1:9]))
+        self.assertTrue(all(self.cache.has(song) for song in songs[9:]))
+        self.assertEqual(self.song_title.call_count, 40)
+
+    def test_stream_title_changes(self):
+        url = 'http://radio.example.com/stream'
+        self.assertEqual(self.cache.get(self._song(5, 'First', url)), 'Artist - First')
+        # a fresh copy of the same entry with the same tags is as good as the one it was made from
+        self.assertTrue(self.cache.has(self._song(5, 'First', url)))
+        self.assertEqual(self.cache.get(self._song(5, 'First', url)), 'Artist - First')
+        self.assertEqual(self.song_title.call_count, 1)
+        # same ID, new title
+        changed = self._song(5, 'Second', url)
+        self.assertFalse(self.cache.has(changed))
+        self.assertEqual(self.cache.get(changed), 'Artist - Second')
+        self.assertEqual(self.song_title.call_count, 2)
+        self.assertEqual(len(self.cache._titles), 1)
+
+    def test_no_id(self):
+        song = my_aiompd.Song.from_pairs([('file', 'Artist/x.flac'), ('Title', 'X')])
+        self.assertEqual(self.cache.get(song), 'X')
+        self.assertEqual(len(self.cache._titles), 0)
+
+
+class NowPlayingTest(TestCase):
+    """NowPlaying's fast path for the next song, with the state filled in by hand rather than by a server."""
+    def setUp(self) -> None:
+        self.loop = asyncio.get_event_loop()
+        self.display = _Display(Mock(send_command=AsyncMock(return_value=[])))
+        self.state = self.display.player_state = PlayerState(None, self.loop, lazy_queue=True)
+        self.songs = [my_aiompd.Song.from_pairs([('file', 'Artist/%02d.flac' % i), ('Artist', 'Artist'),
+                                                 ('Title', 'Song %d' % i), ('duration', '200.000'),
+                                                 ('Pos', str(i)), ('Id', str(10 + i))])
+                      for i in range(3)]
+        self.state.queue._songs = dict(enumerate(self.songs))
+        self.screen = mpd.NowPlaying(self.display, None)
+
+    def tearDown(self) -> None:
+        for handle in (self.screen._update_timer_callback, self.screen._song_scroll_callback,
+                       self.screen._warm_callback):
+            if handle is not None:
+                handle.cancel()
+
+    def _set_status(self, pos, elapsed, next_pos=None):
+        next_pos = pos + 1 if next_pos is None else next_pos
+        self.state.status = {'state': 'play', 'song': str(pos), 'songid': str(10 + pos), 'elapsed': str(elapsed),
+                             'duration': '200.000', 'nextsong': str(next_pos), 'nextsongid': str(10 + next_pos),
+                             'random': '0', 'repeat': '0', 'playlist': '2', 'playlistlength': '3'}
+        self.state._status_time = time.monotonic()
+
+    def _show(self, pos, elapsed):
+        """Paint the screen for a status, and give it the chance to get the next song ready."""
+        self._set_status(pos, elapsed)
+        self.loop.run_until_complete(self.screen.on_status_change())
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.display.clear()
+
+    def test_near_the_end(self):
+        self._show(0, 199.5)
+        self.assertEqual(self.screen._next_frame, (11, '3:20', 'Artist - Song 1'))
+        self.screen._on_early_change(frozenset(['player']))
+        # the next song goes up without waiting for the status to say it's started
+        self.assertEqual(self.display.line(0), '\x00  0:00 / 3:20'.ljust(16))
+        self.assertEqual(self.display.line(1), 'Artist - Song 1'.center(16))
+        self.assertIsNone(self.screen._next_frame)
+        # and only once
+        self.display.clear()
+        self.screen._on_early_change(frozenset(['player']))
+        self.assertEqual(self.display.writes, [])
+
+    def test_not_near_the_end(self):
+        self._show(0, 100)
+        self.screen._on_early_change(frozenset(['player']))
+        self.assertEqual(self.display.writes, [])
+        # nor for anything but playback
+        self._set_status(0, 199.5)
+        self.screen._on_early_change(frozenset(['mixer', 'options']))
+        self.assertEqual(self.display.writes, [])
+        self.assertEqual(self.screen._next_frame[0], 11)
+
+    def test_stale_frame(self):
+        self._show(0, 199.5)
+        # the next song changed since the frame was made, and the status that says so hasn't been painted yet
+        self._set_status(0, 199.5, next_pos=2)
+        self.screen._on_early_change(frozenset(['player']))
+        self.assertEqual(self.display.writes, [])
+
+    def test_next_button(self):
+        self._show(0, 10)
+        painted = []
+        self.display.mpd_client.send_command.side_effect = lambda *args: painted.append(self.display.line(1))
+        self.loop.run_until_complete(self.screen.next())
+        self.display.mpd_client.send_command.assert_called_once_with('next')
+        # already up by the time the command went out
+        self.assertEqual(painted, ['Artist - Song 1'.center(16)])
+
+    def test_next_song_warmed(self):
+        with patch.object(mpd, 'song_title', wraps=mpd.song_title) as song_title:
+            self._show(0, 10)
+            # the current one to paint it, and the next one in the background afterwards
+            self.assertEqual([call.args[0] for call in song_title.call_args_list], self.songs[:2])
+            self.assertTrue(self.screen._titles.has(self.songs[1]))
+            song_title.reset_mock()
+            # so when it starts, only the one after it needs working out
+            self._show(1, 0)
+            self.assertEqual([call.args[0] for call in song_title.call_args_list], self.songs[2:])
+            self.assertEqual(self.screen._next_frame, (12, '3:20', 'Artist - Song 2'))
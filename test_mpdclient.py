@@ -0,0 +1,64 @@
+import asyncio
+import threading
+from unittest import TestCase
+
+import fake_mpd
+import mpdclient
+
+
+class SearchPagesTest(TestCase):
+    """The synchronous client against fake_mpd, which runs on an event loop in a thread of its own."""
+    def setUp(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.server = fake_mpd.FakeMPDServer(fake_mpd.FakeLibrary(artists=3, albums=2, tracks=5), loop=self.loop)
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+        host, port = self._on_server(self.server.start())
+        self.client = mpdclient.MPDClient(host, port)
+
+    def tearDown(self) -> None:
+        self.client.close()
+        self.loop.call_soon_threadsafe(self.server.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def _on_server(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def test_full_last_page(self):
+        everything = [song['file'] for song in self.client.search(('Title', '=~', '^track'), sort='Artist')]
+        self.assertEqual(len(everything), 30)
+        results = self.client.search_pages(('Title', '=~', '^track'), sort='Artist', page_size=15)
+        self.assertEqual(results.get(29)['file'], everything[29])
+        # a full last page doesn't say it's the last one, so it takes an empty one after it to find the end
+        self.assertIsNone(results.length)
+        sent = self.server.commands_received
+        self.assertEqual(results.page(2), [])
+        self.assertEqual(results.length, 30)
+        self.assertEqual(self.server.commands_received, sent + 1)
+        self.assertEqual(results.page(3), [])
+        self.assertIsNone(results.get(50))
+        self.assertEqual(self.server.commands_received, sent + 1)
+        self.assertEqual([song['file'] for song in results], everything)
+
+    def test_shrinks_between_pages(self):
+        results = self.client.search_pages(('Title', '=~', '^track'), sort='Artist', page_size=10)
+        first = results.page(0)
+
+        async def remove():
+            for song in self.server.library.songs[:16]:
+                self.server.library.remove_song(song[0][1])
+        self._on_server(remove())
+        # 14 left, so the third page is empty now, which only says the end is before it...
+        self.assertIsNone(results.get(25))
+        self.assertEqual(results.length, 20)
+        sent = self.server.commands_received
+        self.assertIsNone(results.get(22))
+        self.assertEqual(self.server.commands_received, sent)
+        # ...until the page it's really on is fetched
+        self.assertIsNone(results.get(19))
+        self.assertEqual(results.length, 14)
+        self.assertIsNotNone(results.get(13))
+        self.assertEqual(results.page(0), first)
+        self.assertEqual(len(list(results)), 14)
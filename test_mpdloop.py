@@ -0,0 +1,125 @@
+from unittest import TestCase
+
+import mpdloop
+
+
+class _Client:
+    def __init__(self):
+        self.pending_messages = {}
+
+
+class DispatchTest(TestCase):
+    def setUp(self) -> None:
+        self.loop = mpdloop.BaseMPDLoop()
+        self.loop.client = _Client()
+        self.calls = []
+
+    def _waiter(self, name, subsystems=('player',)):
+        return self.loop.add_subsystem_waiter(subsystems, lambda changed: self.calls.append(name))
+
+    def test_order(self):
+        self._waiter('a')
+        self._waiter('b', ('mixer', 'player'))
+        self._waiter('c', ('mixer',))
+        self.loop._dispatch({'player'})
+        self.assertEqual(self.calls, ['a', 'b'])
+        # each waiter only fires once
+        self.loop._dispatch({'player', 'mixer'})
+        self.assertEqual(self.calls, ['a', 'b', 'c'])
+        self.assertEqual(self.loop._refcounts, {})
+        self.assertEqual(self.loop._waiters, {})
+
+    def test_cancel_during_dispatch(self):
+        def first(changed):
+            self.calls.append('a')
+            self.loop.cancel(second)
+            self.loop.cancel(other)
+        self.loop.add_subsystem_waiter(['player'], first)
+        second = self._waiter('b')
+        other = self._waiter('c', ('mixer',))
+        self._waiter('d')
+        self.loop._dispatch({'player'})
+        self.assertEqual(self.calls, ['a', 'd'])
+        self.assertEqual(self.loop._refcounts, {})
+        # cancelling it again, after it's gone, does nothing
+        self.loop.cancel(second)
+        self.assertEqual(self.loop._refcounts, {})
+
+    def test_add_during_dispatch(self):
+        def first(changed):
+            self.calls.append('a')
+            self._waiter('again')
+        self.loop.add_subsystem_waiter(['player'], first)
+        self.loop._dispatch({'player'})
+        # the new waiter only hears about changes after it was added
+        self.assertEqual(self.calls, ['a'])
+        self.assertEqual(self.loop._refcounts, {'player': 1})
+        self.loop._dispatch({'player'})
+        self.assertEqual(self.calls, ['a', 'again'])
+
+    def test_channels(self):
+        self.loop.add_channel_waiter('one', lambda changed: self.calls.append('one'))
+        self.loop.add_channel_waiter('two', lambda changed: self.calls.append('two'))
+        self.loop.client.pending_messages = {'one': ['hello'], 'two': []}
+        self.loop._dispatch({'message'})
+        self.assertEqual(self.calls, ['one'])
+        self.assertEqual(self.loop._refcounts, {'message': 1})
+
+
+class TimerTest(TestCase):
+    def setUp(self) -> None:
+        # never connected, since nothing here waits on the server
+        self.loop = mpdloop.MPDLoop()
+        self.calls = []
+
+    def test_order(self):
+        self.loop.call_soon(0.02, self.calls.append, 'a')
+        self.loop.call_soon(0, self.calls.append, 'b')
+        self.loop.call_soon(0.01, self.calls.append, 'c')
+        self.loop.call_soon(0, self.calls.append, 'd')
+        self.loop.run()
+        self.assertEqual(self.calls, ['b', 'd', 'c', 'a'])
+
+    def test_scheduled_while_running(self):
+        def first():
+            self.calls.append('a')
+            self.loop.call_soon(0, self.calls.append, 'c')
+        self.loop.call_soon(0, first)
+        self.loop.call_soon(0, self.calls.append, 'b')
+        self.loop.run()
+        self.assertEqual(self.calls, ['a', 'b', 'c'])
+
+    def test_cancel_fired(self):
+        timer = self.loop.call_soon(0, self.calls.append, 'a')
+        self.loop.run()
+        self.loop.cancel(timer)
+        self.assertEqual(self.loop._cancelled_timers, 0)
+        # and from inside its own callback
+        timer = self.loop.call_soon(0, lambda: self.loop.cancel(timer))
+        self.loop.call_soon(0.01, self.calls.append, 'b')
+        self.loop.run()
+        self.assertEqual(self.calls, ['a', 'b'])
+        self.assertEqual(self.loop._cancelled_timers, 0)
+        self.assertEqual(self.loop._timers, [])
+
+    def test_cancel_and_reschedule(self):
+        timer = self.loop.call_soon(0.01, self.calls.append, 'a')
+        self.loop.cancel(timer)
+        self.loop.cancel(timer)
+        self.assertEqual(self.loop._cancelled_timers, 1)
+        self.loop.call_soon(0.01, self.calls.append, 'b')
+        self.loop.run()
+        self.assertEqual(self.calls, ['b'])
+        self.assertEqual(self.loop._cancelled_timers, 0)
+
+    def test_tombstones_cleared(self):
+        timers = [self.loop.call_soon(10, self.calls.append, i) for i in range(200)]
+        for timer in timers[:150]:
+            self.loop.cancel(timer)
+        self.assertLess(len(self.loop._timers), 200)
+        self.assertEqual(len(self.loop._timers) - self.loop._cancelled_timers, 50)
+        for timer in timers[150:]:
+            self.loop.cancel(timer)
+        self.loop.call_soon(0, self.calls.append, 'a')
+        self.loop.run()
+        self.assertEqual(self.calls, ['a'])
@@ -1,7 +1,11 @@
 import asyncio
+import unittest.mock
 from unittest import TestCase
 from unittest.mock import Mock
-from my_aiompd import Client
+import aio_mpdloop
+import fake_mpd
+import mpd_async
+from my_aiompd import Client, MPDError, RecordStream, Song
 
 
 class Test(TestCase):
@@ -15,6 +19,13 @@ class Test(TestCase):
         self.transport.write = write
         self.client.connection_made(self.transport)
         self.client.data_received(b'OK Testsuite 0.0\n')
+        self.reconnects = 0
+
+        async def reconnect():
+            # stand in for actually opening a socket when the client reconnects on its own.
+            self.reconnects += 1
+            self.client.connection_made(self.transport)
+        self.client.reconnect = reconnect
 
     def test_split_binary(self):
         def write(data):
@@ -86,6 +97,29 @@ class Test(TestCase):
 
         self.assertEqual(self.data, b'idle message\nnoidle\ndo_stuff\n')
 
+    def test_cancelled_idle(self):
+        """Nothing must be sent after a cancelled idle until the server has answered it, otherwise the answer goes to
+        the next command.
+        """
+        def write(data):
+            self.data += data
+            if data == b'do_stuff\n':
+                self.loop.call_soon(self.client.data_received, b'a:b\nOK\n')
+        self.transport.write = write
+
+        async def run():
+            idle = self.loop.create_task(self.client.idle('message'))
+            await asyncio.sleep(0)
+            idle.cancel()
+            command = self.loop.create_task(self.client.send_command('do_stuff'))
+            for _ in range(5):
+                await asyncio.sleep(0)
+            self.assertEqual(self.data, b'idle message\nnoidle\n')
+            self.client.data_received(b'OK\n')
+            self.assertEqual(await command, [('a', 'b')])
+        self.loop.run_until_complete(run())
+        self.assertEqual(self.data, b'idle message\nnoidle\ndo_stuff\n')
+
     def test_idle_lock(self):
         """Will fail if one coroutine repeatedly calling idle() will cause another coroutine not to be able to run.
         """
@@ -117,4 +151,499 @@ class Test(TestCase):
         self.assertEqual(results[0], [('thing', '1')])
         self.assertEqual(results[1], [('thing', '2')])
 
+    def test_command_list(self):
+        def write(data):
+            self.assertEqual(data, b'command_list_ok_begin\nstatus\nrepeat 1\ncurrentsong\ncommand_list_end\n')
+            self.loop.call_soon(self.client.data_received, b'state: play\nlist_OK\nlist_OK\nfile: a\nlist_OK\nOK\n')
+        self.transport.write = write
+        result = self.loop.run_until_complete(self.client.command_list('status', ('repeat', '1'), 'currentsong'))
+        self.assertEqual(result, [[('state', 'play')], [], [('file', 'a')]])
+
+    def test_stream_command(self):
+        def write(data):
+            self.assertEqual(data, b'lsinfo "some dir"\n')
+            self.loop.call_soon(self.client.data_received, b'directory: some dir/a\nLast-Modified: x\nfi')
+            self.loop.call_soon(self.client.data_received, b'le: some dir/b.flac\nTitle: B\nfile: some dir/c.flac\n')
+            self.loop.call_soon(self.client.data_received, b'Title: C\nOK\n')
+        self.transport.write = write
+
+        async def consume():
+            return [record async for record in self.client.stream_command('lsinfo', 'some dir')]
+        self.assertEqual(self.loop.run_until_complete(consume()), [
+            {'directory': 'some dir/a', 'Last-Modified': 'x'},
+            {'file': 'some dir/b.flac', 'Title': 'B'},
+            {'file': 'some dir/c.flac', 'Title': 'C'},
+        ])
+        self.assertFalse(self.client._lock.locked())
+
+    def test_stream_backpressure(self):
+        paused = []
+        self.transport.pause_reading = lambda: paused.append(True)
+        self.transport.resume_reading = lambda: paused.append(False)
+
+        def write(data):
+            self.loop.call_soon(self.client.data_received,
+                                b''.join(b'file: %d\n' % i for i in range(10)) + b'OK\n')
+        self.transport.write = write
+
+        async def consume():
+            stream = self.client.stream_command('playlistinfo')
+            first = await stream.__anext__()
+            # the whole response has arrived, so the lock should already be free even though we aren't done reading
+            await asyncio.sleep(0)
+            self.assertFalse(self.client._lock.locked())
+            return [first] + [record async for record in stream]
+        with unittest.mock.patch.object(RecordStream, 'high_water', 4), \
+                unittest.mock.patch.object(RecordStream, 'low_water', 2):
+            records = self.loop.run_until_complete(consume())
+        self.assertEqual([r['file'] for r in records], [str(i) for i in range(10)])
+        self.assertEqual(paused, [True, False])
+
+    def test_stream_error(self):
+        def write(data):
+            self.loop.call_soon(self.client.data_received,
+                                b'file: a\nfile: b\nACK [50@0] {lsinfo} No such directory\n')
+        self.transport.write = write
+
+        records = []
+        async def consume():
+            async for record in self.client.stream_command('lsinfo', 'nope'):
+                records.append(record)
+        with self.assertRaises(MPDError):
+            self.loop.run_until_complete(consume())
+        self.assertEqual(records, [{'file': 'a'}, {'file': 'b'}])
+
+    def _make_idle_client(self):
+        client = Client(dedicated_idle=True)
+        client.connection_made(self.transport)
+        client.data_received(b'OK Testsuite 0.0\n')
+        idle_transport = Mock('transport')
+        idle_data = []
+        def idle_write(data):
+            idle_data.append(data)
+            if data == b'noidle\n':
+                self.loop.call_soon(client._idler.data_received, b'OK\n')
+        idle_transport.write = idle_write
+        idle_transport.close = self.transport.close = lambda: None
+        client._idler = Client()
+        client._idler.connection_made(idle_transport)
+        client._idler.data_received(b'OK Testsuite 0.0\n')
+        return client, idle_data
+
+    def test_dedicated_idle(self):
+        client, idle_data = self._make_idle_client()
+
+        def write(data):
+            self.data += data
+            self.loop.call_soon(client.data_received, b'OK\n')
+        self.transport.write = write
+
+        async def run():
+            idle = self.loop.create_task(client.idle('player'))
+            await asyncio.sleep(0)
+            # a command shouldn't have to interrupt anything
+            await client.send_command('pause')
+            self.assertFalse(idle.done())
+            client._idler.data_received(b'changed: player\nOK\n')
+            self.assertEqual(await idle, ['player'])
+            # changes that happen in between calls to idle() are held onto until the next one
+            await asyncio.sleep(0)
+            client._idler.data_received(b'changed: player\nOK\n')
+            await asyncio.sleep(0)
+            self.assertEqual(await client.idle('player'), ['player'])
+            client.close()
+        self.loop.run_until_complete(run())
+        self.assertEqual(self.data, b'pause\n')
+        self.assertEqual(idle_data[:3], [b'idle player\n', b'idle player\n', b'idle player\n'])
+
+    def test_idle_call_subscriptions_dropped(self):
+        client, idle_data = self._make_idle_client()
+        client.idle_call_linger = 0.01
+
+        async def run():
+            idle = self.loop.create_task(client.idle('player'))
+            for _ in range(3):
+                await asyncio.sleep(0)
+            client._idler.data_received(b'changed: player\nOK\n')
+            self.assertEqual(await idle, ['player'])
+            # kept for a little while in case idle() is called again...
+            self.assertEqual(len(client._subscriptions), 1)
+            await asyncio.sleep(0.05)
+            # ...but not forever
+            self.assertEqual(client._subscriptions, set())
+            self.assertEqual(client._idle_call_subscriptions, {})
+            idle = self.loop.create_task(client.idle('mixer'))
+            await asyncio.sleep(0)
+            client.close()
+            self.assertEqual(client._subscriptions, set())
+            idle.cancel()
+        self.loop.run_until_complete(run())
+
+    def test_idle_subscriptions(self):
+        client, idle_data = self._make_idle_client()
+
+        async def run():
+            player = client.subscribe_idle('player')
+            await asyncio.sleep(0)
+            mixer = client.subscribe_idle('mixer', 'player')
+            # changing the subscriptions restarts the idle with the new set of subsystems
+            for _ in range(3):
+                await asyncio.sleep(0)
+            self.assertEqual(idle_data, [b'idle player\n', b'noidle\n', b'idle mixer player\n'])
+            client._idler.data_received(b'changed: mixer\nchanged: player\nOK\n')
+            self.assertEqual(await player.get(), ['player'])
+            self.assertEqual(await mixer.get(), ['mixer', 'player'])
+            # subscribing to a subset of what's already being watched doesn't need a new idle
+            with client.subscribe_idle('mixer') as mixer_only:
+                await asyncio.sleep(0)
+                client._idler.data_received(b'changed: mixer\nOK\n')
+                self.assertEqual(await mixer_only.get(), ['mixer'])
+            self.assertEqual(player.get_nowait(), [])
+            self.assertEqual(await mixer.get(), ['mixer'])
+            mixer.close()
+            for _ in range(3):
+                await asyncio.sleep(0)
+            self.assertEqual(idle_data[-2:], [b'noidle\n', b'idle player\n'])
+            client.close()
+        self.loop.run_until_complete(run())
+
+    def test_coalesce_reads(self):
+        def write(data):
+            self.data += data
+            self.loop.call_soon(self.client.data_received, b'state: play\nOK\n' if data == b'status\n' else b'OK\n')
+        self.transport.write = write
+
+        async def run():
+            first = await asyncio.gather(*(self.client.send_command('status') for _ in range(3)))
+            # a status asked for after a command that might have changed it has to be a fresh one
+            second = await asyncio.gather(self.client.send_command('status'), self.client.send_command('pause', '1'),
+                                          self.client.send_command('status'))
+            return first, second
+        first, second = self.loop.run_until_complete(run())
+        self.assertEqual(first, [[('state', 'play')]] * 3)
+        self.assertEqual(second, [[('state', 'play')], [], [('state', 'play')]])
+        self.assertEqual(self.data, b'status\npause 1\nstatus\n')
+
+    def test_cached_reads(self):
+        client, idle_data = self._make_idle_client()
+        client._cache_subscription = client.subscribe_idle('player', 'playlist')
+
+        def write(data):
+            self.data += data
+            self.loop.call_soon(client.data_received, b'file: a\nOK\n')
+        self.transport.write = write
+
+        async def run():
+            await asyncio.sleep(0)
+            self.assertEqual(await client.send_command('currentsong'), [('file', 'a')])
+            self.assertEqual(await client.send_command('currentsong'), [('file', 'a')])
+            self.assertEqual(self.data, b'currentsong\n')
+            client._idler.data_received(b'changed: player\nOK\n')
+            await asyncio.sleep(0)
+            self.assertEqual(await client.send_command('currentsong'), [('file', 'a')])
+            self.assertEqual(self.data, b'currentsong\ncurrentsong\n')
+            client.close()
+        self.loop.run_until_complete(run())
+
+    def test_stale_read_not_cached(self):
+        client, idle_data = self._make_idle_client()
+        client._cache_subscription = client.subscribe_idle('player', 'playlist')
+
+        def write(data):
+            self.data += data
+            self.loop.call_soon(client.data_received, b'file: a\nOK\n' if data.startswith(b'currentsong') else b'OK\n')
+        self.transport.write = write
+
+        async def run():
+            await asyncio.sleep(0)
+            # the answer to the first currentsong might be from before the play, so it mustn't be kept
+            first = self.loop.create_task(client.send_command('currentsong'))
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+            await client.send_command('play', '0')
+            await first
+            self.assertEqual(client._read_cache, {})
+            await client.send_command('currentsong')
+            self.assertEqual(self.data, b'currentsong\nplay 0\ncurrentsong\n')
+            # streamed reads are never shared with anyone, so they don't get tracked as sent
+            async for _ in client.stream_command('playlistinfo'):
+                pass
+            self.assertEqual(client._sent_reads, set())
+            client.close()
+        self.loop.run_until_complete(run())
+
+    def test_read_answered_with_event(self):
+        client, idle_data = self._make_idle_client()
+        client._cache_subscription = client.subscribe_idle('player', 'playlist')
+
+        def write(data):
+            self.data += data
+            if self.data.count(b'currentsong') > 1:
+                self.loop.call_soon(client.data_received, b'file: b\nOK\n')
+        self.transport.write = write
+
+        async def run():
+            await asyncio.sleep(0)
+            first = self.loop.create_task(client.send_command('currentsong'))
+            while not client._sent_reads:
+                await asyncio.sleep(0)
+            # The answer and an event that might make it out of date arrive together, and the idle loop hears about
+            # the event before the read is done.
+            client.data_received(b'file: a\nOK\n')
+            client._idler.data_received(b'changed: player\nOK\n')
+            await asyncio.sleep(0)
+            self.assertEqual(client._in_flight, {})
+            self.assertEqual(await first, [('file', 'a')])
+            self.assertEqual(client._read_cache, {})
+            self.assertEqual(await client.send_command('currentsong'), [('file', 'b')])
+            self.assertEqual(self.data, b'currentsong\ncurrentsong\n')
+            client.close()
+        self.loop.run_until_complete(run())
+
+    def test_replay_after_connection_lost(self):
+        def write(data):
+            self.data += data
+            if self.data == b'status\n':
+                # drop the connection halfway through the response
+                self.client.data_received(b'volume: 5')
+                self.loop.call_soon(self.client.connection_lost, None)
+            else:
+                self.loop.call_soon(self.client.data_received, b'OK Testsuite 0.0\nvolume: 50\nOK\n')
+        self.transport.write = write
+
+        result = self.loop.run_until_complete(self.client.send_command('status'))
+        self.assertEqual(result, [('volume', '50')])
+        self.assertEqual(self.data, b'status\nstatus\n')
+        self.assertEqual(self.reconnects, 1)
+
+    def test_no_replay_after_connection_lost(self):
+        def write(data):
+            self.data += data
+            self.client.data_received(b'binary: 5\nab')
+            self.loop.call_soon(self.client.connection_lost, None)
+        self.transport.write = write
+
+        with self.assertRaises(ConnectionResetError):
+            self.loop.run_until_complete(self.client.send_command('next'))
+        # let the background reconnection happen
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertEqual(self.reconnects, 1)
+        self.assertIsNone(self.client._binary_length)
+
+        def write(data):
+            self.loop.call_soon(self.client.data_received, b'OK Testsuite 0.0\nOK\n')
+        self.transport.write = write
+        self.assertEqual(self.loop.run_until_complete(self.client.send_command('next')), [])
+
+    def test_song_from_pairs(self):
+        pairs = [('file', 'a/b.flac'), ('Last-Modified', '2020-01-01T00:00:00Z'), ('Artist', 'Someone'),
+                 ('Artist', 'Someone Else'), ('Album', ''.join(['Al', 'bum'])), ('Composer', 'X'),
+                 ('duration', '12.5'), ('Pos', '3'), ('Id', '42')]
+        song = Song.from_pairs(pairs)
+        self.assertEqual(song.file, 'a/b.flac')
+        self.assertEqual(song.artist, 'Someone; Someone Else')
+        self.assertEqual((song.pos, song.id, song.duration), (3, 42, 12.5))
+        self.assertEqual(song.get_tag('Composer'), 'X')
+        self.assertIsNone(song.get_tag('Title'))
+        # the same album name from two different songs should be the same object
+        self.assertIs(song.album, Song.from_pairs([('file', 'c'), ('Album', ''.join(['Alb', 'um']))]).album)
+
+
+class EndToEndTest(TestCase):
+    """The client against fake_mpd's stand-in server, over a real socket."""
+    def setUp(self) -> None:
+        self.loop = asyncio.get_event_loop()
+        self.server = fake_mpd.FakeMPDServer(fake_mpd.FakeLibrary(artists=3, albums=2, tracks=5))
+        host, port = self.loop.run_until_complete(self.server.start())
+        self.client = Client(host, port)
+
+    def tearDown(self) -> None:
+        self.client.close()
+        self.server.close()
+        self.loop.run_until_complete(asyncio.sleep(0))
+
+    def test_queue_and_playback(self):
+        async def run():
+            uris = self.server.library.directories['Artist 1/Album 0'][1]
+            ids = [int(dict(await self.client.send_command('addid', uri))['Id']) for uri in uris]
+            await self.client.send_command('playid', str(ids[2]))
+            status = dict(await self.client.send_command('status'))
+            self.assertEqual(status['state'], 'play')
+            self.assertEqual(status['song'], '2')
+            self.assertEqual(status['nextsongid'], str(ids[3]))
+            version = status['playlist']
+            await self.client.send_command('deleteid', str(ids[0]))
+            changes = await self.client.send_command('plchangesposid', version)
+            self.assertEqual(changes, [('cpos', str(pos)) if k == 'cpos' else ('Id', str(song_id))
+                                       for pos, song_id in enumerate(ids[1:]) for k in ('cpos', 'Id')])
+            with self.assertRaises(MPDError):
+                await self.client.send_command('playid', '12345')
+        self.loop.run_until_complete(run())
+
+    def test_stream_lsinfo(self):
+        async def run():
+            records = [record async for record in self.client.stream_command('lsinfo', 'Artïst Ünïcødé 0/Album 1')]
+            self.assertEqual(len(records), 5)
+            self.assertEqual(records[0]['Artist'], 'Artïst Ünïcødé 0')
+            directories = [record async for record in self.client.stream_command('lsinfo')]
+            self.assertEqual([record['directory'] for record in directories],
+                             ['Artïst Ünïcødé 0', 'Artist 1', 'Artist 2'])
+        self.loop.run_until_complete(run())
+
+    def test_idle_events(self):
+        async def run():
+            other = Client(*self.client_address())
+            with self.client.subscribe_idle('mixer', 'options') as changes:
+                await self.client.send_command('status')
+                await other.send_command('setvol', '20')
+                self.assertEqual(set(await asyncio.wait_for(changes.get(), 1)), {'mixer'})
+                await other.send_command('random', '1')
+                self.assertEqual(set(await asyncio.wait_for(changes.get(), 1)), {'options'})
+            other.close()
+        self.loop.run_until_complete(run())
+
+    def test_split_and_slow_responses(self):
+        self.server.latency = 0.01
+        self.server.chunk_size = 3
+        async def run():
+            song = self.server.library.songs[0][0][1]
+            response = dict(await self.client.send_command('albumart', song, '0'))
+            self.assertEqual(response['binary'], self.server.picture)
+            responses = await self.client.command_list('ping', ('lsinfo', song), 'status')
+            self.assertEqual(dict(responses[1])['file'], song)
+        self.loop.run_until_complete(run())
+
+    def test_reconnect(self):
+        async def run():
+            await self.client.send_command('ping')
+            self.server.disconnect_all()
+            await asyncio.sleep(0.05)
+            self.assertEqual(dict(await self.client.send_command('status'))['state'], 'stop')
+        self.loop.run_until_complete(run())
+
+    def test_paged_search(self):
+        async def run():
+            # 3 artists * 2 albums * 5 tracks, 12 of which are track 1 or 5 of something
+            results = self.client.search(('Title', '=~', '^track [15] '), sort='-Artist', page_size=5)
+            first = await results.page(0)
+            self.assertEqual(len(first), 5)
+            self.assertEqual(first[0].artist, 'Artïst Ünïcødé 0')
+            self.assertIsNone(results.length)
+            self.assertEqual(await results.count(), 12)
+            self.assertEqual(len(await results.page(2)), 2)
+            self.assertEqual(await results.page(3), [])
+            self.assertEqual(len([song async for song in results]), 12)
+            sent = self.server.commands_received
+            await results.get(11)
+            self.assertEqual(self.server.commands_received, sent, 'pages should only be fetched once')
+            self.assertEqual(await self.client.count(group='Artist', Album='Album 1'),
+                             {artist: (5, unittest.mock.ANY) for artist in ('Artist 1', 'Artist 2', 'Artïst Ünïcødé 0')})
+        self.loop.run_until_complete(run())
+
+    def test_search_window_boundary(self):
+        async def run():
+            everything = [record['file'] async for record in self.client.stream_command('search', '(Title =~ "^track")',
+                                                                                         'sort', 'Artist')]
+            self.assertEqual(len(everything), 30)
+            results = self.client.search(('Title', '=~', '^track'), sort='Artist', page_size=10)
+            sent = self.server.commands_received
+            self.assertEqual((await results.get(9)).file, everything[9])
+            self.assertEqual(self.server.commands_received, sent + 1)
+            # the first one on the next page needs the next window, and only that
+            self.assertEqual((await results.get(10)).file, everything[10])
+            self.assertEqual(self.server.commands_received, sent + 2)
+            self.assertEqual(sorted(results._pages), [0, 1])
+            self.assertEqual((await results.get(29)).file, everything[29])
+            # a full last page doesn't say it's the last one, so it takes an empty one after it to find the end
+            self.assertIsNone(results.length)
+            self.assertIsNone(await results.get(30))
+            self.assertEqual(results.length, 30)
+            sent = self.server.commands_received
+            self.assertIsNone(await results.get(45))
+            self.assertEqual(self.server.commands_received, sent)
+            self.assertEqual([song.file async for song in results], everything)
+        self.loop.run_until_complete(run())
+
+    def test_search_shrinks_between_pages(self):
+        async def run():
+            results = self.client.search(('Title', '=~', '^track'), sort='Artist', page_size=10)
+            first = await results.page(0)
+            for song in self.server.library.songs[:16]:
+                self.server.library.remove_song(song[0][1])
+            # 14 left, so the third page is empty now, which only says the end is before it...
+            self.assertIsNone(await results.get(25))
+            self.assertEqual(results.length, 20)
+            sent = self.server.commands_received
+            self.assertIsNone(await results.get(22))
+            self.assertEqual(self.server.commands_received, sent)
+            # ...until the page it's really on is fetched
+            self.assertIsNone(await results.get(19))
+            self.assertEqual(results.length, 14)
+            self.assertIsNotNone(await results.get(13))
+            # the first page was fetched before they went, and is kept as it was
+            self.assertEqual(await results.page(0), first)
+            self.assertEqual(len([song async for song in results]), 14)
+        self.loop.run_until_complete(run())
+
+    def test_search_escaping(self):
+        title = 'say "hi" \\ (bye) \''
+        self.server.library.songs.append([('file', 'odd.flac'), ('Title', title), ('Time', '1')])
+        async def run():
+            results = self.client.search(Title=title, exact=True)
+            self.assertEqual([song.title async for song in results], [title])
+            self.assertEqual(await self.client.count(('Title', 'contains', '"hi" \\')), (1, 1))
+        self.loop.run_until_complete(run())
+
+    def test_channel_messages(self):
+        async def run():
+            other = Client(*self.client_address())
+            remote = await self.client.subscribe_channel('remote')
+            bounded = await self.client.subscribe_channel('remote', maxlen=3, drop='newest')
+            for i in range(10):
+                await other.send_command('sendmessage', 'remote', str(i))
+            await asyncio.sleep(0.1)
+            # everything that arrived while nobody was looking comes out in one go
+            self.assertEqual(await asyncio.wait_for(remote.get(), 1), [str(i) for i in range(10)])
+            self.assertEqual(list(bounded.messages), ['0', '1', '2'])
+            self.assertEqual(bounded.dropped, 7)
+            bounded.close()
+
+            # the subscription survives the connection being dropped
+            self.server.disconnect_all()
+            await asyncio.sleep(0.1)
+            await other.send_command('sendmessage', 'remote', 'back')
+            self.assertEqual(await asyncio.wait_for(remote.__anext__(), 1), 'back')
+            remote.close()
+            await asyncio.sleep(0.05)
+            self.assertEqual(await other.send_command('channels'), [])
+            other.close()
+        self.loop.run_until_complete(run())
+
+    def test_mpd_async_on_asyncio(self):
+        mpd_loop = aio_mpdloop.AsyncioMPDLoop(self.client)
+
+        async def listen():
+            await mpd_loop.client.subscribe('remote')
+            await mpd_async.sleep(0.01)
+            changed = await mpd_async.wait_for_events(['mixer'])
+            messages = []
+            async for message in mpd_async.ChannelMessages('remote'):
+                messages.append(message)
+                if len(messages) == 2:
+                    return changed, messages
+
+        async def run():
+            other = Client(*self.client_address())
+            task = asyncio.ensure_future(mpd_loop.run_coroutine(listen()))
+            await asyncio.sleep(0.1)
+            await other.send_command('setvol', '20')
+            await asyncio.sleep(0.1)
+            await other.send_command('sendmessage', 'remote', 'play')
+            await other.send_command('sendmessage', 'remote', 'next')
+            self.assertEqual(await asyncio.wait_for(task, 1), (['mixer'], ['play', 'next']))
+            other.close()
+            mpd_loop.close()
+        self.loop.run_until_complete(run())
 
+    def client_address(self):
+        return self.client._host, self.client._port